@@ -0,0 +1,103 @@
+import hmac
+import os
+from typing import Optional
+from fastapi import Header, HTTPException
+
+# Rutas /api/admin/*: requieren "Authorization: Bearer <ADMIN_TOKEN>"; sin token
+# configurado quedan desactivadas.
+ADMIN_TOKEN = os.getenv('ADMIN_TOKEN', '')
+
+# Claves que escriben los workers (worker/accounting.py y worker/storage.py).
+USAGE_ENGINES_KEY = 'usage:engines'
+USAGE_PEAK_KEY = 'usage:peak_mb'
+PRIORITIES = ('prioritaria', 'normal')
+USAGE_FIELDS = {
+    'u_eng': 'engine',
+    'u_pt': 'prefill_tokens',
+    'u_dt': 'decode_tokens',
+    'u_gpu': 'gpu_seconds',
+    'u_cpu': 'cpu_seconds',
+    'u_wall': 'wall_seconds',
+    'u_mem': 'peak_mb',
+    'u_usd': 'cost_usd',
+}
+PER_IMAGE_FIELDS = ('prefill_tokens', 'decode_tokens', 'gpu_seconds', 'cpu_seconds', 'wall_seconds', 'cost_usd')
+
+
+def require_admin(authorization: Optional[str] = Header(None)):
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="API de administración desactivada (ADMIN_TOKEN)")
+    scheme, _, token = (authorization or '').partition(' ')
+    if scheme.lower() != 'bearer' or not hmac.compare_digest(token.strip().encode(), ADMIN_TOKEN.encode()):
+        raise HTTPException(status_code=401, detail="Token de administración no válido",
+                            headers={"WWW-Authenticate": "Bearer"})
+
+
+def rollup_key(engine: str, priority: str) -> str:
+    return f"usage:{engine}:{priority}"
+
+
+def _number(value):
+    number = float(value)
+    return int(number) if number == int(number) else number
+
+
+def summarize(totals: dict, peak_mb: Optional[float]) -> dict:
+    # Coste por imagen entregada: lo gastado en copias descartadas (hedging) se reparte
+    # entre los resultados que sí se guardaron.
+    summary = {field: _number(value) for field, value in totals.items()}
+    delivered = summary.get('tasks', 0) - summary.get('discarded', 0)
+    if delivered > 0:
+        summary['per_image'] = {field: summary[field] / delivered for field in PER_IMAGE_FIELDS if field in summary}
+    if peak_mb is not None:
+        summary['peak_mb'] = peak_mb
+    return summary
+
+
+def usage_report(redis_conn) -> dict:
+    engines = sorted(redis_conn.smembers(USAGE_ENGINES_KEY))
+    pipe = redis_conn.pipeline(transaction=False)
+    for engine in engines:
+        for priority in PRIORITIES:
+            pipe.hgetall(rollup_key(engine, priority))
+    pipe.zrange(USAGE_PEAK_KEY, 0, -1, withscores=True)
+    replies = pipe.execute()
+    peaks = dict(replies[-1])
+
+    report = {}
+    for index, engine in enumerate(engines):
+        combined = {}
+        by_priority = {}
+        for offset, priority in enumerate(PRIORITIES):
+            totals = replies[index * len(PRIORITIES) + offset]
+            if not totals:
+                continue
+            by_priority[priority] = summarize(totals, peaks.get(f"{engine}:{priority}"))
+            for field, value in totals.items():
+                combined[field] = combined.get(field, 0) + float(value)
+        engine_peaks = [peaks[f"{engine}:{p}"] for p in PRIORITIES if f"{engine}:{p}" in peaks]
+        report[engine] = {'total': summarize(combined, max(engine_peaks) if engine_peaks else None),
+                          **by_priority}
+    return report
+
+
+def reset_usage(redis_conn):
+    engines = redis_conn.smembers(USAGE_ENGINES_KEY)
+    # DEL de una clave por llamada: en Cluster cada agregado puede estar en otro slot.
+    pipe = redis_conn.pipeline(transaction=False)
+    for engine in engines:
+        for priority in PRIORITIES:
+            pipe.delete(rollup_key(engine, priority))
+    pipe.delete(USAGE_PEAK_KEY)
+    pipe.delete(USAGE_ENGINES_KEY)
+    pipe.execute()
+
+
+def task_usage(fields: dict) -> Optional[dict]:
+    usage = {key: fields[field] if key == 'engine' else _number(fields[field])
+             for field, key in USAGE_FIELDS.items() if field in fields}
+    if not usage:
+        return None
+    if fields.get('model'):
+        usage['model'] = fields['model']
+    return usage
@@ -0,0 +1,116 @@
+import hashlib
+import hmac
+import math
+import os
+import time
+from typing import Optional, Tuple
+
+RATE_LIMIT_PER_MINUTE = float(os.getenv('RATE_LIMIT_PER_MINUTE', 30))
+RATE_LIMIT_BURST = int(os.getenv('RATE_LIMIT_BURST', 10))
+ADMISSION_MAX_WAIT = float(os.getenv('ADMISSION_MAX_WAIT', 120))
+# Fracción de la espera máxima reservada a la cola prioritaria: las tareas
+# normales se rechazan antes para que las prioritarias sigan entrando.
+ADMISSION_PRIORITY_RESERVE = float(os.getenv('ADMISSION_PRIORITY_RESERVE', 0.25))
+# Claves de API válidas (separadas por comas). Sólo ellas tienen bucket propio: una
+# clave desconocida cuenta como su IP, para que inventar claves no salte el límite.
+API_KEYS = [key.strip() for key in os.getenv('API_KEYS', '').split(',') if key.strip()]
+
+# Token bucket por cliente. KEYS: bucket. ARGV: tokens/s, ráfaga, ahora, coste.
+TOKEN_BUCKET_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local cost = tonumber(ARGV[4])
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or burst
+local ts = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - ts) * rate)
+local allowed = 0
+local retry_after = 0
+if tokens >= cost then
+    tokens = tokens - cost
+    allowed = 1
+else
+    retry_after = (cost - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 1)
+return {allowed, tostring(retry_after)}
+"""
+
+STATS_KEY = 'stats:admission'
+
+_token_bucket_script = None
+
+
+class AdmissionRejected(Exception):
+    # retry_after=None: la solicitud no se admitirá nunca, esperar no sirve.
+    def __init__(self, status_code: int, detail: str, retry_after: Optional[float]):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+        self.retry_after = max(1, math.ceil(retry_after)) if retry_after is not None else None
+
+
+def max_request_cost(limit: int) -> int:
+    # Imágenes que caben en una solicitud: con límite de tasa, nunca más que la ráfaga.
+    return min(limit, RATE_LIMIT_BURST) if RATE_LIMIT_PER_MINUTE > 0 else limit
+
+
+def valid_api_key(api_key: Optional[str], valid_keys=None) -> bool:
+    valid_keys = API_KEYS if valid_keys is None else valid_keys
+    if not api_key:
+        return False
+    return any(hmac.compare_digest(api_key.encode('utf-8'), key.encode('utf-8')) for key in valid_keys)
+
+
+def client_id(api_key: Optional[str], forwarded_for: Optional[str], host: Optional[str], valid_keys=None) -> str:
+    if valid_api_key(api_key, valid_keys):
+        return 'key:' + hashlib.sha256(api_key.encode('utf-8')).hexdigest()[:16]
+    # La última entrada de X-Forwarded-For es la que añade Traefik; las anteriores
+    # las puede escribir el propio cliente.
+    if forwarded_for:
+        return 'ip:' + forwarded_for.split(',')[-1].strip()
+    return 'ip:' + (host or 'desconocido')
+
+
+def take_tokens(redis_conn, client: str, cost: int = 1) -> Tuple[bool, float]:
+    global _token_bucket_script
+    if _token_bucket_script is None:
+        _token_bucket_script = redis_conn.register_script(TOKEN_BUCKET_SCRIPT)
+    allowed, retry_after = _token_bucket_script(
+        keys=[f"ratelimit:{client}"],
+        args=[RATE_LIMIT_PER_MINUTE / 60, RATE_LIMIT_BURST, time.time(), cost],
+        client=redis_conn
+    )
+    return allowed == 1, float(retry_after)
+
+
+def _check(redis_conn, router, client: str, priority: bool, queues, cost: int):
+    if RATE_LIMIT_PER_MINUTE > 0:
+        # La capacidad del bucket es fija: un lote mayor que la ráfaga no cabe nunca.
+        if cost > RATE_LIMIT_BURST:
+            raise AdmissionRejected(413, f"Máximo {RATE_LIMIT_BURST} imágenes por solicitud", None)
+        allowed, retry_after = take_tokens(redis_conn, client, cost)
+        if not allowed:
+            raise AdmissionRejected(429, "Demasiadas solicitudes, inténtalo más tarde", retry_after)
+
+    if ADMISSION_MAX_WAIT <= 0:
+        return
+    wait = router.estimated_wait(queues)
+    if wait is None:
+        return
+    limit = ADMISSION_MAX_WAIT if priority else ADMISSION_MAX_WAIT * (1 - ADMISSION_PRIORITY_RESERVE)
+    if wait > limit:
+        raise AdmissionRejected(503, f"Servicio saturado (espera estimada {wait:.0f} s)", wait - limit)
+
+
+def admit(redis_conn, router, client: str, priority: bool, queues, cost: int = 1):
+    if redis_conn is None:
+        return
+    try:
+        _check(redis_conn, router, client, priority, queues, cost)
+    except AdmissionRejected as e:
+        redis_conn.hincrby(STATS_KEY, f"rejected_{e.status_code}", cost)
+        raise
+    redis_conn.hincrby(STATS_KEY, 'admitted', cost)
@@ -1,24 +1,40 @@
-import base64
-import json
+import asyncio
 import uuid
+import orjson
+import re
 import pika
 import os
-import redis
-from fastapi import FastAPI, UploadFile, File, HTTPException
-from fastapi.responses import JSONResponse
+import threading
+import time
+from fastapi import FastAPI, UploadFile, File, HTTPException, Request, Depends, Header
+from fastapi.responses import ORJSONResponse, PlainTextResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
-from PIL import Image
-import io
-from typing import Optional
+from starlette.concurrency import run_in_threadpool
+from typing import List, Optional
+from results import load_results, result_key, result_exists, result_ttl
+from coalescing import attach_or_lead, cache_key, new_task_id
+from redis_topology import create_redis, tagged
+from router import EngineRouter, ROUTING_ENGINES, engine_queue
+import hedging
+from history import HistoryStore, record_cached, HISTORY_TIMEZONE
+from datetime import datetime, timedelta
+from admission import admit, client_id, max_request_cost, AdmissionRejected
+from admin import require_admin, usage_report, reset_usage, task_usage
+from profiling import run_profile
+from result_cache import ResultCache, etag_matches, cache_control, NO_STORE
+from uploads import (UploadLimitMiddleware, read_upload, prepare_image, start_cpu_pool, stop_cpu_pool,
+                     MAX_BATCH_FILES)
 
-app = FastAPI(title="IdentiCal", version="1.0.0")
+app = FastAPI(title="IdentiCal", version="1.0.0", default_response_class=ORJSONResponse)
 
+app.add_middleware(UploadLimitMiddleware)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Retry-After", "ETag"],
 )
 
 RABBITMQ_HOST = os.getenv('RABBITMQ_HOST', 'rabbitmq')
@@ -27,11 +43,15 @@ RABBITMQ_PASS = os.getenv('RABBITMQ_PASS', 'password')
 RABBITMQ_QUEUE = 'food_analysis_queue'
 RABBITMQ_PRIORITY_QUEUE = 'food_analysis_priority_queue'
 
-REDIS_HOST = os.getenv('REDIS_HOST', 'redis')
-REDIS_PORT = int(os.getenv('REDIS_PORT', 6379))
-REDIS_DB = int(os.getenv('REDIS_DB', 0))
+QUEUE_DEPTH_CACHE_SECONDS = float(os.getenv('QUEUE_DEPTH_CACHE_SECONDS', 2))
+
+# Las consultas de resultados van a las réplicas (Sentinel, Cluster o REDIS_REPLICA_HOST);
+# lo que aún no ha llegado a la réplica se vuelve a leer del primario.
+REDIS_READ_FROM_REPLICAS = os.getenv('REDIS_READ_FROM_REPLICAS', 'false').lower() in ('1', 'true', 'yes')
 
 redis_client = None
+redis_binary_client = None
+redis_replica_client = None
 
 def get_rabbitmq_connection():
     credentials = pika.PlainCredentials(RABBITMQ_USER, RABBITMQ_PASS)
@@ -46,91 +66,278 @@ def get_redis_client():
     global redis_client
     if redis_client is None:
         try:
-            redis_client = redis.Redis(
-                host=REDIS_HOST,
-                port=REDIS_PORT,
-                db=REDIS_DB,
-                decode_responses=True
-            )
+            redis_client = create_redis(decode_responses=True)
             redis_client.ping()
         except Exception as e:
             print(f"Error conectando a Redis: {e}")
             redis_client = None
     return redis_client
 
+def get_redis_binary_client():
+    global redis_binary_client
+    if redis_binary_client is None and get_redis_client() is not None:
+        redis_binary_client = create_redis(decode_responses=False)
+    return redis_binary_client
+
+def get_redis_replica_client():
+    global redis_replica_client
+    if not REDIS_READ_FROM_REPLICAS:
+        return get_redis_binary_client()
+    if redis_replica_client is None and get_redis_client() is not None:
+        redis_replica_client = create_redis(decode_responses=False, replica=True)
+    return redis_replica_client
+
+def read_results(task_ids: List[str]) -> List[Optional[dict]]:
+    results = load_results(get_redis_replica_client(), task_ids)
+    missing = [index for index, result in enumerate(results) if result is None]
+    if REDIS_READ_FROM_REPLICAS and missing:
+        for index, result in zip(missing, load_results(get_redis_binary_client(), [task_ids[i] for i in missing])):
+            results[index] = result
+    return results
+
+
+def routed_queues() -> List[str]:
+    queues = []
+    for base in (RABBITMQ_PRIORITY_QUEUE, RABBITMQ_QUEUE):
+        queues.append(base)
+        queues.extend(engine_queue(base, engine) for engine in ROUTING_ENGINES)
+    return queues
+
+queue_depths = {}
+queue_depths_at = 0.0
+queue_depths_lock = threading.Lock()
+
+def refresh_queue_depths():
+    connection = get_rabbitmq_connection()
+    try:
+        channel = connection.channel()
+        depths = {}
+        for queue in routed_queues():
+            try:
+                depths[queue] = channel.queue_declare(queue=queue, passive=True).method.message_count
+            except pika.exceptions.ChannelClosedByBroker:
+                # La cola aún no existe; el canal queda cerrado y hay que abrir otro.
+                depths[queue] = 0
+                channel = connection.channel()
+        return depths
+    finally:
+        connection.close()
+
+def get_queue_depth(queue: str) -> int:
+    global queue_depths, queue_depths_at
+    with queue_depths_lock:
+        if time.monotonic() - queue_depths_at > QUEUE_DEPTH_CACHE_SECONDS:
+            try:
+                queue_depths = refresh_queue_depths()
+            except Exception as e:
+                print(f"No se pudo consultar la profundidad de las colas: {e}")
+            queue_depths_at = time.monotonic()
+        return queue_depths.get(queue, 0)
+
+router = EngineRouter(get_redis_client, get_queue_depth)
 
 def setup_rabbitmq():
     try:
         connection = get_rabbitmq_connection()
         channel = connection.channel()
         
-        channel.queue_declare(queue=RABBITMQ_QUEUE, durable=True)
-        channel.queue_declare(queue=RABBITMQ_PRIORITY_QUEUE, durable=True)
+        for queue in routed_queues():
+            channel.queue_declare(queue=queue, durable=True)
         
         connection.close()
-        print("RabbitMQ configurado correctamente (2 colas)")
+        print(f"RabbitMQ configurado correctamente ({len(routed_queues())} colas)")
         return True
     except Exception as e:
         print(f"Error configurando RabbitMQ: {e}")
         return False
 
-@app.post("/api/analyze-food")
-async def analyze_food(image: UploadFile = File(...), priority: bool = False):
+# El frontend deja de consultar tras 30 intentos cada 5 s.
+TASK_DEADLINE_SECONDS = int(os.getenv('TASK_DEADLINE_SECONDS', 150))
+DEADLINE_HEADER = 'x-deadline'
+BATCH_TTL = int(os.getenv('RESULT_TTL', 3600))
+# Un lote mayor que la ráfaga del límite de tasa no se admitiría nunca.
+BATCH_LIMIT = max_request_cost(MAX_BATCH_FILES)
+if BATCH_LIMIT < MAX_BATCH_FILES:
+    print(f"MAX_BATCH_FILES={MAX_BATCH_FILES} supera RATE_LIMIT_BURST: los lotes se limitan a {BATCH_LIMIT} imágenes")
+
+def request_client(request: Request) -> str:
+    return client_id(request.headers.get('x-api-key'), request.headers.get('x-forwarded-for'),
+                     request.client.host if request.client else None)
+
+async def check_admission(request: Request, priority: bool, cost: int = 1) -> str:
+    client = request_client(request)
+    # Las tareas normales esperan también detrás de la cola prioritaria.
+    queues = [RABBITMQ_PRIORITY_QUEUE] if priority else [RABBITMQ_PRIORITY_QUEUE, RABBITMQ_QUEUE]
     try:
-        if not image.filename:
-            raise HTTPException(status_code=400, detail="No se seleccionó archivo")
-        
-        allowed_extensions = {'png', 'jpg', 'jpeg', 'gif', 'webp'}
-        file_extension = image.filename.rsplit('.', 1)[1].lower() if '.' in image.filename else ''
-        
-        if file_extension not in allowed_extensions:
-            raise HTTPException(status_code=400, detail="Formato de imagen no válido")
+        await run_in_threadpool(admit, get_redis_client(), router, client, priority, queues, cost)
+    except AdmissionRejected as e:
+        headers = {"Retry-After": str(e.retry_after)} if e.retry_after is not None else None
+        raise HTTPException(status_code=e.status_code, detail=e.detail, headers=headers)
+    return client
+
+def build_task_message(task_id: str, image_b64: str, filename: str, content_type: Optional[str],
+                       priority: bool, batch_id: Optional[str] = None, digest: Optional[str] = None,
+                       user: Optional[str] = None) -> dict:
+    message = {
+        'task_id': task_id,
+        'image_data': image_b64,
+        'filename': filename,
+        'content_type': content_type,
+        'priority': priority,
+        'deadline': int(time.time()) + TASK_DEADLINE_SECONDS
+    }
+    if batch_id:
+        message['batch_id'] = batch_id
+    if digest:
+        message['image_hash'] = digest
+    if user:
+        message['user'] = user
+    return message
+
+def prepare_task(redis_conn, digest: str, image_b64: str, filename: str, content_type: Optional[str],
+                 priority: bool, batch_id: Optional[str] = None, user: Optional[str] = None):
+    task_id = new_task_id(digest)
+    if redis_conn is None:
+        return task_id, 'leader', build_task_message(task_id, image_b64, filename, content_type, priority, batch_id,
+                                                     user=user)
+    
+    state, owner = attach_or_lead(redis_conn, digest, task_id, user or '')
+    if state == 'cached':
+        record_cached(redis_conn, owner, user or '')
+        return owner, state, None
+    if state == 'attached':
+        # El worker del análisis líder escribirá también el resultado de esta tarea.
+        return task_id, state, None
+    return task_id, state, build_task_message(task_id, image_b64, filename, content_type, priority, batch_id,
+                                              digest, user)
+
+def publish_tasks(messages: List[dict], priority: bool, selected_queue: Optional[str] = None) -> str:
+    if selected_queue is None:
+        base_queue = RABBITMQ_PRIORITY_QUEUE if priority else RABBITMQ_QUEUE
+        selected_queue = router.select_queue(base_queue, priority)
+    
+    connection = get_rabbitmq_connection()
+    try:
+        channel = connection.channel()
+        channel.queue_declare(queue=selected_queue, durable=True)
+        if len(messages) > 1:
+            channel.confirm_delivery()
         
-        try:
-            image_bytes = await image.read()
-            image_pil = Image.open(io.BytesIO(image_bytes))
-            image_pil.verify()
-        except Exception as e:
-            raise HTTPException(status_code=400, detail="Imagen corrupta o no válida")
+        for message in messages:
+            channel.basic_publish(
+                exchange='',
+                routing_key=selected_queue,
+                body=orjson.dumps(message),
+                properties=pika.BasicProperties(
+                    delivery_mode=2,
+                    headers={DEADLINE_HEADER: message['deadline']} if 'deadline' in message else None
+                )
+            )
+    finally:
+        connection.close()
+    return selected_queue
+
+hedge_tasks = set()
+
+async def hedge_task(message: dict, primary_queue: str):
+    task_id = message['task_id']
+    try:
+        delay = await run_in_threadpool(hedging.hedge_delay, router, primary_queue)
+        await asyncio.sleep(delay)
         
-        image_base64 = base64.b64encode(image_bytes).decode('utf-8')
+        redis_conn = get_redis_client()
+        if redis_conn is None or await run_in_threadpool(redis_conn.exists, result_key(task_id),
+                                                         cancelled_key(task_id)):
+            return
         
-        task_id = str(uuid.uuid4())
-        message = {
-            'task_id': task_id,
-            'image_data': image_base64,
-            'filename': image.filename,
-            'content_type': image.content_type,
-            'priority': priority
+        queue = await run_in_threadpool(hedging.hedge_queue, router, RABBITMQ_PRIORITY_QUEUE, primary_queue)
+        await run_in_threadpool(publish_tasks, [dict(message, hedged=True)], True, queue)
+        hedging.record(redis_conn, 'hedged')
+        print(f"Tarea {task_id} sin resultado tras {delay:.1f}s, copia enviada a {queue}")
+    except Exception as e:
+        print(f"No se pudo duplicar la tarea {task_id}: {e}")
+
+async def schedule_hedges(messages: List[dict], primary_queue: str):
+    if not hedging.HEDGE_PRIORITY_TASKS or not messages:
+        return
+    redis_conn = get_redis_client()
+    if redis_conn is not None:
+        await run_in_threadpool(hedging.record, redis_conn, 'priority_tasks', len(messages))
+    for message in messages:
+        task = asyncio.create_task(hedge_task(message, primary_queue))
+        hedge_tasks.add(task)
+        task.add_done_callback(hedge_tasks.discard)
+
+def cancelled_key(task_id: str) -> str:
+    return f"cancelled:{tagged(task_id)}"
+
+def build_result_content(task_id: str, nutrition_data: Optional[dict]) -> dict:
+    if not nutrition_data:
+        return {
+            "task_id": task_id,
+            "status": "processing",
+            "message": "Análisis en proceso..."
         }
+    
+    if nutrition_data.get('status') == 'error':
+        # Un error sin marca terminal todavía se reintenta: el cliente sigue esperando.
+        if not nutrition_data.get('terminal'):
+            return {
+                "task_id": task_id,
+                "status": "processing",
+                "message": "Análisis en proceso..."
+            }
+        return {
+            "task_id": task_id,
+            "status": "error",
+            "message": nutrition_data.get('error', 'Error en el análisis'),
+            "attempts": nutrition_data.get('attempts', 0)
+        }
+    
+    return {
+        "task_id": task_id,
+        "status": "completed",
+        "results": nutrition_data
+    }
+
+@app.post("/api/analyze-food")
+async def analyze_food(request: Request, image: UploadFile = File(...), priority: bool = False):
+    try:
+        client = await check_admission(request, priority)
+        image_bytes = await read_upload(image)
+        digest, image_b64 = await prepare_image(asyncio.get_running_loop(), image.filename, image_bytes)
         
-        selected_queue = RABBITMQ_PRIORITY_QUEUE if priority else RABBITMQ_QUEUE
-        
-        connection = get_rabbitmq_connection()
-        channel = connection.channel()
-        
-        channel.queue_declare(queue=selected_queue, durable=True)
+        task_id, state, message = await run_in_threadpool(prepare_task, get_redis_client(), digest, image_b64,
+                                                          image.filename, image.content_type, priority, user=client)
         
-        channel.basic_publish(
-            exchange='',
-            routing_key=selected_queue,
-            body=json.dumps(message),
-            properties=pika.BasicProperties(
-                delivery_mode=2,
+        if state == 'cached':
+            return ORJSONResponse(
+                status_code=200,
+                content={
+                    "message": "Imagen ya analizada, resultado disponible",
+                    "task_id": task_id,
+                    "estimated_time": "inmediato",
+                    "queue": None
+                }
             )
-        )
-        connection.close()
+        
+        selected_queue = None
+        if message is not None:
+            selected_queue = await run_in_threadpool(publish_tasks, [message], priority)
+            if priority:
+                await schedule_hedges([message], selected_queue)
         
         queue_type = "prioritaria" if priority else "normal"
         estimated_time = "15-30 segundos" if priority else "30-60 segundos"
         
-        return JSONResponse(
+        return ORJSONResponse(
             status_code=200,
             content={
                 "message": f"Imagen enviada para análisis (cola {queue_type})", 
                 "task_id": task_id,
                 "estimated_time": estimated_time,
-                "queue": selected_queue
+                "queue": selected_queue,
+                "coalesced": state == 'attached'
             }
         )
         
@@ -140,33 +347,184 @@ async def analyze_food(image: UploadFile = File(...), priority: bool = False):
         raise HTTPException(status_code=500, detail=f"Error interno del servidor: {str(e)}")
 
 
-@app.get("/api/results/{task_id}")
-async def get_analysis_results(task_id: str):
+@app.post("/api/analyze-food/batch")
+async def analyze_food_batch(request: Request, images: List[UploadFile] = File(...), priority: bool = False):
     try:
+        if not images:
+            raise HTTPException(status_code=400, detail="No se seleccionaron archivos")
+        if len(images) > BATCH_LIMIT:
+            raise HTTPException(status_code=400, detail=f"Máximo {BATCH_LIMIT} imágenes por lote")
+        client = await check_admission(request, priority, len(images))
+        
         redis_conn = get_redis_client()
         if not redis_conn:
             raise HTTPException(status_code=503, detail="Base de datos no disponible")
         
-        result_key = f"analysis:{task_id}"
-        result_data = redis_conn.get(result_key)
+        contents = [await read_upload(image) for image in images]
+        loop = asyncio.get_running_loop()
+        prepared = await asyncio.gather(*[
+            prepare_image(loop, image.filename, image_bytes)
+            for image, image_bytes in zip(images, contents)
+        ])
         
-        if not result_data:
-            return JSONResponse(
-                status_code=202,
-                content={
-                    "task_id": task_id,
-                    "status": "processing",
-                    "message": "Análisis en proceso..."
-                }
-            )
-        nutrition_data = json.loads(result_data)
+        batch_id = str(uuid.uuid4())
+        task_ids = []
+        messages = []
+        for image, (digest, image_b64) in zip(images, prepared):
+            task_id, _, message = await run_in_threadpool(prepare_task, redis_conn, digest, image_b64, image.filename,
+                                                          image.content_type, priority, batch_id, client)
+            task_ids.append(task_id)
+            if message is not None:
+                messages.append(message)
+        
+        batch_key = f"batch:{batch_id}"
+        pipe = redis_conn.pipeline()
+        pipe.rpush(batch_key, *task_ids)
+        pipe.expire(batch_key, BATCH_TTL)
+        await run_in_threadpool(pipe.execute)
+        
+        selected_queue = None
+        if messages:
+            selected_queue = await run_in_threadpool(publish_tasks, messages, priority)
+            if priority:
+                await schedule_hedges(messages, selected_queue)
         
-        return JSONResponse(
+        return ORJSONResponse(
             status_code=200,
             content={
-                "task_id": task_id,
-                "status": "completed",
-                "results": nutrition_data
+                "message": f"{len(task_ids)} imágenes enviadas para análisis",
+                "batch_id": batch_id,
+                "task_ids": task_ids,
+                "queue": selected_queue,
+                "published": len(messages)
+            }
+        )
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error interno del servidor: {str(e)}")
+
+
+result_cache = ResultCache()
+
+def cached_result_response(etag: str, body: bytes, max_age: int, if_none_match: Optional[str]) -> Response:
+    headers = {"ETag": etag, "Cache-Control": cache_control(max_age)}
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+@app.get("/api/results/{task_id}")
+async def get_analysis_results(task_id: str, if_none_match: Optional[str] = Header(None)):
+    try:
+        # Los resultados completados no cambian: se sirven sin consultar Redis.
+        cached = result_cache.get(task_id)
+        if cached:
+            return cached_result_response(*cached, if_none_match)
+        
+        redis_conn = get_redis_client()
+        if not redis_conn:
+            raise HTTPException(status_code=503, detail="Base de datos no disponible")
+        
+        nutrition_data = (await run_in_threadpool(read_results, [task_id]))[0]
+        content = build_result_content(task_id, nutrition_data)
+        # Sólo un análisis terminado con éxito es definitivo: un error puede sustituirse
+        # por otra copia de la tarea. La caché dura lo que le queda a la clave en Redis.
+        if nutrition_data and nutrition_data.get('status') == 'completed':
+            ttl = await run_in_threadpool(result_ttl, redis_conn, task_id)
+            if ttl != -2:
+                entry = result_cache.put(task_id, orjson.dumps(content), ttl)
+                return cached_result_response(*entry, if_none_match)
+        if content["status"] == "processing" and await run_in_threadpool(redis_conn.exists, cancelled_key(task_id)):
+            content = {"task_id": task_id, "status": "cancelled", "message": "Análisis cancelado"}
+        
+        return ORJSONResponse(
+            status_code=202 if content["status"] == "processing" else 200,
+            content=content,
+            headers={"Cache-Control": NO_STORE}
+        )
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error interno: {str(e)}")
+
+
+SHA256_PATTERN = re.compile(r'^[0-9a-f]{64}$')
+
+@app.get("/api/cache/{digest}")
+async def lookup_cached_result(request: Request, digest: str):
+    try:
+        if not SHA256_PATTERN.match(digest):
+            raise HTTPException(status_code=400, detail="Hash de imagen no válido")
+        
+        redis_conn = get_redis_client()
+        if not redis_conn:
+            raise HTTPException(status_code=503, detail="Base de datos no disponible")
+        
+        # El frontend calcula el SHA-256 de la imagen ya comprimida: si coincide
+        # con un análisis completado no hace falta volver a subir los bytes.
+        task_id = await run_in_threadpool(redis_conn.get, cache_key(digest))
+        if not task_id or not await run_in_threadpool(redis_conn.exists, result_key(task_id)):
+            raise HTTPException(status_code=404, detail="Imagen no analizada")
+        
+        await run_in_threadpool(record_cached, redis_conn, task_id, request_client(request))
+        return {
+            "message": "Imagen ya analizada, resultado disponible",
+            "task_id": task_id,
+            "estimated_time": "inmediato",
+            "queue": None
+        }
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error interno: {str(e)}")
+
+
+@app.delete("/api/results/{task_id}")
+async def cancel_analysis(task_id: str):
+    try:
+        redis_conn = get_redis_client()
+        if not redis_conn:
+            raise HTTPException(status_code=503, detail="Base de datos no disponible")
+        
+        if await run_in_threadpool(result_exists, redis_conn, task_id):
+            return {"task_id": task_id, "status": "completed", "message": "El análisis ya había terminado"}
+        
+        # Los workers consultan esta marca al sacar la tarea de la cola y la descartan sin inferencia.
+        await run_in_threadpool(redis_conn.set, cancelled_key(task_id), "1", ex=TASK_DEADLINE_SECONDS)
+        return {"task_id": task_id, "status": "cancelled", "message": "Análisis cancelado"}
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error interno: {str(e)}")
+
+
+@app.get("/api/batches/{batch_id}")
+async def get_batch_results(batch_id: str):
+    try:
+        redis_conn = get_redis_client()
+        if not redis_conn:
+            raise HTTPException(status_code=503, detail="Base de datos no disponible")
+        
+        task_ids = await run_in_threadpool(redis_conn.lrange, f"batch:{batch_id}", 0, -1)
+        if not task_ids:
+            raise HTTPException(status_code=404, detail="Lote no encontrado")
+        
+        results = await run_in_threadpool(read_results, task_ids)
+        tasks = [build_result_content(task_id, data) for task_id, data in zip(task_ids, results)]
+        completed = sum(1 for task in tasks if task["status"] in ("completed", "error"))
+        
+        return ORJSONResponse(
+            status_code=200 if completed == len(tasks) else 202,
+            content={
+                "batch_id": batch_id,
+                "status": "completed" if completed == len(tasks) else "processing",
+                "completed": completed,
+                "total": len(tasks),
+                "tasks": tasks
             }
         )
         
@@ -175,6 +533,114 @@ async def get_analysis_results(task_id: str):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error interno: {str(e)}")
 
+@app.get("/api/engines")
+async def get_engines():
+    try:
+        snapshot = await run_in_threadpool(router.snapshot)
+        depths = {queue: await run_in_threadpool(get_queue_depth, queue) for queue in routed_queues()}
+        return {"engines": snapshot, "queues": depths}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error interno: {str(e)}")
+
+history_store = HistoryStore()
+DATE_PATTERN = re.compile(r'^\d{4}-\d{2}-\d{2}$')
+
+def history_range(start: Optional[str], end: Optional[str], default_days: int):
+    today = datetime.now(HISTORY_TIMEZONE).date()
+    end = end or today.isoformat()
+    start = start or (today - timedelta(days=default_days - 1)).isoformat()
+    if not DATE_PATTERN.match(start) or not DATE_PATTERN.match(end):
+        raise HTTPException(status_code=400, detail="Las fechas deben tener formato AAAA-MM-DD")
+    return start, end
+
+@app.get("/api/history")
+async def get_history(request: Request, period: str = 'day', start: Optional[str] = None, end: Optional[str] = None):
+    try:
+        if period not in ('day', 'week'):
+            raise HTTPException(status_code=400, detail="El periodo debe ser 'day' o 'week'")
+        start, end = history_range(start, end, 7 if period == 'day' else 28)
+        user = request_client(request)
+        # Los agregados se mantienen al escribir cada análisis: la consulta es una búsqueda por clave.
+        rollups = await run_in_threadpool(history_store.rollups, user, period, start, end)
+        return {"period": period, "start": start, "end": end, "rollups": rollups}
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error interno: {str(e)}")
+
+@app.get("/api/history/meals")
+async def get_history_meals(request: Request, start: Optional[str] = None, end: Optional[str] = None,
+                            food: Optional[str] = None, limit: int = 100):
+    try:
+        start, end = history_range(start, end, 1)
+        meals = await run_in_threadpool(history_store.meals, request_client(request), start, end, food,
+                                        max(1, min(limit, 500)))
+        return {"start": start, "end": end, "meals": meals}
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error interno: {str(e)}")
+
+@app.get("/api/admin/usage", dependencies=[Depends(require_admin)])
+async def get_usage():
+    try:
+        redis_conn = get_redis_client()
+        if not redis_conn:
+            raise HTTPException(status_code=503, detail="Base de datos no disponible")
+        # Consumo medido por los workers (tokens, segundos de GPU/CPU, memoria y coste) por motor y prioridad.
+        return {"engines": await run_in_threadpool(usage_report, redis_conn)}
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error interno: {str(e)}")
+
+@app.delete("/api/admin/usage", dependencies=[Depends(require_admin)])
+async def delete_usage():
+    try:
+        redis_conn = get_redis_client()
+        if not redis_conn:
+            raise HTTPException(status_code=503, detail="Base de datos no disponible")
+        await run_in_threadpool(reset_usage, redis_conn)
+        return {"message": "Agregados de consumo reiniciados"}
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error interno: {str(e)}")
+
+@app.get("/api/admin/usage/{task_id}", dependencies=[Depends(require_admin)])
+async def get_task_usage(task_id: str):
+    try:
+        redis_conn = get_redis_client()
+        if not redis_conn:
+            raise HTTPException(status_code=503, detail="Base de datos no disponible")
+        
+        usage = task_usage(redis_conn.hgetall(result_key(task_id)))
+        if usage is None:
+            raise HTTPException(status_code=404, detail="Sin consumo registrado para la tarea")
+        return {"task_id": task_id, "usage": usage}
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error interno: {str(e)}")
+
+@app.post("/api/admin/profile", dependencies=[Depends(require_admin)])
+async def profile_backend(seconds: float = 10, memory: bool = False, format: str = 'json'):
+    # Perfila el proceso uvicorn que atiende la petición (con WEB_CONCURRENCY > 1, uno de ellos: ver 'pid').
+    try:
+        report = await run_in_threadpool(run_profile, seconds, memory, f"backend-{os.getpid()}")
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error interno: {str(e)}")
+    if format == 'folded':
+        return PlainTextResponse(report['folded'] + '\n')
+    return report
+
 @app.get("/api/health")
 async def health_check():
     redis_conn = get_redis_client()
@@ -188,8 +654,13 @@ async def health_check():
 
 @app.on_event("startup")
 async def startup_event():
+    start_cpu_pool()
     setup_rabbitmq()
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    stop_cpu_pool()
+
 if __name__ == '__main__':
     import uvicorn
     uvicorn.run(app, host='0.0.0.0', port=5000)
\ No newline at end of file
@@ -0,0 +1,98 @@
+import argparse
+import json
+import os
+import time
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+import redis
+from hedging import STATS_KEY
+
+SKIPPED_STATS_KEY = 'stats:skipped'
+
+
+def upload(api: str, image_path: str) -> str:
+    boundary = uuid.uuid4().hex
+    with open(image_path, 'rb') as f:
+        image_bytes = f.read()
+    # Bytes aleatorios al final evitan que el backend reutilice el resultado cacheado.
+    image_bytes += uuid.uuid4().bytes
+    body = (f"--{boundary}\r\nContent-Disposition: form-data; name=\"image\"; "
+            f"filename=\"{os.path.basename(image_path)}\"\r\nContent-Type: image/jpeg\r\n\r\n").encode('utf-8')
+    body += image_bytes + f"\r\n--{boundary}--\r\n".encode('utf-8')
+    request = urllib.request.Request(f"{api}/api/analyze-food?priority=true", data=body, method='POST',
+                                     headers={'Content-Type': f"multipart/form-data; boundary={boundary}"})
+    with urllib.request.urlopen(request) as response:
+        return json.loads(response.read())['task_id']
+
+
+def run_task(api: str, image_path: str, timeout: float) -> float:
+    started = time.perf_counter()
+    task_id = upload(api, image_path)
+    while time.perf_counter() - started < timeout:
+        with urllib.request.urlopen(f"{api}/api/results/{task_id}") as response:
+            if response.status == 200:
+                return time.perf_counter() - started
+        time.sleep(0.25)
+    return timeout
+
+
+def percentile(values, fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def read_stats(conn) -> dict:
+    stats = {k.decode('utf-8'): int(v) for k, v in conn.hgetall(STATS_KEY).items()}
+    stats['skipped'] = int(conn.hget(SKIPPED_STATS_KEY, 'completed') or 0)
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Latencia de tareas prioritarias con y sin hedging")
+    parser.add_argument('image')
+    parser.add_argument('--api', default=os.getenv('API_URL', 'http://localhost:5000'))
+    parser.add_argument('--count', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--timeout', type=float, default=180)
+    parser.add_argument('--host', default=os.getenv('REDIS_HOST', 'localhost'))
+    parser.add_argument('--port', type=int, default=int(os.getenv('REDIS_PORT', 6379)))
+    parser.add_argument('--save', help="Guarda los percentiles en un JSON para comparar ejecuciones")
+    parser.add_argument('--baseline', help="JSON de una ejecución con HEDGE_PRIORITY_TASKS=false")
+    args = parser.parse_args()
+
+    conn = redis.Redis(host=args.host, port=args.port)
+    before = read_stats(conn)
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        latencies = list(executor.map(lambda _: run_task(args.api, args.image, args.timeout), range(args.count)))
+    after = read_stats(conn)
+    delta = {field: after.get(field, 0) - before.get(field, 0) for field in after}
+
+    summary = {
+        'p50': percentile(latencies, 0.50),
+        'p95': percentile(latencies, 0.95),
+        'p99': percentile(latencies, 0.99),
+        'timeouts': sum(1 for latency in latencies if latency >= args.timeout),
+    }
+    priority_tasks = delta.get('priority_tasks', 0)
+    print(f"tareas: {args.count}  p50: {summary['p50']:.2f}s  p95: {summary['p95']:.2f}s  "
+          f"p99: {summary['p99']:.2f}s  timeouts: {summary['timeouts']}")
+    if priority_tasks:
+        print(f"hedge rate: {delta.get('hedged', 0) / priority_tasks:.1%}  "
+              f"copias ganadoras: {delta.get('hedge_wins', 0)}  copias omitidas: {delta.get('skipped', 0)}")
+    else:
+        print("hedging desactivado en el backend (sin tareas prioritarias registradas)")
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        improvement = (baseline['p99'] - summary['p99']) / baseline['p99'] if baseline['p99'] else 0
+        print(f"p99 sin hedging: {baseline['p99']:.2f}s  con hedging: {summary['p99']:.2f}s  "
+              f"mejora: {improvement:.1%}")
+    if args.save:
+        with open(args.save, 'w', encoding='utf-8') as f:
+            json.dump(summary, f)
+
+
+if __name__ == '__main__':
+    main()
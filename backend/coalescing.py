@@ -0,0 +1,60 @@
+import hashlib
+import os
+import uuid
+from typing import Tuple
+from redis_topology import LUA_TAGGED, tagged, SHARD_TAG_LENGTH
+
+INFLIGHT_TTL = int(os.getenv('INFLIGHT_TTL', 900))
+RESULT_TTL = int(os.getenv('RESULT_TTL', 3600))
+
+# Registra la subida de forma atómica: reutiliza un resultado ya cacheado,
+# se une como espera a un análisis en curso o queda como líder y debe publicar.
+# Cada espera se anota como "task_id|usuario" para el historial.
+ATTACH_SCRIPT = LUA_TAGGED + """
+local cached = redis.call('GET', KEYS[2])
+if cached and redis.call('EXISTS', 'analysis:' .. tagged(cached)) == 1 then
+    return {'cached', cached}
+end
+local leader = redis.call('GET', KEYS[1])
+if leader then
+    local waiters = 'waiters:' .. tagged(leader)
+    redis.call('RPUSH', waiters, ARGV[4])
+    redis.call('EXPIRE', waiters, ARGV[3])
+    return {'attached', leader}
+end
+redis.call('SET', KEYS[1], ARGV[1], 'EX', ARGV[2])
+return {'leader', ARGV[1]}
+"""
+
+_attach_script = None
+
+
+def image_hash(image_bytes: bytes) -> str:
+    return hashlib.sha256(image_bytes).hexdigest()
+
+
+def new_task_id(digest: str) -> str:
+    # El prefijo del hash de la imagen es la etiqueta de hash de todas las claves de la
+    # tarea: las subidas idénticas quedan en el mismo slot que su análisis líder.
+    task_id = str(uuid.uuid4())
+    return digest[:SHARD_TAG_LENGTH] + task_id[SHARD_TAG_LENGTH:] if digest else task_id
+
+
+def inflight_key(digest: str) -> str:
+    return f"inflight:{tagged(digest)}"
+
+
+def cache_key(digest: str) -> str:
+    return f"imagecache:{tagged(digest)}"
+
+
+def attach_or_lead(redis_conn, digest: str, task_id: str, user: str = '') -> Tuple[str, str]:
+    global _attach_script
+    if _attach_script is None:
+        _attach_script = redis_conn.register_script(ATTACH_SCRIPT)
+    state, owner = _attach_script(
+        keys=[inflight_key(digest), cache_key(digest)],
+        args=[task_id, INFLIGHT_TTL, INFLIGHT_TTL, f"{task_id}|{user}"],
+        client=redis_conn
+    )
+    return state, owner
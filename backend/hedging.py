@@ -0,0 +1,25 @@
+import os
+from router import queue_engine
+
+HEDGE_PRIORITY_TASKS = os.getenv('HEDGE_PRIORITY_TASKS', 'true').lower() in ('1', 'true', 'yes')
+HEDGE_P95_FACTOR = float(os.getenv('HEDGE_P95_FACTOR', 1.0))
+HEDGE_MIN_DELAY = float(os.getenv('HEDGE_MIN_DELAY', 5))
+HEDGE_MAX_DELAY = float(os.getenv('HEDGE_MAX_DELAY', 60))
+STATS_KEY = 'stats:hedging'
+
+
+def hedge_delay(router, primary_queue: str) -> float:
+    # La copia sale cuando la tarea supera el p95 del motor que la recibió.
+    p95 = router.latency_p95(queue_engine(primary_queue))
+    return min(HEDGE_MAX_DELAY, max(HEDGE_MIN_DELAY, p95 * HEDGE_P95_FACTOR))
+
+
+def hedge_queue(router, base_queue: str, primary_queue: str) -> str:
+    return router.select_queue(base_queue, True, exclude=queue_engine(primary_queue))
+
+
+def record(redis_conn, field: str, count: int = 1):
+    try:
+        redis_conn.hincrby(STATS_KEY, field, count)
+    except Exception as e:
+        print(f"No se pudieron registrar estadísticas de hedging: {e}")
@@ -0,0 +1,231 @@
+import os
+import socket
+import sqlite3
+import time
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional
+from zoneinfo import ZoneInfo
+import redis
+from redis.exceptions import ResponseError
+from redis_topology import create_redis, is_cluster
+from results import result_key
+
+HISTORY_DB_PATH = os.getenv('HISTORY_DB_PATH', '/data/history.db')
+HISTORY_TIMEZONE = ZoneInfo(os.getenv('HISTORY_TIMEZONE', 'UTC'))
+HISTORY_BATCH_SIZE = int(os.getenv('HISTORY_BATCH_SIZE', 500))
+HISTORY_STREAM = 'history:stream'
+HISTORY_STREAM_MAXLEN = int(os.getenv('HISTORY_STREAM_MAXLEN', 100000))
+HISTORY_GROUP = 'history-writer'
+
+# Campo compacto del resultado en Redis -> columna en SQLite.
+NUTRIENT_COLUMNS = {
+    'cal': 'calorias',
+    'prot': 'proteinas',
+    'carb': 'carbohidratos',
+    'gras': 'grasas',
+    'fib': 'fibra',
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS analyses (
+    entry_id TEXT PRIMARY KEY,
+    task_id TEXT NOT NULL,
+    user_id TEXT NOT NULL,
+    ts INTEGER NOT NULL,
+    day TEXT NOT NULL,
+    comida TEXT,
+    food_key TEXT,
+    calorias REAL NOT NULL DEFAULT 0,
+    proteinas REAL NOT NULL DEFAULT 0,
+    carbohidratos REAL NOT NULL DEFAULT 0,
+    grasas REAL NOT NULL DEFAULT 0,
+    fibra REAL NOT NULL DEFAULT 0,
+    model TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_analyses_user_ts ON analyses(user_id, ts);
+CREATE INDEX IF NOT EXISTS idx_analyses_food_ts ON analyses(food_key, ts);
+CREATE INDEX IF NOT EXISTS idx_analyses_ts ON analyses(ts);
+
+CREATE TABLE IF NOT EXISTS rollups (
+    user_id TEXT NOT NULL,
+    period TEXT NOT NULL,
+    start TEXT NOT NULL,
+    meals INTEGER NOT NULL,
+    calorias REAL NOT NULL,
+    proteinas REAL NOT NULL,
+    carbohidratos REAL NOT NULL,
+    grasas REAL NOT NULL,
+    fibra REAL NOT NULL,
+    PRIMARY KEY (user_id, period, start)
+) WITHOUT ROWID;
+"""
+
+UPSERT_ROLLUP = """
+INSERT INTO rollups (user_id, period, start, meals, calorias, proteinas, carbohidratos, grasas, fibra)
+VALUES (?, ?, ?, 1, ?, ?, ?, ?, ?)
+ON CONFLICT (user_id, period, start) DO UPDATE SET
+    meals = meals + 1,
+    calorias = calorias + excluded.calorias,
+    proteinas = proteinas + excluded.proteinas,
+    carbohidratos = carbohidratos + excluded.carbohidratos,
+    grasas = grasas + excluded.grasas,
+    fibra = fibra + excluded.fibra
+"""
+
+# Anota en el historial una subida resuelta con un resultado ya cacheado.
+# KEYS: analysis, history. ARGV: task_id, usuario, maxlen.
+RECORD_CACHED_SCRIPT = """
+local fields = redis.call('HGETALL', KEYS[1])
+if #fields == 0 then
+    return 0
+end
+redis.call('XADD', KEYS[2], 'MAXLEN', '~', ARGV[3], '*', 'task_id', ARGV[1], 'user', ARGV[2], unpack(fields))
+return 1
+"""
+
+_record_cached_script = None
+
+
+def record_cached(redis_conn, task_id: str, user: str):
+    global _record_cached_script
+    if _record_cached_script is None:
+        _record_cached_script = redis_conn.register_script(RECORD_CACHED_SCRIPT)
+    if is_cluster(redis_conn):
+        # El stream está en otro slot que el resultado: lectura y escritura por separado.
+        fields = redis_conn.hgetall(result_key(task_id))
+        if fields:
+            redis_conn.xadd(HISTORY_STREAM, dict({'task_id': task_id, 'user': user}, **fields),
+                            maxlen=HISTORY_STREAM_MAXLEN, approximate=True)
+        return
+    _record_cached_script(keys=[result_key(task_id), HISTORY_STREAM],
+                          args=[task_id, user, HISTORY_STREAM_MAXLEN], client=redis_conn)
+
+
+def local_day(ts_ms: int) -> datetime:
+    return datetime.fromtimestamp(ts_ms / 1000, tz=timezone.utc).astimezone(HISTORY_TIMEZONE)
+
+
+def week_start(day: str) -> str:
+    date = datetime.strptime(day, '%Y-%m-%d').date()
+    return (date - timedelta(days=date.weekday())).isoformat()
+
+
+def _number(value: Optional[str]) -> float:
+    try:
+        return float(value or 0)
+    except ValueError:
+        return 0.0
+
+
+class HistoryStore:
+    def __init__(self, path: str = HISTORY_DB_PATH):
+        self.path = path
+
+    def connect(self, readonly: bool = False) -> sqlite3.Connection:
+        if readonly:
+            conn = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, timeout=5)
+        else:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def initialize(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self.connect() as conn:
+            conn.executescript(SCHEMA)
+
+    def apply(self, conn: sqlite3.Connection, entries) -> int:
+        inserted = 0
+        with conn:
+            for entry_id, fields in entries:
+                ts = int(entry_id.split('-')[0])
+                day = local_day(ts).date().isoformat()
+                user = fields.get('user') or 'anonimo'
+                comida = fields.get('comida')
+                values = [_number(fields.get(field)) for field in NUTRIENT_COLUMNS]
+                cursor = conn.execute(
+                    "INSERT OR IGNORE INTO analyses (entry_id, task_id, user_id, ts, day, comida, food_key, "
+                    "calorias, proteinas, carbohidratos, grasas, fibra, model) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    [entry_id, fields.get('task_id', ''), user, ts, day, comida,
+                     comida.strip().lower() if comida else None, *values, fields.get('model')]
+                )
+                # Una entrada reprocesada tras un corte no vuelve a sumar en los agregados.
+                if cursor.rowcount == 0:
+                    continue
+                conn.execute(UPSERT_ROLLUP, [user, 'day', day, *values])
+                conn.execute(UPSERT_ROLLUP, [user, 'week', week_start(day), *values])
+                inserted += 1
+        return inserted
+
+    def rollups(self, user: str, period: str, start: str, end: str) -> List[dict]:
+        if not os.path.exists(self.path):
+            return []
+        with self.connect(readonly=True) as conn:
+            rows = conn.execute(
+                "SELECT start, meals, calorias, proteinas, carbohidratos, grasas, fibra FROM rollups "
+                "WHERE user_id = ? AND period = ? AND start BETWEEN ? AND ? ORDER BY start",
+                [user, period, start, end]
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def meals(self, user: str, start: str, end: str, food: Optional[str] = None, limit: int = 100) -> List[dict]:
+        if not os.path.exists(self.path):
+            return []
+        start_ts = int(datetime.strptime(start, '%Y-%m-%d').replace(tzinfo=HISTORY_TIMEZONE).timestamp() * 1000)
+        end_ts = int((datetime.strptime(end, '%Y-%m-%d') + timedelta(days=1))
+                     .replace(tzinfo=HISTORY_TIMEZONE).timestamp() * 1000)
+        query = ("SELECT task_id, ts, day, comida, calorias, proteinas, carbohidratos, grasas, fibra, model "
+                 "FROM analyses WHERE user_id = ? AND ts >= ? AND ts < ?")
+        params = [user, start_ts, end_ts]
+        if food:
+            query += " AND food_key = ?"
+            params.append(food.strip().lower())
+        query += " ORDER BY ts DESC LIMIT ?"
+        params.append(limit)
+        with self.connect(readonly=True) as conn:
+            rows = conn.execute(query, params).fetchall()
+        return [dict(row) for row in rows]
+
+
+def consume(redis_conn, store: HistoryStore, consumer: str):
+    try:
+        redis_conn.xgroup_create(HISTORY_STREAM, HISTORY_GROUP, id='0', mkstream=True)
+    except ResponseError as e:
+        if 'BUSYGROUP' not in str(e):
+            raise
+
+    conn = store.connect()
+    # Primero se reprocesan las entradas leídas y no confirmadas antes de un corte.
+    last_id = '0'
+    while True:
+        response = redis_conn.xreadgroup(HISTORY_GROUP, consumer, {HISTORY_STREAM: last_id},
+                                         count=HISTORY_BATCH_SIZE, block=5000)
+        entries = response[0][1] if response else []
+        if not entries:
+            last_id = '>'
+            continue
+        inserted = store.apply(conn, entries)
+        redis_conn.xack(HISTORY_STREAM, HISTORY_GROUP, *[entry_id for entry_id, _ in entries])
+        print(f"Historial: {inserted} análisis guardados ({len(entries)} entradas)")
+
+
+def main():
+    store = HistoryStore()
+    store.initialize()
+    consumer = socket.gethostname()
+    while True:
+        try:
+            redis_conn = create_redis(decode_responses=True, socket_timeout=None)
+            consume(redis_conn, store, consumer)
+        except (redis.ConnectionError, redis.TimeoutError) as e:
+            print(f"Conexión con Redis perdida en el historial: {e}")
+            time.sleep(2)
+
+
+if __name__ == '__main__':
+    main()
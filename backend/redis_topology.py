@@ -0,0 +1,91 @@
+import os
+from typing import List, Optional, Tuple
+import redis
+from redis.cluster import RedisCluster, ClusterNode
+from redis.sentinel import Sentinel
+try:
+    from redis.cluster import LoadBalancingStrategy
+except ImportError:  # redis-py < 5.3
+    LoadBalancingStrategy = None
+
+# Topología de Redis compartida por backend y workers (este archivo está duplicado en
+# backend/ y worker/ porque cada imagen Docker sólo copia su carpeta).
+#   standalone: REDIS_HOST:REDIS_PORT y, para lecturas, REDIS_REPLICA_HOST opcional
+#   sentinel:   REDIS_SENTINELS=host:puerto,... y REDIS_SENTINEL_MASTER
+#   cluster:    REDIS_CLUSTER_NODES=host:puerto,... (nodos de arranque)
+REDIS_TOPOLOGY = os.getenv('REDIS_TOPOLOGY', 'standalone')
+REDIS_HOST = os.getenv('REDIS_HOST', 'redis')
+REDIS_PORT = int(os.getenv('REDIS_PORT', 6379))
+REDIS_DB = int(os.getenv('REDIS_DB', 0))
+REDIS_PASSWORD = os.getenv('REDIS_PASSWORD') or None
+REDIS_REPLICA_HOST = os.getenv('REDIS_REPLICA_HOST', '')
+REDIS_SENTINELS = os.getenv('REDIS_SENTINELS', '')
+REDIS_SENTINEL_MASTER = os.getenv('REDIS_SENTINEL_MASTER', 'mymaster')
+REDIS_CLUSTER_NODES = os.getenv('REDIS_CLUSTER_NODES', '')
+REDIS_SOCKET_TIMEOUT = float(os.getenv('REDIS_SOCKET_TIMEOUT', 5))
+
+# Las claves de una tarea y de su imagen llevan como etiqueta de hash los primeros
+# caracteres del identificador; el backend crea los task_id con el prefijo del hash
+# de la imagen, así resultado, esperas, marcador en curso y caché caen en el mismo
+# slot del Cluster y los scripts Lua siguen siendo atómicos.
+SHARD_TAG_LENGTH = 8
+LUA_TAGGED = f"""
+local function tagged(id)
+    return '{{' .. string.sub(id, 1, {SHARD_TAG_LENGTH}) .. '}}' .. string.sub(id, {SHARD_TAG_LENGTH + 1})
+end
+"""
+
+
+def tagged(identifier: str) -> str:
+    return f"{{{identifier[:SHARD_TAG_LENGTH]}}}{identifier[SHARD_TAG_LENGTH:]}"
+
+
+def parse_nodes(spec: str, default_port: int) -> List[Tuple[str, int]]:
+    nodes = []
+    for node in spec.split(','):
+        if node.strip():
+            host, _, port = node.strip().partition(':')
+            nodes.append((host, int(port or default_port)))
+    return nodes
+
+
+def create_redis(decode_responses: bool = True, replica: bool = False, topology: Optional[str] = None,
+                 host: Optional[str] = None, port: Optional[int] = None, nodes: Optional[str] = None, **kwargs):
+    # replica=True devuelve un cliente de sólo lectura que reparte las lecturas entre réplicas.
+    # nodes sustituye a REDIS_SENTINELS / REDIS_CLUSTER_NODES (p. ej. en los benchmarks).
+    topology = topology or REDIS_TOPOLOGY
+    options = dict(decode_responses=decode_responses, password=REDIS_PASSWORD,
+                   socket_connect_timeout=REDIS_SOCKET_TIMEOUT, socket_timeout=REDIS_SOCKET_TIMEOUT)
+    options.update(kwargs)
+
+    if topology == 'sentinel':
+        nodes = parse_nodes(nodes or REDIS_SENTINELS, 26379) or [(host or REDIS_HOST, port or 26379)]
+        sentinel = Sentinel(nodes, socket_timeout=REDIS_SOCKET_TIMEOUT)
+        if replica:
+            return sentinel.slave_for(REDIS_SENTINEL_MASTER, db=REDIS_DB, **options)
+        return sentinel.master_for(REDIS_SENTINEL_MASTER, db=REDIS_DB, **options)
+
+    if topology == 'cluster':
+        nodes = parse_nodes(nodes or REDIS_CLUSTER_NODES, 6379) or [(host or REDIS_HOST, port or REDIS_PORT)]
+        if replica and LoadBalancingStrategy is not None:
+            options['load_balancing_strategy'] = LoadBalancingStrategy.ROUND_ROBIN_REPLICAS
+        elif replica:
+            options['read_from_replicas'] = True
+        return RedisCluster(startup_nodes=[ClusterNode(h, p) for h, p in nodes], **options)
+
+    if topology != 'standalone':
+        raise ValueError(f"Topología de Redis desconocida: {topology}")
+    if replica and REDIS_REPLICA_HOST:
+        replica_host, replica_port = parse_nodes(REDIS_REPLICA_HOST, REDIS_PORT)[0]
+        return redis.Redis(host=replica_host, port=replica_port, db=REDIS_DB, **options)
+    return redis.Redis(host=host or REDIS_HOST, port=port or REDIS_PORT, db=REDIS_DB, **options)
+
+
+def is_cluster(redis_conn) -> bool:
+    return isinstance(redis_conn, RedisCluster)
+
+
+def atomic_pipeline(redis_conn):
+    # El pipeline de Cluster de redis-py no envía MULTI/EXEC; las claves que deben
+    # cambiar juntas comparten etiqueta de hash y van al mismo nodo.
+    return redis_conn.pipeline(transaction=not is_cluster(redis_conn))
@@ -0,0 +1,69 @@
+import collections
+import hashlib
+import os
+import threading
+import time
+from typing import Optional, Tuple
+
+# Un resultado completado no cambia: su respuesta se sirve desde memoria con un ETag
+# fuerte, y las consultas repetidas (o condicionales, 304) no llegan a Redis. Cada
+# proceso de uvicorn tiene su propia caché; basta con que el ETag sea el mismo en todos.
+RESULT_CACHE_SIZE = int(os.getenv('RESULT_CACHE_SIZE', 4096))
+# Vida máxima de la respuesta en caché (proceso, proxy y navegador); nunca pasa de
+# lo que le queda a la clave en Redis, para no servir un resultado que ya expiró.
+RESULT_CACHE_MAX_AGE = int(os.getenv('RESULT_CACHE_MAX_AGE', os.getenv('RESULT_TTL', 3600)))
+# Las respuestas "processing" cambian en cada sondeo: ningún proxy debe guardarlas.
+NO_STORE = "no-store"
+
+
+def cache_control(max_age: int) -> str:
+    return f"public, max-age={max_age}, immutable"
+
+
+def make_etag(body: bytes) -> str:
+    return '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    # If-None-Match usa comparación débil: se ignora el prefijo W/ de cada valor.
+    if not if_none_match:
+        return False
+    for value in if_none_match.split(','):
+        value = value.strip()
+        if value == '*' or value.removeprefix('W/') == etag:
+            return True
+    return False
+
+
+class ResultCache:
+    def __init__(self, size: int = RESULT_CACHE_SIZE, max_age: int = RESULT_CACHE_MAX_AGE):
+        self._size = size
+        self._max_age = max_age
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, task_id: str) -> Optional[Tuple[str, bytes, int]]:
+        # Devuelve ETag, cuerpo y segundos de vida que le quedan.
+        with self._lock:
+            entry = self._entries.get(task_id)
+            if entry is None:
+                return None
+            etag, body, expires_at = entry
+            remaining = int(expires_at - time.monotonic())
+            if remaining <= 0:
+                del self._entries[task_id]
+                return None
+            self._entries.move_to_end(task_id)
+            return etag, body, remaining
+
+    def put(self, task_id: str, body: bytes, ttl: int) -> Tuple[str, bytes, int]:
+        # ttl: lo que le queda a la clave en Redis (TTL; -1 = sin caducidad).
+        max_age = self._max_age if ttl < 0 else min(ttl, self._max_age)
+        etag = make_etag(body)
+        if self._size > 0 and max_age > 0:
+            with self._lock:
+                self._entries[task_id] = (etag, body, time.monotonic() + max_age)
+                self._entries.move_to_end(task_id)
+                while len(self._entries) > self._size:
+                    self._entries.popitem(last=False)
+        return etag, body, max_age
@@ -0,0 +1,125 @@
+import json
+import zlib
+from typing import List, Optional
+from redis.exceptions import ResponseError
+from redis_topology import tagged
+
+NUTRIENTS = {
+    'cal': ('calorías', 'kcal', 'Energía proporcionada por el alimento'),
+    'prot': ('proteínas', 'g', 'Esenciales para el crecimiento y reparación muscular'),
+    'carb': ('carbohidratos', 'g', 'Fuente principal de energía'),
+    'gras': ('grasas', 'g', 'Importantes para la absorción de vitaminas'),
+    'fib': ('fibra', 'g', 'Ayuda a la digestión y salud intestinal'),
+    'conf': ('confianza', '%', 'Nivel de confianza del análisis'),
+}
+
+
+def result_key(task_id: str) -> str:
+    return f"analysis:{tagged(task_id)}"
+
+
+def raw_key(task_id: str) -> str:
+    return f"analysis:{tagged(task_id)}:raw"
+
+
+# Claves sin etiqueta de hash de los resultados guardados antes de Sentinel/Cluster:
+# se siguen leyendo hasta que caducan (RESULT_TTL), así un despliegue no pierde los
+# resultados que los clientes aún consultan.
+def legacy_result_key(task_id: str) -> str:
+    return f"analysis:{task_id}"
+
+
+def result_exists(redis_conn, task_id: str) -> bool:
+    # Dos EXISTS y no uno con las dos claves: en Cluster están en slots distintos.
+    pipe = redis_conn.pipeline(transaction=False)
+    pipe.exists(result_key(task_id))
+    pipe.exists(legacy_result_key(task_id))
+    return any(pipe.execute())
+
+
+def result_ttl(redis_conn, task_id: str) -> int:
+    ttl = redis_conn.ttl(result_key(task_id))
+    return ttl if ttl != -2 else redis_conn.ttl(legacy_result_key(task_id))
+
+
+def _number(value: str):
+    number = float(value)
+    return int(number) if number == int(number) else number
+
+
+def expand_result(task_id: str, fields: dict, raw: Optional[bytes] = None) -> dict:
+    result = {'task_id': task_id}
+    name = fields.get('comida')
+    if name:
+        result['nombre'] = name
+        result['alimento'] = name
+        result['food_type'] = name
+
+    for field, (key, unit, description) in NUTRIENTS.items():
+        if field in fields:
+            result[key] = {
+                'value': _number(fields[field]),
+                'unit': unit,
+                'description': description,
+            }
+
+    if raw:
+        result['raw_analysis'] = zlib.decompress(raw).decode('utf-8')
+
+    for field in ('status', 'filename', 'model', 'timestamp', 'error'):
+        if field in fields:
+            result[field] = fields[field]
+    if 'attempts' in fields:
+        result['attempts'] = int(fields['attempts'])
+    if fields.get('terminal') == '1':
+        result['terminal'] = True
+    return result
+
+
+def _decode_fields(fields: dict) -> dict:
+    return {k.decode('utf-8'): v.decode('utf-8') for k, v in fields.items()}
+
+
+def _load(binary_conn, task_ids: List[str], keys: List[str]) -> List[Optional[dict]]:
+    pipe = binary_conn.pipeline(transaction=False)
+    for key in keys:
+        pipe.hgetall(key)
+        pipe.get(key + ':raw')
+    replies = pipe.execute(raise_on_error=False)
+
+    results = []
+    legacy = []
+    for index, task_id in enumerate(task_ids):
+        fields, raw = replies[2 * index], replies[2 * index + 1]
+        if isinstance(fields, ResponseError):
+            # Resultados guardados antes del formato compacto (cadena JSON).
+            legacy.append(index)
+            results.append(None)
+        elif fields:
+            results.append(expand_result(task_id, _decode_fields(fields), raw))
+        else:
+            results.append(None)
+
+    if legacy:
+        # GET por clave en lugar de MGET: en Cluster las claves están en slots distintos.
+        pipe = binary_conn.pipeline(transaction=False)
+        for index in legacy:
+            pipe.get(keys[index])
+        values = pipe.execute()
+        for index, value in zip(legacy, values):
+            results[index] = json.loads(value) if value else None
+    return results
+
+
+def load_results(binary_conn, task_ids: List[str]) -> List[Optional[dict]]:
+    results = _load(binary_conn, task_ids, [result_key(task_id) for task_id in task_ids])
+    missing = [index for index, result in enumerate(results) if result is None]
+    if missing:
+        old = _load(binary_conn, [task_ids[i] for i in missing], [legacy_result_key(task_ids[i]) for i in missing])
+        for index, result in zip(missing, old):
+            results[index] = result
+    return results
+
+
+def load_result(binary_conn, task_id: str) -> Optional[dict]:
+    return load_results(binary_conn, [task_id])[0]
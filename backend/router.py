@@ -0,0 +1,141 @@
+import os
+import time
+import logging
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+ROUTING_ENGINES = [e.strip() for e in os.getenv('ROUTING_ENGINES', 'llava,gpt4').split(',') if e.strip()]
+# Orden de preferencia para la cola normal (de más barato a más caro).
+ROUTING_NORMAL_PREFERENCE = [e.strip() for e in os.getenv('ROUTING_NORMAL_PREFERENCE', 'llava,gpt4').split(',') if e.strip()]
+ROUTING_NORMAL_MAX_WAIT = float(os.getenv('ROUTING_NORMAL_MAX_WAIT', 45))
+ROUTING_CACHE_SECONDS = float(os.getenv('ROUTING_CACHE_SECONDS', 1))
+WORKER_ALIVE_SECONDS = int(os.getenv('WORKER_ALIVE_SECONDS', 30))
+CIRCUIT_ERROR_RATE = float(os.getenv('CIRCUIT_ERROR_RATE', 0.5))
+CIRCUIT_MIN_SAMPLES = int(os.getenv('CIRCUIT_MIN_SAMPLES', 5))
+CIRCUIT_COOLDOWN = int(os.getenv('CIRCUIT_COOLDOWN', 30))
+HEALTH_BUCKET_SECONDS = 10
+DEFAULT_LATENCY = {'llava': 20.0, 'gpt4': 8.0}
+
+
+def engine_queue(base_queue: str, engine: str) -> str:
+    return f"{base_queue}.{engine}"
+
+
+def queue_engine(queue: str) -> Optional[str]:
+    engine = queue.rsplit('.', 1)[-1] if '.' in queue else None
+    return engine if engine in ROUTING_ENGINES else None
+
+
+def _percentile(values, fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class EngineRouter:
+    def __init__(self, get_redis, get_backlog):
+        self._get_redis = get_redis
+        self._get_backlog = get_backlog
+        self._snapshot = None
+        self._snapshot_at = 0.0
+
+    def snapshot(self) -> dict:
+        now = time.time()
+        if self._snapshot is not None and now - self._snapshot_at < ROUTING_CACHE_SECONDS:
+            return self._snapshot
+
+        redis_conn = self._get_redis()
+        if redis_conn is None:
+            return {}
+
+        buckets = [int(now // HEALTH_BUCKET_SECONDS) - i for i in range(CIRCUIT_COOLDOWN // HEALTH_BUCKET_SECONDS)]
+        pipe = redis_conn.pipeline(transaction=False)
+        for engine in ROUTING_ENGINES:
+            pipe.zcount(f"engine:{engine}:workers", now - WORKER_ALIVE_SECONDS, '+inf')
+            pipe.lrange(f"engine:{engine}:latency", 0, 99)
+            pipe.exists(f"engine:{engine}:circuit_open")
+            for bucket in buckets:
+                pipe.hmget(f"engine:{engine}:outcomes:{bucket}", 'ok', 'error')
+        replies = pipe.execute()
+
+        snapshot = {}
+        step = 3 + len(buckets)
+        for index, engine in enumerate(ROUTING_ENGINES):
+            alive, latencies, circuit_open, *outcomes = replies[index * step:(index + 1) * step]
+            ok = sum(int(o or 0) for o, _ in outcomes)
+            errors = sum(int(e or 0) for _, e in outcomes)
+            samples = [float(value) for value in latencies]
+            mean = sum(samples) / len(samples) if samples else DEFAULT_LATENCY.get(engine, 15.0)
+            p95 = _percentile(samples, 0.95) if samples else mean
+            error_rate = errors / (ok + errors) if ok + errors else 0.0
+
+            if not circuit_open and ok + errors >= CIRCUIT_MIN_SAMPLES and error_rate >= CIRCUIT_ERROR_RATE:
+                redis_conn.set(f"engine:{engine}:circuit_open", '1', ex=CIRCUIT_COOLDOWN)
+                circuit_open = 1
+                logger.warning(f"Circuito abierto para {engine}: tasa de error {error_rate:.0%}")
+
+            snapshot[engine] = {
+                'workers': int(alive),
+                'latency_mean': round(mean, 2),
+                'latency_p95': round(p95, 2),
+                'error_rate': round(error_rate, 3),
+                'circuit_open': bool(circuit_open),
+            }
+
+        self._snapshot = snapshot
+        self._snapshot_at = now
+        return snapshot
+
+    def _estimated_wait(self, engine: str, stats: dict, base_queue: str) -> float:
+        backlog = self._get_backlog(engine_queue(base_queue, engine))
+        return backlog * stats['latency_mean'] / max(1, stats['workers'])
+
+    def estimated_wait(self, queues) -> Optional[float]:
+        # Espera estimada (s) para una tarea nueva que queda detrás de `queues`
+        # en el mejor motor disponible; None si no hay métricas para estimarla.
+        snapshot = self.snapshot()
+        healthy = {engine: stats for engine, stats in snapshot.items()
+                   if stats['workers'] > 0 and not stats['circuit_open']}
+        if not healthy:
+            return None
+
+        total_workers = sum(stats['workers'] for stats in healthy.values())
+        shared = sum(self._get_backlog(queue) for queue in queues)
+        waits = []
+        for engine, stats in healthy.items():
+            own = sum(self._get_backlog(engine_queue(queue, engine)) for queue in queues)
+            waits.append((own / stats['workers'] + shared / total_workers) * stats['latency_mean'])
+        return min(waits)
+
+    def latency_p95(self, engine: Optional[str]) -> float:
+        try:
+            stats = self.snapshot().get(engine) if engine else None
+        except Exception:
+            stats = None
+        if stats:
+            return stats['latency_p95']
+        return max(DEFAULT_LATENCY.values())
+
+    def select_queue(self, base_queue: str, priority: bool, exclude: Optional[str] = None) -> str:
+        try:
+            snapshot = self.snapshot()
+        except Exception as e:
+            logger.warning(f"Sin métricas de motores, usando cola compartida: {e}")
+            return base_queue
+
+        healthy = {engine: stats for engine, stats in snapshot.items()
+                   if stats['workers'] > 0 and not stats['circuit_open'] and engine != exclude}
+        if not healthy:
+            return base_queue
+
+        completion = {engine: self._estimated_wait(engine, stats, base_queue) + stats['latency_p95']
+                      for engine, stats in healthy.items()}
+
+        if not priority:
+            for engine in ROUTING_NORMAL_PREFERENCE:
+                if engine in healthy and completion[engine] <= ROUTING_NORMAL_MAX_WAIT:
+                    return engine_queue(base_queue, engine)
+
+        engine = min(completion, key=completion.get)
+        return engine_queue(base_queue, engine)
+
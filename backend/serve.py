@@ -0,0 +1,24 @@
+import os
+import uvicorn
+
+# Un proceso por núcleo: cada uno con su bucle uvloop y su pool de CPU propio.
+WEB_CONCURRENCY = int(os.getenv('WEB_CONCURRENCY', 0)) or (os.cpu_count() or 1)
+PORT = int(os.getenv('PORT', 5000))
+
+
+def main():
+    uvicorn.run(
+        'app:app',
+        host='0.0.0.0',
+        port=PORT,
+        workers=WEB_CONCURRENCY,
+        loop='uvloop',
+        http='httptools',
+        proxy_headers=True,
+        forwarded_allow_ips='*',
+        access_log=os.getenv('ACCESS_LOG', 'false').lower() in ('1', 'true', 'yes'),
+    )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+import fakeredis
+import pytest
+import admission
+from admission import AdmissionRejected, client_id, take_tokens
+
+
+@pytest.fixture
+def redis_conn():
+    return fakeredis.FakeRedis(decode_responses=True)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1_000_000.0]
+    monkeypatch.setattr(admission.time, 'time', lambda: now[0])
+    return now
+
+
+def test_client_id_valid_key_gets_own_bucket():
+    assert client_id('secreta', '1.2.3.4', '10.0.0.1', valid_keys=['secreta']).startswith('key:')
+
+
+def test_client_id_unknown_key_falls_back_to_ip():
+    first = client_id('inventada-1', '1.2.3.4', '10.0.0.1', valid_keys=['secreta'])
+    second = client_id('inventada-2', '1.2.3.4', '10.0.0.1', valid_keys=['secreta'])
+    assert first == second == 'ip:1.2.3.4'
+
+
+def test_client_id_uses_proxy_entry_of_forwarded_for():
+    # El cliente puede anteponer direcciones falsas; la última la añade Traefik.
+    assert client_id(None, '6.6.6.6, 1.2.3.4', '10.0.0.1', valid_keys=[]) == 'ip:1.2.3.4'
+    assert client_id(None, None, '10.0.0.1', valid_keys=[]) == 'ip:10.0.0.1'
+
+
+def test_take_tokens_refills_over_time(redis_conn, clock, monkeypatch):
+    monkeypatch.setattr(admission, 'RATE_LIMIT_PER_MINUTE', 60)
+    monkeypatch.setattr(admission, 'RATE_LIMIT_BURST', 3)
+    assert [take_tokens(redis_conn, 'ip:a')[0] for _ in range(3)] == [True, True, True]
+    allowed, retry_after = take_tokens(redis_conn, 'ip:a')
+    assert not allowed and retry_after == pytest.approx(1)
+    clock[0] += 1
+    assert take_tokens(redis_conn, 'ip:a')[0]
+    # Otro cliente tiene su propio bucket.
+    assert take_tokens(redis_conn, 'ip:b')[0]
+
+
+def test_take_tokens_capacity_does_not_grow_with_cost(redis_conn, clock, monkeypatch):
+    monkeypatch.setattr(admission, 'RATE_LIMIT_PER_MINUTE', 60)
+    monkeypatch.setattr(admission, 'RATE_LIMIT_BURST', 3)
+    allowed, _ = take_tokens(redis_conn, 'ip:a', cost=5)
+    assert not allowed
+    clock[0] += 3600
+    assert not take_tokens(redis_conn, 'ip:a', cost=5)[0]
+
+
+class FakeRouter:
+    def __init__(self, wait=None):
+        self.wait = wait
+
+    def estimated_wait(self, queues):
+        return self.wait
+
+
+def test_admit_rejects_cost_above_burst(redis_conn, clock, monkeypatch):
+    monkeypatch.setattr(admission, 'RATE_LIMIT_BURST', 3)
+    with pytest.raises(AdmissionRejected) as rejected:
+        admission.admit(redis_conn, FakeRouter(), 'ip:a', False, [], cost=4)
+    assert rejected.value.status_code == 413
+    assert rejected.value.retry_after is None
+    assert redis_conn.hget(admission.STATS_KEY, 'rejected_413') == '4'
+
+
+def test_max_request_cost_follows_burst(monkeypatch):
+    monkeypatch.setattr(admission, 'RATE_LIMIT_BURST', 10)
+    assert admission.max_request_cost(20) == 10
+    assert admission.max_request_cost(5) == 5
+    monkeypatch.setattr(admission, 'RATE_LIMIT_PER_MINUTE', 0)
+    assert admission.max_request_cost(20) == 20
+
+
+def test_admit_reserves_capacity_for_priority(redis_conn, clock, monkeypatch):
+    monkeypatch.setattr(admission, 'ADMISSION_MAX_WAIT', 100)
+    monkeypatch.setattr(admission, 'ADMISSION_PRIORITY_RESERVE', 0.25)
+    router = FakeRouter(wait=90)
+    admission.admit(redis_conn, router, 'ip:a', True, [])
+    with pytest.raises(AdmissionRejected) as rejected:
+        admission.admit(redis_conn, router, 'ip:b', False, [])
+    assert rejected.value.status_code == 503
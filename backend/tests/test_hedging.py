@@ -0,0 +1,56 @@
+import fakeredis
+import pytest
+import hedging
+from hedging import hedge_delay, hedge_queue
+
+
+class FakeRouter:
+    def __init__(self, p95=None):
+        self.p95 = p95 or {}
+        self.asked = []
+        self.excluded = None
+
+    def latency_p95(self, engine):
+        self.asked.append(engine)
+        return self.p95.get(engine, 20.0)
+
+    def select_queue(self, base_queue, priority, exclude=None):
+        self.excluded = exclude
+        return f"{base_queue}.gpt4"
+
+
+@pytest.fixture(autouse=True)
+def limits(monkeypatch):
+    monkeypatch.setattr(hedging, 'HEDGE_P95_FACTOR', 1.5)
+    monkeypatch.setattr(hedging, 'HEDGE_MIN_DELAY', 5)
+    monkeypatch.setattr(hedging, 'HEDGE_MAX_DELAY', 60)
+
+
+def test_delay_uses_p95_of_primary_engine():
+    router = FakeRouter({'llava': 20.0, 'gpt4': 4.0})
+    assert hedge_delay(router, 'food_analysis_priority_queue.llava') == pytest.approx(30.0)
+    assert router.asked == ['llava']
+
+
+def test_delay_is_clamped():
+    assert hedge_delay(FakeRouter({'gpt4': 1.0}), 'cola.gpt4') == 5
+    assert hedge_delay(FakeRouter({'llava': 200.0}), 'cola.llava') == 60
+
+
+def test_shared_queue_has_no_engine():
+    router = FakeRouter()
+    hedge_delay(router, 'food_analysis_priority_queue')
+    assert router.asked == [None]
+
+
+def test_hedge_goes_to_another_engine():
+    router = FakeRouter()
+    assert hedge_queue(router, 'cola', 'cola.llava') == 'cola.gpt4'
+    assert router.excluded == 'llava'
+
+
+def test_record_counts_and_survives_redis_errors():
+    redis_conn = fakeredis.FakeRedis(decode_responses=True)
+    hedging.record(redis_conn, 'hedges_sent', 2)
+    assert redis_conn.hget(hedging.STATS_KEY, 'hedges_sent') == '2'
+    hedging.record(None, 'hedges_sent')
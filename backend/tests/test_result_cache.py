@@ -0,0 +1,51 @@
+import pytest
+import result_cache
+from result_cache import ResultCache, etag_matches, make_etag
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(result_cache.time, 'monotonic', lambda: now[0])
+    return now
+
+
+def test_lifetime_follows_redis_ttl(clock):
+    cache = ResultCache(size=10, max_age=3600)
+    etag, body, max_age = cache.put('t1', b'{"a":1}', ttl=120)
+    assert max_age == 120 and etag == make_etag(b'{"a":1}')
+    clock[0] += 100
+    assert cache.get('t1') == (etag, body, 20)
+    clock[0] += 20
+    assert cache.get('t1') is None
+
+
+def test_lifetime_is_capped_by_max_age(clock):
+    cache = ResultCache(size=10, max_age=60)
+    assert cache.put('t1', b'x', ttl=3000)[2] == 60
+    assert cache.put('t2', b'y', ttl=-1)[2] == 60
+
+
+def test_expired_key_is_not_cached(clock):
+    cache = ResultCache(size=10, max_age=60)
+    cache.put('t1', b'x', ttl=0)
+    assert cache.get('t1') is None
+
+
+def test_least_recently_used_is_evicted(clock):
+    cache = ResultCache(size=2, max_age=60)
+    cache.put('a', b'a', 60)
+    cache.put('b', b'b', 60)
+    cache.get('a')
+    cache.put('c', b'c', 60)
+    assert cache.get('b') is None
+    assert cache.get('a') and cache.get('c')
+
+
+def test_etag_matching():
+    etag = make_etag(b'cuerpo')
+    assert etag_matches(etag, etag)
+    assert etag_matches(f'"otro", W/{etag}', etag)
+    assert etag_matches('*', etag)
+    assert not etag_matches('"otro"', etag)
+    assert not etag_matches(None, etag)
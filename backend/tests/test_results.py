@@ -0,0 +1,30 @@
+import json
+import zlib
+import fakeredis
+from results import load_results, result_exists, result_ttl, result_key, legacy_result_key
+
+
+def test_reads_tagged_and_legacy_keys():
+    conn = fakeredis.FakeRedis()
+    conn.hset(result_key('abcdef12-nuevo'), mapping={'comida': 'paella', 'cal': '500', 'status': 'completed'})
+    conn.set(result_key('abcdef12-nuevo') + ':raw', zlib.compress('texto'.encode()))
+    # Formato compacto bajo la clave anterior a las etiquetas de hash.
+    conn.hset(legacy_result_key('viejo-hash'), mapping={'comida': 'sopa', 'cal': '120', 'status': 'completed'})
+    # Formato JSON original bajo la clave anterior.
+    conn.set(legacy_result_key('viejo-json'), json.dumps({'task_id': 'viejo-json', 'nombre': 'tortilla'}))
+
+    new, old_hash, old_json, missing = load_results(conn, ['abcdef12-nuevo', 'viejo-hash', 'viejo-json', 'nada'])
+    assert new['nombre'] == 'paella' and new['raw_analysis'] == 'texto'
+    assert old_hash['nombre'] == 'sopa' and old_hash['calorías']['value'] == 120
+    assert old_json['nombre'] == 'tortilla'
+    assert missing is None
+
+
+def test_exists_and_ttl_fall_back_to_legacy_key():
+    conn = fakeredis.FakeRedis()
+    conn.hset(legacy_result_key('viejo'), 'status', 'completed')
+    conn.expire(legacy_result_key('viejo'), 300)
+    assert result_exists(conn, 'viejo')
+    assert 0 < result_ttl(conn, 'viejo') <= 300
+    assert not result_exists(conn, 'ninguno')
+    assert result_ttl(conn, 'ninguno') == -2
@@ -0,0 +1,136 @@
+import base64
+import io
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional, Tuple
+from fastapi import HTTPException, UploadFile
+from starlette.responses import JSONResponse
+from PIL import Image
+from coalescing import image_hash
+
+ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'webp'}
+MAX_UPLOAD_BYTES = int(float(os.getenv('MAX_UPLOAD_MB', 10)) * 1024 * 1024)
+MAX_BATCH_FILES = int(os.getenv('MAX_BATCH_FILES', 20))
+UPLOAD_CHUNK_SIZE = 64 * 1024
+CPU_POOL_WORKERS = int(os.getenv('CPU_POOL_WORKERS', 2))
+
+_cpu_pool = None
+
+
+class UploadTooLarge(Exception):
+    pass
+
+
+# Corta las subidas que superan el límite mientras llegan, antes de que el
+# parser multipart las vuelque a disco o memoria.
+class UploadLimitMiddleware:
+    def __init__(self, app, max_bytes: int = MAX_UPLOAD_BYTES, max_batch_bytes: int = MAX_UPLOAD_BYTES * MAX_BATCH_FILES):
+        self.app = app
+        self.max_bytes = max_bytes
+        self.max_batch_bytes = max_batch_bytes
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or scope['method'] not in ('POST', 'PUT'):
+            await self.app(scope, receive, send)
+            return
+
+        limit = self.max_batch_bytes if scope['path'].endswith('/batch') else self.max_bytes
+        content_length = dict(scope['headers']).get(b'content-length')
+        if content_length and content_length.isdigit() and int(content_length) > limit:
+            await self._reject(scope, receive, send, limit)
+            return
+
+        received = 0
+        exceeded = False
+
+        async def limited_receive():
+            nonlocal received, exceeded
+            message = await receive()
+            if message['type'] == 'http.request':
+                received += len(message.get('body', b''))
+                if received > limit:
+                    exceeded = True
+                    raise UploadTooLarge()
+            return message
+
+        response_started = False
+
+        async def guarded_send(message):
+            nonlocal response_started
+            # FastAPI convierte el error del parser en un 400; se sustituye por el 413.
+            if exceeded:
+                return
+            response_started = True
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, guarded_send)
+        except UploadTooLarge:
+            pass
+        if exceeded and not response_started:
+            await self._reject(scope, receive, send, limit)
+
+    async def _reject(self, scope, receive, send, limit: int):
+        response = JSONResponse(
+            status_code=413,
+            content={"detail": f"Archivo demasiado grande (máximo {limit // (1024 * 1024)} MB)"}
+        )
+        await response(scope, receive, send)
+
+
+async def read_upload(upload: UploadFile, max_bytes: int = MAX_UPLOAD_BYTES) -> bytes:
+    chunks = []
+    size = 0
+    while True:
+        chunk = await upload.read(UPLOAD_CHUNK_SIZE)
+        if not chunk:
+            break
+        size += len(chunk)
+        if size > max_bytes:
+            raise HTTPException(status_code=413,
+                                detail=f"Archivo demasiado grande: {upload.filename} (máximo {max_bytes // (1024 * 1024)} MB)")
+        chunks.append(chunk)
+    return b''.join(chunks)
+
+
+def check_filename(filename: Optional[str]):
+    if not filename:
+        raise HTTPException(status_code=400, detail="No se seleccionó archivo")
+
+    file_extension = filename.rsplit('.', 1)[1].lower() if '.' in filename else ''
+    if file_extension not in ALLOWED_EXTENSIONS:
+        raise HTTPException(status_code=400, detail=f"Formato de imagen no válido: {filename}")
+
+
+def inspect_image(image_bytes: bytes) -> Tuple[bool, str, str]:
+    # Se ejecuta en el pool de procesos: verificación PIL, hash y base64 son CPU puro.
+    try:
+        image_pil = Image.open(io.BytesIO(image_bytes))
+        image_pil.verify()
+    except Exception:
+        return False, '', ''
+    return True, image_hash(image_bytes), base64.b64encode(image_bytes).decode('utf-8')
+
+
+def start_cpu_pool():
+    global _cpu_pool
+    if _cpu_pool is None and CPU_POOL_WORKERS > 0:
+        _cpu_pool = ProcessPoolExecutor(max_workers=CPU_POOL_WORKERS,
+                                        mp_context=multiprocessing.get_context('spawn'))
+    return _cpu_pool
+
+
+def stop_cpu_pool():
+    global _cpu_pool
+    if _cpu_pool is not None:
+        _cpu_pool.shutdown(wait=False, cancel_futures=True)
+        _cpu_pool = None
+
+
+async def prepare_image(loop, filename: Optional[str], image_bytes: bytes) -> Tuple[str, str]:
+    check_filename(filename)
+    valid, digest, image_b64 = await loop.run_in_executor(_cpu_pool, inspect_image, image_bytes)
+    if not valid:
+        raise HTTPException(status_code=400, detail=f"Imagen corrupta o no válida: {filename}")
+    return digest, image_b64
@@ -1,7 +1,8 @@
 import React, { useState } from 'react';
 import ImageUploader from './components/ImageUploader';
 import ResultView from './components/ResultView';
-import { analyzeImage, getResults } from './services/api';
+import { analyzeImage, getResults, cancelTask, lookupCachedResult } from './services/api';
+import { prepareImage } from './services/imageCompressor';
 
 function App() {
   const [currentView, setCurrentView] = useState('index'); // 'index', 'result'
@@ -10,7 +11,7 @@ function App() {
   const [uploadedImage, setUploadedImage] = useState(null);
   const [isLoading, setIsLoading] = useState(false);
 
-  const handleImageUpload = async (imageFile, priority = false) => {
+  const handleImageUpload = async (imageFile, priority = false, onProgress) => {
     try {
       setIsLoading(true);
       
@@ -18,11 +19,22 @@ function App() {
       const imageUrl = URL.createObjectURL(imageFile);
       setUploadedImage(imageUrl);
       
-      // Enviar imagen para análisis
-      const response = await analyzeImage(imageFile, priority);
+      // Reducir la imagen en un Web Worker y calcular su hash antes de subirla
+      const prepared = await prepareImage(imageFile, (percent) =>
+        onProgress?.({ label: 'Optimizando imagen', percent: Math.round(percent * 0.4) })
+      );
+      console.log(`Imagen preparada: ${(imageFile.size / 1024).toFixed(0)} KB -> ${(prepared.file.size / 1024).toFixed(0)} KB`);
+      
+      // Si la misma imagen ya se analizó, no hace falta enviar los bytes
+      const cached = prepared.hash ? await lookupCachedResult(prepared.hash) : null;
+      const response = cached || await analyzeImage(prepared.file, priority, (percent) =>
+        onProgress?.({ label: 'Subiendo imagen', percent: 40 + Math.round(percent * 0.6) })
+      );
       setTaskId(response.task_id);
       
-      console.log(`Análisis ${priority ? 'prioritario' : 'normal'} iniciado - Cola: ${response.queue}`);
+      console.log(cached
+        ? `Resultado encontrado en caché para ${prepared.hash}`
+        : `Análisis ${priority ? 'prioritario' : 'normal'} iniciado - Cola: ${response.queue}`);
       
       // Cambiar a vista de resultado
       setCurrentView('result');
@@ -51,11 +63,17 @@ function App() {
           console.log('Analysis completed! Results:', response.results);
           setResults(response.results);
           setIsLoading(false);
+        } else if (response.status === 'error') {
+          setIsLoading(false);
+          alert('Error: ' + (response.message || 'No se pudo analizar la imagen'));
+        } else if (response.status === 'cancelled') {
+          console.log(`Task ${taskId} cancelled, polling stopped`);
         } else if (response.status === 'processing' && attempts < maxAttempts) {
           console.log(`Still processing... attempt ${attempts}/${maxAttempts}`);
           setTimeout(poll, 5000);
         } else {
           setIsLoading(false);
+          cancelTask(taskId);
           alert('Tiempo de espera agotado');
         }
       } catch (err) {
@@ -69,6 +87,10 @@ function App() {
   };
 
   const handleNewAnalysis = () => {
+    // Si el usuario abandona un análisis en curso, el worker no debe gastar inferencia en él
+    if (taskId && !results) {
+      cancelTask(taskId);
+    }
     setCurrentView('index');
     setTaskId(null);
     setResults(null);
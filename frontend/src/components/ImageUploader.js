@@ -4,6 +4,7 @@ const ImageUploader = ({ onImageUpload }) => {
   const [isDragOver, setIsDragOver] = useState(false);
   const [selectedFile, setSelectedFile] = useState(null);
   const [isPriority, setIsPriority] = useState(false);
+  const [progress, setProgress] = useState(null);
   const fileInputRef = useRef(null);
 
   const handleDragOver = (e) => {
@@ -39,9 +40,11 @@ const ImageUploader = ({ onImageUpload }) => {
     }
   };
 
-  const handleUpload = () => {
-    if (selectedFile) {
-      onImageUpload(selectedFile, isPriority);
+  const handleUpload = async () => {
+    if (selectedFile && !progress) {
+      setProgress({ label: 'Optimizando imagen', percent: 0 });
+      await onImageUpload(selectedFile, isPriority, setProgress);
+      setProgress(null);
     }
   };
 
@@ -113,9 +116,22 @@ const ImageUploader = ({ onImageUpload }) => {
             </label>
           </div>
           
+          {progress && (
+            <div className="progress-section" style={{ display: 'flex' }}>
+              <div className="progress-header">
+                <p className="progress-text">{progress.label}</p>
+                <p className="progress-text">{progress.percent}%</p>
+              </div>
+              <div className="progress-bar-container">
+                <div className="progress-bar" style={{ width: `${progress.percent}%` }}></div>
+              </div>
+            </div>
+          )}
+          
           <button 
             className="btn btn-primary analyze-btn"
             onClick={handleUpload}
+            disabled={!!progress}
           >
             <span className="material-symbols-outlined">psychology</span>
             Analizar Imagen
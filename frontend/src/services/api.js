@@ -10,7 +10,7 @@ const api = axios.create({
   },
 });
 
-export const analyzeImage = async (imageFile, priority = false) => {
+export const analyzeImage = async (imageFile, priority = false, onUploadProgress) => {
   try {
     const formData = new FormData();
     formData.append('image', imageFile);
@@ -20,6 +20,11 @@ export const analyzeImage = async (imageFile, priority = false) => {
       headers: {
         'Content-Type': 'multipart/form-data',
       },
+      onUploadProgress: (event) => {
+        if (onUploadProgress && event.total) {
+          onUploadProgress(Math.round((event.loaded * 100) / event.total));
+        }
+      },
     });
 
     return response.data;
@@ -37,4 +42,24 @@ export const getResults = async (taskId) => {
   }
 };
 
+export const lookupCachedResult = async (hash) => {
+  try {
+    const response = await api.get(`/api/cache/${hash}`);
+    return response.data;
+  } catch (error) {
+    // 404 (sin resultado cacheado) o fallo de red: se sube la imagen igualmente
+    return null;
+  }
+};
+
+export const cancelTask = async (taskId) => {
+  try {
+    const response = await api.delete(`/api/results/${taskId}`);
+    return response.data;
+  } catch (error) {
+    // La cancelación es un aviso al backend: si falla, el worker descartará la tarea al vencer su plazo.
+    return null;
+  }
+};
+
 export default api;
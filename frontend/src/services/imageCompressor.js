@@ -0,0 +1,61 @@
+// Resolución útil para los modelos: LLaVA trabaja a 672 px y GPT-4o reduce
+// el lado corto a 768 px, así que subir más píxeles solo gasta ancho de banda.
+const MAX_SIDE = 1024;
+const JPEG_QUALITY = 0.85;
+
+const toHex = (buffer) =>
+  Array.from(new Uint8Array(buffer))
+    .map((byte) => byte.toString(16).padStart(2, '0'))
+    .join('');
+
+const supportsWorker = () =>
+  typeof Worker !== 'undefined' &&
+  typeof OffscreenCanvas !== 'undefined' &&
+  typeof createImageBitmap !== 'undefined';
+
+const renameAsJpeg = (name) => name.replace(/\.[^.]+$/, '') + '.jpg';
+
+const compressInWorker = (file, onProgress) =>
+  new Promise((resolve, reject) => {
+    const worker = new Worker(new URL('./imageWorker.js', import.meta.url));
+    worker.onmessage = ({ data }) => {
+      if (data.type === 'progress') {
+        onProgress?.(data.percent);
+        return;
+      }
+      worker.terminate();
+      if (data.type === 'done') {
+        resolve(data);
+      } else {
+        reject(new Error(data.message));
+      }
+    };
+    worker.onerror = (event) => {
+      worker.terminate();
+      reject(new Error(event.message));
+    };
+    worker.postMessage({ file, maxSide: MAX_SIDE, quality: JPEG_QUALITY });
+  });
+
+// Devuelve el archivo a subir (reducido si se pudo) y el SHA-256 de esos bytes,
+// que coincide con el hash que usa el backend para su caché de resultados.
+export const prepareImage = async (file, onProgress) => {
+  if (supportsWorker()) {
+    try {
+      const { blob, unchanged, hash } = await compressInWorker(file, onProgress);
+      const prepared = unchanged
+        ? file
+        : new File([blob], renameAsJpeg(file.name), { type: 'image/jpeg' });
+      onProgress?.(100);
+      return { file: prepared, hash };
+    } catch (err) {
+      console.warn('No se pudo comprimir la imagen, se sube la original:', err);
+    }
+  }
+
+  const hash = window.crypto?.subtle
+    ? toHex(await window.crypto.subtle.digest('SHA-256', await file.arrayBuffer()))
+    : null;
+  onProgress?.(100);
+  return { file, hash };
+};
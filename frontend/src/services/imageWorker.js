@@ -0,0 +1,40 @@
+/* eslint-disable no-restricted-globals */
+// Reduce y recodifica la imagen fuera del hilo principal y calcula su hash.
+
+const toHex = (buffer) =>
+  Array.from(new Uint8Array(buffer))
+    .map((byte) => byte.toString(16).padStart(2, '0'))
+    .join('');
+
+self.onmessage = async (event) => {
+  const { file, maxSide, quality } = event.data;
+  try {
+    self.postMessage({ type: 'progress', percent: 10 });
+    const bitmap = await createImageBitmap(file);
+    const scale = Math.min(1, maxSide / Math.max(bitmap.width, bitmap.height));
+    const width = Math.round(bitmap.width * scale);
+    const height = Math.round(bitmap.height * scale);
+
+    const canvas = new OffscreenCanvas(width, height);
+    canvas.getContext('2d').drawImage(bitmap, 0, 0, width, height);
+    bitmap.close();
+    self.postMessage({ type: 'progress', percent: 60 });
+
+    let blob = await canvas.convertToBlob({ type: 'image/jpeg', quality });
+    // Si la imagen ya era pequeña, recodificarla no compensa: se sube la original
+    // con su tipo y su nombre (el blob que llega al hilo principal es una copia).
+    const unchanged = scale === 1 && blob.size >= file.size;
+    if (unchanged) {
+      blob = file;
+    }
+    self.postMessage({ type: 'progress', percent: 85 });
+
+    // crypto.subtle solo existe en contextos seguros (https o localhost)
+    const hash = self.crypto?.subtle
+      ? toHex(await self.crypto.subtle.digest('SHA-256', await blob.arrayBuffer()))
+      : null;
+    self.postMessage({ type: 'done', blob: unchanged ? null : blob, unchanged, hash, width, height });
+  } catch (error) {
+    self.postMessage({ type: 'error', message: error.message });
+  }
+};
@@ -0,0 +1,137 @@
+import json
+import os
+import resource
+import sys
+import time
+import logging
+from typing import List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Precio en USD por millón de tokens (entrada, salida). OPENAI_PRICES añade o corrige
+# modelos, p. ej. {"gpt-4o": [2.5, 10]}; la Batch API cobra la mitad.
+DEFAULT_OPENAI_PRICES = {
+    'gpt-4o': (2.50, 10.00),
+    'gpt-4o-mini': (0.15, 0.60),
+    'gpt-4.1': (2.00, 8.00),
+    'gpt-4.1-mini': (0.40, 1.60),
+}
+OPENAI_PRICES = dict(DEFAULT_OPENAI_PRICES, **json.loads(os.getenv('OPENAI_PRICES') or '{}'))
+OPENAI_BATCH_DISCOUNT = float(os.getenv('OPENAI_BATCH_DISCOUNT', 0.5))
+
+# Agregados por motor y prioridad; el backend los expone en /api/admin/usage.
+USAGE_ENGINES_KEY = 'usage:engines'
+USAGE_PEAK_KEY = 'usage:peak_mb'
+ROLLUP_FIELDS = ('prefill_tokens', 'decode_tokens', 'gpu_seconds', 'cpu_seconds', 'wall_seconds', 'cost_usd')
+
+
+def priority_label(priority: bool) -> str:
+    return 'prioritaria' if priority else 'normal'
+
+
+def rollup_key(engine: str, priority: bool) -> str:
+    return f"usage:{engine}:{priority_label(priority)}"
+
+
+def openai_cost(model: str, prompt_tokens: int, completion_tokens: int, batch: bool = False) -> Optional[float]:
+    # Los modelos con fecha (gpt-4o-2024-08-06) usan el precio de su familia.
+    family = max((name for name in OPENAI_PRICES if model == name or model.startswith(name + '-')),
+                 key=len, default=None)
+    if family is None:
+        return None
+    price_in, price_out = OPENAI_PRICES[family]
+    cost = (prompt_tokens * price_in + completion_tokens * price_out) / 1_000_000
+    return cost * OPENAI_BATCH_DISCOUNT if batch else cost
+
+
+class UsageMeter:
+    # Mide una pasada del modelo: reloj, CPU del proceso (incluye los hilos de torch),
+    # GPU ocupada y pico de memoria. En CPU el pico es el máximo del proceso (ru_maxrss).
+    def __init__(self, device: str = 'cpu', cpu_clock=time.process_time):
+        self.device = device
+        self._cpu_clock = cpu_clock
+        self.prefill_tokens = []
+        self.decode_tokens = []
+        self.wall_seconds = 0.0
+        self.cpu_seconds = 0.0
+        self.peak_mb = 0.0
+
+    def __enter__(self):
+        torch = sys.modules.get('torch')
+        self._cuda = self.device == 'cuda' and torch is not None
+        if self._cuda:
+            torch.cuda.reset_peak_memory_stats()
+        self._wall = time.perf_counter()
+        self._cpu = self._cpu_clock()
+        return self
+
+    def __exit__(self, *exc):
+        if self._cuda:
+            torch = sys.modules['torch']
+            torch.cuda.synchronize()
+            self.peak_mb = torch.cuda.max_memory_allocated() / (1024 ** 2)
+        else:
+            self.peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        self.wall_seconds = time.perf_counter() - self._wall
+        self.cpu_seconds = self._cpu_clock() - self._cpu
+        return False
+
+    def add_tokens(self, prefill: List[int], decode: List[int]):
+        # Una entrada por imagen; llamadas repetidas (reintentos) se suman.
+        if not self.prefill_tokens:
+            self.prefill_tokens = [0] * len(prefill)
+            self.decode_tokens = [0] * len(decode)
+        self.prefill_tokens = [a + b for a, b in zip(self.prefill_tokens, prefill)]
+        self.decode_tokens = [a + b for a, b in zip(self.decode_tokens, decode)]
+
+    def report(self, index: int = 0, count: int = 1) -> dict:
+        # En un lote cada imagen carga con su parte del tiempo; el pico es el del lote.
+        usage = {
+            'wall_seconds': self.wall_seconds / count,
+            'cpu_seconds': self.cpu_seconds / count,
+            'gpu_seconds': self.wall_seconds / count if self.device == 'cuda' else 0.0,
+            'peak_mb': self.peak_mb,
+        }
+        if index < len(self.prefill_tokens):
+            usage['prefill_tokens'] = int(self.prefill_tokens[index])
+            usage['decode_tokens'] = int(self.decode_tokens[index])
+        if count > 1:
+            usage['batch'] = count
+        return usage
+
+
+def record_usage(redis_conn, items: List[tuple]):
+    # items: (usage, guardado). Las inferencias cuyo resultado se descartó (otra copia
+    # ganó el hedging) también costaron: cuentan como 'discarded'.
+    totals = {}
+    peaks = {}
+    for usage, stored in items:
+        if not usage or not usage.get('engine'):
+            continue
+        group = (usage['engine'], bool(usage.get('priority')))
+        total = totals.setdefault(group, {'tasks': 0, 'discarded': 0})
+        total['tasks'] += 1
+        total['discarded'] += 0 if stored else 1
+        for field in ROLLUP_FIELDS:
+            if usage.get(field):
+                total[field] = total.get(field, 0) + usage[field]
+        if usage.get('peak_mb'):
+            peaks[group] = max(peaks.get(group, 0), usage['peak_mb'])
+    if not totals:
+        return
+
+    try:
+        pipe = redis_conn.pipeline(transaction=False)
+        for (engine, priority), total in totals.items():
+            key = rollup_key(engine, priority)
+            for field, amount in total.items():
+                if isinstance(amount, int):
+                    pipe.hincrby(key, field, amount)
+                else:
+                    pipe.hincrbyfloat(key, field, amount)
+            pipe.sadd(USAGE_ENGINES_KEY, engine)
+        for (engine, priority), peak in peaks.items():
+            pipe.zadd(USAGE_PEAK_KEY, {f"{engine}:{priority_label(priority)}": peak}, gt=True)
+        pipe.execute()
+    except Exception as e:
+        logger.warning(f"No se pudo registrar el consumo de recursos: {e}")
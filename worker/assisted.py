@@ -0,0 +1,150 @@
+import os
+import time
+import logging
+from collections import deque
+import torch
+from transformers import AutoModelForCausalLM, AutoTokenizer, DynamicCache
+
+logger = logging.getLogger(__name__)
+
+ASSISTED_DRAFT_TOKENS = int(os.getenv('ASSISTED_DRAFT_TOKENS', 5))
+ASSISTED_MIN_ACCEPTANCE = float(os.getenv('ASSISTED_MIN_ACCEPTANCE', 0.4))
+ASSISTED_WINDOW = int(os.getenv('ASSISTED_WINDOW', 20))
+
+TOKENIZER_PROBE = "Comida: arroz con pollo. Calorías: 650 kcal, Proteínas: 35 g"
+
+
+class AssistedDecoder:
+    # Decodificación asistida (especulativa, voraz): un modelo de lenguaje pequeño
+    # que comparte tokenizador propone varios tokens y el modelo grande los verifica
+    # en una sola pasada. El borrador no ve la imagen, sólo el texto del prompt.
+    def __init__(self, model, tokenizer, draft_name: str, draft_tokens: int = ASSISTED_DRAFT_TOKENS,
+                 min_acceptance: float = ASSISTED_MIN_ACCEPTANCE, window: int = ASSISTED_WINDOW):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.draft_name = draft_name
+        self.draft_tokens = draft_tokens
+        self.min_acceptance = min_acceptance
+        self.enabled = False
+        self.draft = None
+        self._window = deque(maxlen=window)
+        self._image_token = getattr(model.config, 'image_token_index', None)
+
+    def load(self):
+        draft_tokenizer = AutoTokenizer.from_pretrained(self.draft_name)
+        if draft_tokenizer(TOKENIZER_PROBE).input_ids != self.tokenizer(TOKENIZER_PROBE).input_ids:
+            raise ValueError(f"El modelo borrador {self.draft_name} no comparte tokenizador con el principal")
+
+        device = next(self.model.parameters()).device
+        self.draft = AutoModelForCausalLM.from_pretrained(
+            self.draft_name,
+            dtype=torch.float16 if device.type == 'cuda' else torch.float32,
+            low_cpu_mem_usage=True,
+        ).to(device)
+        self.draft.eval()
+        self.enabled = True
+        logger.info(f"Decodificación asistida activada con {self.draft_name} "
+                    f"({self.draft_tokens} tokens propuestos por paso)")
+
+    @property
+    def acceptance(self) -> float:
+        proposed = sum(p for _, p in self._window)
+        return sum(a for a, _ in self._window) / proposed if proposed else 1.0
+
+    def stats(self) -> dict:
+        return {'draft_model': self.draft_name, 'enabled': self.enabled,
+                'acceptance': round(self.acceptance, 3), 'samples': len(self._window)}
+
+    @torch.no_grad()
+    def generate(self, inputs, max_new_tokens: int = 512) -> list:
+        if inputs['input_ids'].shape[0] != 1:
+            raise ValueError("La decodificación asistida sólo admite una imagen por pasada")
+        started = time.perf_counter()
+        eos = self.tokenizer.eos_token_id
+        vocab_size = self.draft.config.vocab_size
+
+        target_past = DynamicCache()
+        out = self.model(**inputs, past_key_values=target_past, use_cache=True)
+        target_past = out.past_key_values
+        sequence = [out.logits[0, -1].argmax(-1).item()]
+
+        prompt_ids = inputs['input_ids'][0]
+        if self._image_token is not None:
+            prompt_ids = prompt_ids[prompt_ids != self._image_token]
+        draft_past = DynamicCache()
+        self.draft(input_ids=prompt_ids.unsqueeze(0), past_key_values=draft_past, use_cache=True)
+        draft_prompt = draft_past.get_seq_length()
+        # Tokens confirmados que el borrador ya tiene en su caché.
+        draft_fed = 0
+
+        proposed = accepted = 0
+        device = prompt_ids.device
+        while len(sequence) < max_new_tokens and sequence[-1] != eos:
+            if sequence[-1] >= vocab_size:
+                # El borrador no puede seguir desde un token que no conoce: el resto se
+                # genera sólo con el modelo grande, cuya caché tiene todo salvo ese token.
+                logger.info(f"Token {sequence[-1]} fuera del vocabulario del borrador ({vocab_size}), "
+                            f"se termina la generación sin borrador")
+                self._decode_plain(sequence, target_past, max_new_tokens, eos, device)
+                break
+            steps = min(self.draft_tokens, max_new_tokens - len(sequence))
+            pending = torch.tensor([sequence[draft_fed:]], device=device)
+            candidates = []
+            for _ in range(steps):
+                logits = self.draft(input_ids=pending, past_key_values=draft_past, use_cache=True).logits
+                token = logits[0, -1].argmax(-1).item()
+                candidates.append(token)
+                pending = torch.tensor([[token]], device=device)
+
+            # El modelo grande verifica último token + propuestas en una sola pasada.
+            target_len = target_past.get_seq_length()
+            verify = torch.tensor([[sequence[-1]] + candidates], device=device)
+            logits = self.model(input_ids=verify, past_key_values=target_past, use_cache=True).logits
+            predictions = logits[0].argmax(-1).tolist()
+
+            n = 0
+            while n < steps and candidates[n] == predictions[n]:
+                n += 1
+            proposed += steps
+            accepted += n
+
+            confirmed = len(sequence)
+            new_tokens = candidates[:n] + [predictions[n]]
+            if eos in new_tokens:
+                new_tokens = new_tokens[:new_tokens.index(eos) + 1]
+            sequence.extend(new_tokens)
+
+            target_past.crop(target_len + 1 + n)
+            draft_fed = confirmed + min(n, steps - 1)
+            draft_past.crop(draft_prompt + draft_fed)
+
+        sequence = sequence[:max_new_tokens]
+        elapsed = time.perf_counter() - started
+        acceptance = accepted / proposed if proposed else 0.0
+        logger.info(f"Generación asistida: {len(sequence)} tokens en {elapsed:.2f}s "
+                    f"({len(sequence) / elapsed:.1f} tokens/s), aceptación {acceptance:.0%} "
+                    f"({accepted}/{proposed})")
+        self._record(accepted, proposed)
+        return sequence
+
+    def _decode_plain(self, sequence: list, target_past, max_new_tokens: int, eos, device):
+        while len(sequence) < max_new_tokens and sequence[-1] != eos:
+            logits = self.model(input_ids=torch.tensor([[sequence[-1]]], device=device),
+                                past_key_values=target_past, use_cache=True).logits
+            sequence.append(logits[0, -1].argmax(-1).item())
+
+    def _record(self, accepted: int, proposed: int):
+        if not proposed:
+            return
+        self._window.append((accepted, proposed))
+        # Con una aceptación baja el borrador sólo añade trabajo: se vuelve a la generación normal.
+        if len(self._window) == self._window.maxlen and self.acceptance < self.min_acceptance:
+            logger.warning(f"Aceptación del borrador {self.acceptance:.0%} por debajo de "
+                           f"{self.min_acceptance:.0%}, desactivando la decodificación asistida")
+            self.disable()
+
+    def disable(self):
+        self.enabled = False
+        self.draft = None
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
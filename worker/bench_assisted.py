@@ -0,0 +1,61 @@
+import argparse
+import time
+from PIL import Image
+from engine_llava import LlavaEngine, NUTRITION_PROMPT, MAX_NEW_TOKENS
+
+
+def timed(fn, *args):
+    started = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Velocidad de generación LLaVA normal frente a decodificación asistida")
+    parser.add_argument('images', nargs='+')
+    parser.add_argument('--model', default='llava-hf/llava-1.5-7b-hf')
+    parser.add_argument('--draft', default='double7/vicuna-68m', help="Modelo borrador con el mismo tokenizador")
+    parser.add_argument('--draft-tokens', type=int, default=None, help="Tokens propuestos por paso")
+    args = parser.parse_args()
+
+    engine = LlavaEngine({'model_name': args.model, 'draft_model': args.draft})
+    engine.load()
+    if engine.assisted is None:
+        print("No se pudo cargar el modelo borrador; revisa los logs")
+        return
+    if args.draft_tokens:
+        engine.assisted.draft_tokens = args.draft_tokens
+    # El umbral de aceptación no debe apagar el modo asistido a mitad de la medición.
+    engine.assisted.min_acceptance = 0
+    engine.warm_up()
+
+    tokenizer = engine.processor.tokenizer
+    device = next(engine.model.parameters()).device
+    plain_tokens = plain_seconds = assisted_tokens = assisted_seconds = 0
+    matches = 0
+    for path in args.images:
+        image = Image.open(path).convert('RGB')
+        inputs = engine.processor(text=NUTRITION_PROMPT, images=image, return_tensors="pt").to(device)
+
+        # Ambos modos en voraz: el texto debe coincidir y sólo cambia la velocidad.
+        plain_text, seconds = timed(engine.generate_plain, inputs, False)
+        plain_seconds += seconds
+        plain_tokens += len(tokenizer(plain_text, add_special_tokens=False).input_ids)
+
+        tokens, seconds = timed(engine.assisted.generate, inputs, MAX_NEW_TOKENS)
+        assisted_seconds += seconds
+        assisted_tokens += len(tokens)
+        matches += tokenizer.decode(tokens, skip_special_tokens=True).strip() == plain_text
+        print(f"{path}: normal {plain_seconds:.1f}s acumulado, asistida {assisted_seconds:.1f}s acumulado")
+
+    plain_rate = plain_tokens / plain_seconds
+    assisted_rate = assisted_tokens / assisted_seconds
+    stats = engine.assisted.stats()
+    print(f"Modelo: {args.model}  borrador: {args.draft}  dispositivo: {device}")
+    print(f"Normal:   {plain_rate:.1f} tokens/s")
+    print(f"Asistida: {assisted_rate:.1f} tokens/s  aceptación {stats['acceptance']:.0%}")
+    print(f"Aceleración: {assisted_rate / plain_rate:.2f}x  salidas idénticas: {matches}/{len(args.images)}")
+
+
+if __name__ == '__main__':
+    main()
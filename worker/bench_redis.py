@@ -0,0 +1,121 @@
+import argparse
+import hashlib
+import os
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+import storage
+from storage import store_result, result_key, raw_key, cache_key
+from redis_topology import create_redis, is_cluster
+from bench_storage import SAMPLE_RESULT
+
+# Compara topologías de Redis con el patrón de acceso real: el worker guarda cada
+# resultado con el script de storage.py y el backend lo consulta (HGETALL + GET del
+# análisis crudo), opcionalmente desde réplicas. Ejemplo con instancias locales:
+#   python bench_redis.py \
+#       --target standalone=localhost:6379 \
+#       --target sentinel=localhost:26379 \
+#       --target cluster=localhost:7000,localhost:7001,localhost:7002
+
+BENCH_HISTORY_STREAM = 'bench:history:stream'
+
+
+def percentile(values, fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def connect(spec: str, replica: bool = False, decode_responses: bool = True):
+    topology, _, nodes = spec.partition('=')
+    if topology == 'standalone':
+        host, _, port = nodes.partition(':')
+        return create_redis(decode_responses=decode_responses, replica=replica, topology=topology,
+                            host=host or None, port=int(port) if port else None)
+    return create_redis(decode_responses=decode_responses, replica=replica, topology=topology, nodes=nodes)
+
+
+def write_task(conn, _) -> tuple:
+    digest = hashlib.sha256(uuid.uuid4().bytes).hexdigest()
+    task_id = digest[:8] + str(uuid.uuid4())[8:]
+    started = time.perf_counter()
+    store_result(conn, task_id, dict(SAMPLE_RESULT, task_id=task_id), ttl=600, image_hash=digest, user='bench')
+    return task_id, digest, time.perf_counter() - started
+
+
+def read_task(conn, primary, task_id: str) -> float:
+    started = time.perf_counter()
+    pipe = conn.pipeline(transaction=False)
+    pipe.hgetall(result_key(task_id))
+    pipe.get(raw_key(task_id))
+    fields, _ = pipe.execute()
+    if not fields:
+        # Réplica con retraso: el backend repite la lectura en el primario.
+        primary.hgetall(result_key(task_id))
+    return time.perf_counter() - started
+
+
+def cleanup(conn, writes):
+    pipe = conn.pipeline(transaction=False)
+    for task_id, digest, _ in writes:
+        pipe.delete(result_key(task_id))
+        pipe.delete(raw_key(task_id))
+        pipe.delete(cache_key(digest))
+    pipe.delete(BENCH_HISTORY_STREAM)
+    pipe.execute()
+
+
+def run(spec: str, count: int, concurrency: int, replicas: bool) -> dict:
+    conn = connect(spec)
+    # Como el backend: lecturas con cliente binario (el análisis crudo va comprimido).
+    reader = connect(spec, replica=replicas, decode_responses=False)
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        started = time.perf_counter()
+        writes = list(pool.map(lambda i: write_task(conn, i), range(count)))
+        write_seconds = time.perf_counter() - started
+
+        task_ids = [task_id for task_id, _, _ in writes]
+        started = time.perf_counter()
+        reads = list(pool.map(lambda task_id: read_task(reader, conn, task_id), task_ids))
+        read_seconds = time.perf_counter() - started
+
+    nodes = len(conn.get_primaries()) if is_cluster(conn) else 1
+    cleanup(conn, writes)
+    write_latencies = [seconds for _, _, seconds in writes]
+    return {
+        'target': spec,
+        'nodes': nodes,
+        'write_ops': count / write_seconds,
+        'write_p50': percentile(write_latencies, 0.50),
+        'write_p99': percentile(write_latencies, 0.99),
+        'read_ops': count / read_seconds,
+        'read_p50': percentile(reads, 0.50),
+        'read_p99': percentile(reads, 0.99),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rendimiento de resultados en Redis standalone, Sentinel y Cluster")
+    parser.add_argument('--target', action='append', metavar='TOPOLOGÍA=NODOS',
+                        help="standalone=host:puerto, sentinel=host:puerto,... o cluster=host:puerto,...")
+    parser.add_argument('--count', type=int, default=20000)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--replicas', action='store_true', help="Lee los resultados desde las réplicas")
+    args = parser.parse_args()
+    targets = args.target or [f"standalone={os.getenv('REDIS_HOST', 'localhost')}:{os.getenv('REDIS_PORT', 6379)}"]
+
+    # El historial del benchmark va a un stream propio que se borra al terminar.
+    storage.HISTORY_STREAM = BENCH_HISTORY_STREAM
+    print(f"{'destino':<48} {'nodos':>5} {'escr/s':>9} {'p50':>8} {'p99':>8} {'lect/s':>9} {'p50':>8} {'p99':>8}")
+    for spec in targets:
+        try:
+            r = run(spec, args.count, args.concurrency, args.replicas)
+        except Exception as e:
+            print(f"{spec:<48} error: {e}")
+            continue
+        print(f"{r['target']:<48} {r['nodes']:>5} {r['write_ops']:>9.0f} {r['write_p50'] * 1000:>6.2f}ms "
+              f"{r['write_p99'] * 1000:>6.2f}ms {r['read_ops']:>9.0f} {r['read_p50'] * 1000:>6.2f}ms "
+              f"{r['read_p99'] * 1000:>6.2f}ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+import argparse
+import json
+import os
+import uuid
+import redis
+from storage import store_result, result_key, raw_key
+
+SAMPLE_RAW = """Comida: Plato de arroz blanco con pechuga de pollo a la plancha, ensalada de lechuga y tomate
+Calorías: 620 kcal
+Proteínas: 42 g
+Carbohidratos: 68 g
+Grasas: 16 g
+Fibra: 5 g
+Confianza: 85%"""
+
+SAMPLE_RESULT = {
+    'nombre': 'Plato de arroz blanco con pechuga de pollo a la plancha',
+    'alimento': 'Plato de arroz blanco con pechuga de pollo a la plancha',
+    'food_type': 'Plato de arroz blanco con pechuga de pollo a la plancha',
+    'calorías': {'value': 620.0, 'unit': 'kcal', 'description': 'Energía proporcionada por el alimento'},
+    'proteínas': {'value': 42.0, 'unit': 'g', 'description': 'Esenciales para el crecimiento y reparación muscular'},
+    'carbohidratos': {'value': 68.0, 'unit': 'g', 'description': 'Fuente principal de energía'},
+    'grasas': {'value': 16.0, 'unit': 'g', 'description': 'Importantes para la absorción de vitaminas'},
+    'fibra': {'value': 5.0, 'unit': 'g', 'description': 'Ayuda a la digestión y salud intestinal'},
+    'confianza': {'value': 85.0, 'unit': '%', 'description': 'Nivel de confianza del análisis'},
+    'raw_analysis': SAMPLE_RAW,
+    'model': 'GPT-4 Vision (gpt-4o)',
+    'filename': 'almuerzo.jpg',
+    'status': 'completed',
+    'timestamp': 'OpenAI GPT-4 Vision',
+}
+
+
+def used_memory(conn) -> int:
+    return int(conn.info('memory')['used_memory'])
+
+
+def bench_legacy(conn, count: int):
+    keys = []
+    before = used_memory(conn)
+    pipe = conn.pipeline(transaction=False)
+    for _ in range(count):
+        task_id = str(uuid.uuid4())
+        result = dict(SAMPLE_RESULT, task_id=task_id)
+        pipe.setex(result_key(task_id), 3600, json.dumps(result))
+        keys.append(result_key(task_id))
+    pipe.execute()
+    per_key = sum(conn.memory_usage(k) or 0 for k in keys[:100]) / min(count, 100)
+    return (used_memory(conn) - before) / count, per_key, keys
+
+
+def bench_compact(conn, count: int, with_raw: bool = True):
+    keys = []
+    sample = SAMPLE_RESULT if with_raw else {k: v for k, v in SAMPLE_RESULT.items() if k != 'raw_analysis'}
+    before = used_memory(conn)
+    for _ in range(count):
+        task_id = str(uuid.uuid4())
+        store_result(conn, task_id, dict(sample, task_id=task_id))
+        keys += [result_key(task_id), raw_key(task_id)]
+    per_key = sum(conn.memory_usage(k) or 0 for k in keys[:200]) / min(count, 100)
+    return (used_memory(conn) - before) / count, per_key, keys
+
+
+def bench_compact_without_raw(conn, count: int):
+    return bench_compact(conn, count, with_raw=False)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Memoria por resultado: JSON heredado vs. formato compacto")
+    parser.add_argument('--count', type=int, default=10000)
+    parser.add_argument('--host', default=os.getenv('REDIS_HOST', 'localhost'))
+    parser.add_argument('--port', type=int, default=int(os.getenv('REDIS_PORT', 6379)))
+    args = parser.parse_args()
+
+    conn = redis.Redis(host=args.host, port=args.port, db=15)
+    listpack_value = conn.config_get('hash-max-listpack-value').get('hash-max-listpack-value')
+    print(f"hash-max-listpack-value={listpack_value} (docker-compose usa 256)")
+
+    benches = (
+        ('json (heredado)', bench_legacy),
+        ('hash + raw zlib', bench_compact),
+        ('hash sin raw', bench_compact_without_raw),
+    )
+    for name, bench in benches:
+        per_result, per_key, keys = bench(conn, args.count)
+        print(f"{name:18s} used_memory/resultado: {per_result:8.1f} B   MEMORY USAGE/resultado: {per_key:8.1f} B")
+        for i in range(0, len(keys), 1000):
+            conn.delete(*keys[i:i + 1000])
+
+
+if __name__ == '__main__':
+    main()
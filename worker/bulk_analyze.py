@@ -0,0 +1,424 @@
+import argparse
+import base64
+import collections
+import hashlib
+import io
+import json
+import os
+import queue
+import tarfile
+import threading
+import time
+import uuid
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image
+from engines import start_engine
+from eval_golden import parse_config, RESULT_KEYS
+from nutrition import error_result
+from storage import store_results, RESULT_TTL
+from accounting import record_usage
+from redis_topology import create_redis, SHARD_TAG_LENGTH
+
+# Análisis masivo sin pasar por la API ni por RabbitMQ (backfills, reanálisis tras
+# cambiar de modelo). Lee un directorio, un tar(.gz) o un manifiesto JSONL y pasa las
+# imágenes por decodificación en paralelo -> inferencia por lotes con el mismo motor
+# del worker -> escritura en bloque en Redis o en Parquet. Ejemplos:
+#   python bulk_analyze.py fotos/ --engine llava:quantization=4bit --batch-size 8
+#   python bulk_analyze.py fotos.tar.gz --engine gpt4:detail=low --parquet salida/
+#   python bulk_analyze.py manifiesto.jsonl --history
+# Cada línea del manifiesto es {"path": ..., "task_id": opcional, "user": opcional}, con
+# rutas relativas al manifiesto. El checkpoint (JSONL con origen, task_id y estado)
+# permite reanudar y sirve de índice origen -> task_id de lo escrito en Redis.
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp', '.bmp')
+MACROS = ['calorias', 'proteinas', 'carbohidratos', 'grasas', 'fibra']
+REPORT_INTERVAL = 10
+
+
+class BulkItem:
+    def __init__(self, source: str, path: str = None, data: bytes = None, task_id: str = None, user: str = None):
+        self.source = source
+        self.path = path
+        self.data = data
+        self.task_id = task_id
+        self.user = user
+
+
+class BulkSample:
+    # Lo mínimo de una Delivery que usan los motores al inferir.
+    def __init__(self, item: BulkItem, digest: str = None):
+        self.source = item.source
+        self.user = item.user
+        self.image_hash = digest
+        self.task_id = item.task_id or new_task_id(digest or '')
+        self.filename = os.path.basename(item.source)
+        self.image = None
+        self.image_data = None
+        self.message = {}
+        self.priority = False
+        self.result = None
+
+
+def new_task_id(digest: str) -> str:
+    # Mismo formato que el backend: el prefijo del hash es la etiqueta de hash en Cluster.
+    task_id = str(uuid.uuid4())
+    return digest[:SHARD_TAG_LENGTH] + task_id[SHARD_TAG_LENGTH:] if digest else task_id
+
+
+def iter_directory(path: str, skip):
+    for root, dirs, files in os.walk(path):
+        dirs.sort()
+        for name in sorted(files):
+            full = os.path.join(root, name)
+            source = os.path.relpath(full, path)
+            if name.lower().endswith(IMAGE_EXTENSIONS) and not skip(source):
+                yield BulkItem(source, path=full)
+
+
+def iter_manifest(path: str, skip):
+    base = os.path.dirname(os.path.abspath(path))
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            if not skip(entry['path']):
+                yield BulkItem(entry['path'], path=os.path.join(base, entry['path']),
+                               task_id=entry.get('task_id'), user=entry.get('user'))
+
+
+def iter_tarball(path: str, skip):
+    # Lectura secuencial del tar en este hilo; la decodificación va al pool.
+    with tarfile.open(path, 'r:*') as tar:
+        for member in tar:
+            if member.isfile() and member.name.lower().endswith(IMAGE_EXTENSIONS) and not skip(member.name):
+                yield BulkItem(member.name, data=tar.extractfile(member).read())
+
+
+def open_input(path: str, skip):
+    # Devuelve (elementos, total); en un tar el total no se conoce sin leerlo entero.
+    if os.path.isdir(path):
+        items = list(iter_directory(path, skip))
+        return iter(items), len(items)
+    if path.endswith('.jsonl'):
+        items = list(iter_manifest(path, skip))
+        return iter(items), len(items)
+    if tarfile.is_tarfile(path):
+        return iter_tarball(path, skip), None
+    raise ValueError(f"Entrada no reconocida (directorio, .tar[.gz] o manifiesto .jsonl): {path}")
+
+
+def fail(sample: BulkSample, error: str):
+    sample.result = dict(error_result(error, 'bulk'), task_id=sample.task_id, filename=sample.filename, status='error')
+
+
+def decode(item: BulkItem, max_side: int, needs_image: bool) -> BulkSample:
+    try:
+        if item.data is not None:
+            data = item.data
+        else:
+            with open(item.path, 'rb') as f:
+                data = f.read()
+    except OSError as e:
+        sample = BulkSample(item)
+        fail(sample, f"No se pudo leer la imagen: {e}")
+        return sample
+
+    sample = BulkSample(item, hashlib.sha256(data).hexdigest())
+    try:
+        image = Image.open(io.BytesIO(data)).convert('RGB')
+        if max_side and max(image.size) > max_side:
+            image.thumbnail((max_side, max_side), Image.LANCZOS)
+            buffer = io.BytesIO()
+            image.save(buffer, 'JPEG', quality=90)
+            data = buffer.getvalue()
+        if needs_image:
+            sample.image = image
+        else:
+            sample.image_data = base64.b64encode(data).decode('ascii')
+    except Exception as e:
+        fail(sample, f"Imagen no decodificable: {e}")
+    return sample
+
+
+def decoded(items, workers: int, prefetch: int, max_side: int, needs_image: bool, stats):
+    # Mantiene el orden de entrada con a lo sumo `prefetch` imágenes decodificándose.
+    def timed_decode(item):
+        started = time.perf_counter()
+        sample = decode(item, max_side, needs_image)
+        stats.busy('decodificación', time.perf_counter() - started)
+        return sample
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='decode') as pool:
+        pending = collections.deque()
+        for item in items:
+            pending.append(pool.submit(timed_decode, item))
+            if len(pending) >= prefetch:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+class Throughput:
+    def __init__(self, total, interval: float = REPORT_INTERVAL):
+        self.total = total
+        self.interval = interval
+        self.started = time.monotonic()
+        self.reported = self.started
+        self.done = 0
+        self.failed = 0
+        self.stages = collections.Counter()
+        self._lock = threading.Lock()
+
+    def busy(self, stage: str, seconds: float):
+        with self._lock:
+            self.stages[stage] += seconds
+
+    def add(self, samples):
+        with self._lock:
+            self.done += len(samples)
+            self.failed += sum(1 for sample in samples if sample.result.get('status') != 'completed')
+        if time.monotonic() - self.reported >= self.interval:
+            self.reported = time.monotonic()
+            print(self.line(), flush=True)
+
+    def line(self) -> str:
+        elapsed = time.monotonic() - self.started
+        rate = self.done / elapsed if elapsed else 0
+        progress = f"{self.done}/{self.total}" if self.total is not None else str(self.done)
+        eta = ''
+        if self.total is not None and rate:
+            eta = f", faltan {(self.total - self.done) / rate / 60:.1f} min"
+        stages = ', '.join(f"{stage} {seconds:.1f}s" for stage, seconds in self.stages.items())
+        return (f"{progress} imágenes en {elapsed:.0f}s ({rate:.2f} img/s{eta}), {self.failed} fallidas; "
+                f"tiempo ocupado: {stages}")
+
+
+class Checkpoint:
+    def __init__(self, path: str):
+        self.path = path
+        self.status = {}
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        self.status[entry['source']] = entry['status']
+        self._file = open(path, 'a', encoding='utf-8')
+
+    def skip(self, retry_errors: bool):
+        return lambda source: source in self.status and (self.status[source] == 'completed' or not retry_errors)
+
+    def record(self, samples):
+        # Se anota después de escribir el lote: al reanudar no se pierde nada ya procesado.
+        for sample in samples:
+            self._file.write(json.dumps({'source': sample.source, 'task_id': sample.task_id,
+                                         'status': sample.result.get('status')}, ensure_ascii=False) + '\n')
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        self._file.close()
+
+
+class RedisSink:
+    def __init__(self, redis_conn, ttl: int, history: bool):
+        self.redis_conn = redis_conn
+        self.ttl = ttl
+        self.history = history
+
+    def write(self, samples):
+        items = [(sample.task_id, sample.result, sample.image_hash, sample.user) for sample in samples]
+        stored = store_results(self.redis_conn, items, self.ttl, self.history)
+        record_usage(self.redis_conn, [(sample.result.get('usage'), ok) for sample, ok in zip(samples, stored)])
+
+
+class ParquetSink:
+    # Un archivo por bloque dentro del directorio: el conjunto se lee como un solo dataset
+    # (pandas.read_parquet, DuckDB) y una ejecución reanudada sólo añade archivos.
+    def __init__(self, directory: str):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise SystemExit("La salida Parquet necesita pyarrow (pip install pyarrow)")
+        self._pa = pyarrow
+        self._pq = pyarrow.parquet
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._part = len([name for name in os.listdir(directory) if name.endswith('.parquet')])
+
+    @staticmethod
+    def row(sample) -> dict:
+        result = sample.result
+        row = {
+            'task_id': sample.task_id,
+            'source': sample.source,
+            'image_hash': sample.image_hash,
+            'status': result.get('status'),
+            'nombre': result.get('nombre'),
+            'model': result.get('model'),
+            'error': result.get('error'),
+            'raw_analysis': result.get('raw_analysis'),
+            'usage': json.dumps(result['usage']) if result.get('usage') else None,
+        }
+        for macro in MACROS + ['confianza']:
+            value = result.get(RESULT_KEYS.get(macro, macro))
+            row[macro] = float(value.get('value') or 0) if isinstance(value, dict) else None
+        return row
+
+    def write(self, samples):
+        table = self._pa.Table.from_pylist([self.row(sample) for sample in samples])
+        path = os.path.join(self.directory, f"part-{self._part:05d}.parquet")
+        self._pq.write_table(table, path + '.tmp')
+        os.replace(path + '.tmp', path)
+        self._part += 1
+
+
+def complete(sample, result: dict, engine, usage_engine: str):
+    # Como complete_result en worker.py; los fallos quedan como 'error' y se pueden
+    # reintentar con --retry-errors.
+    result['task_id'] = sample.task_id
+    result['filename'] = sample.filename
+    result['status'] = 'error' if 'error' in result else 'completed'
+    result['timestamp'] = engine.source()
+    if result.get('usage') is not None:
+        result['usage']['engine'] = usage_engine
+        result['usage']['priority'] = False
+    sample.result = result
+    sample.image = None
+    sample.image_data = None
+
+
+def infer_one(engine, sample) -> dict:
+    try:
+        return engine.infer(sample)
+    except Exception as e:
+        return error_result(str(e), f"{engine.label} (error)")
+
+
+def run_inference(engine, samples, pool, usage_engine: str):
+    results = None
+    if engine.supports_batch and len(samples) > 1:
+        try:
+            results = engine.infer_batch(samples)
+        except Exception as e:
+            print(f"Error en inferencia por lotes, procesando {len(samples)} imágenes una a una: {e}")
+    if results is None:
+        # Motores remotos: tantas llamadas en paralelo como su concurrencia.
+        results = list(pool.map(lambda sample: infer_one(engine, sample), samples))
+    for sample, result in zip(samples, results):
+        complete(sample, result, engine, usage_engine)
+
+
+def writer_loop(sink, checkpoint, stats, batches: queue.Queue, flush_size: int):
+    pending = []
+    finished = False
+    while not finished:
+        batch = batches.get()
+        if batch is None:
+            finished = True
+        else:
+            pending.extend(batch)
+        if not pending or (len(pending) < flush_size and not finished):
+            continue
+        started = time.perf_counter()
+        while True:
+            try:
+                sink.write(pending)
+                break
+            except Exception as e:
+                # Sin checkpoint no hay pérdida: se reintenta y, si se interrumpe, se reanuda.
+                print(f"No se pudieron escribir {len(pending)} resultados, reintentando en 5s: {e}", flush=True)
+                time.sleep(5)
+        checkpoint.record(pending)
+        stats.busy('escritura', time.perf_counter() - started)
+        stats.add(pending)
+        pending = []
+
+
+def main():
+    logging.basicConfig(level=logging.WARNING)
+    parser = argparse.ArgumentParser(description="Análisis masivo de imágenes con el motor del worker, sin cola")
+    parser.add_argument('input', help="Directorio de imágenes, archivo .tar[.gz] o manifiesto .jsonl")
+    parser.add_argument('--engine', default=os.getenv('ENGINE_KIND', 'llava'), metavar='MOTOR[:CLAVE=VALOR,...]',
+                        help="Motor y opciones, como en eval_golden.py (p. ej. llava:quantization=4bit)")
+    parser.add_argument('--parquet', metavar='DIRECTORIO', help="Escribe en Parquet en lugar de Redis")
+    parser.add_argument('--checkpoint', help="Archivo de checkpoint (por defecto junto a la salida)")
+    parser.add_argument('--retry-errors', action='store_true', help="Al reanudar, repite las imágenes que fallaron")
+    parser.add_argument('--batch-size', type=int, default=8, help="Imágenes por pasada del modelo")
+    parser.add_argument('--decode-workers', type=int, default=os.cpu_count() or 2)
+    parser.add_argument('--max-side', type=int, default=1024, help="Lado máximo al decodificar (0 = sin reducir)")
+    parser.add_argument('--flush-size', type=int, default=256, help="Resultados por escritura en bloque")
+    parser.add_argument('--ttl', type=int, default=RESULT_TTL, help="Vida de los resultados en Redis (segundos)")
+    parser.add_argument('--history', action='store_true',
+                        help="Anota los resultados en el historial de comidas (usuario del manifiesto)")
+    parser.add_argument('--limit', type=int, help="Procesa como máximo N imágenes")
+    args = parser.parse_args()
+
+    kind, options = parse_config(args.engine)
+    if kind == 'gpt4':
+        # Aquí el lote lo forma la propia herramienta: nada de esperar a la Batch API.
+        options.setdefault('batch_mode', 'off')
+    checkpoint_path = args.checkpoint or (
+        args.parquet.rstrip('/') + '.checkpoint.jsonl' if args.parquet
+        else f"bulk-{os.path.basename(os.path.abspath(args.input))}.checkpoint.jsonl")
+    checkpoint = Checkpoint(checkpoint_path)
+    items, total = open_input(args.input, checkpoint.skip(args.retry_errors))
+    if args.limit is not None:
+        items = (item for _, item in zip(range(args.limit), items))
+        total = min(total, args.limit) if total is not None else args.limit
+    if checkpoint.status:
+        print(f"Reanudando desde {checkpoint_path}: {len(checkpoint.status)} imágenes ya procesadas")
+
+    if args.parquet:
+        sink = ParquetSink(args.parquet)
+    else:
+        redis_conn = create_redis(decode_responses=True)
+        redis_conn.ping()
+        sink = RedisSink(redis_conn, args.ttl, args.history)
+
+    started = time.perf_counter()
+    engine = start_engine(kind, options)
+    print(f"Motor {engine.label} cargado en {time.perf_counter() - started:.1f}s; {total if total is not None else '?'} "
+          f"imágenes pendientes")
+    usage_engine = f"bulk-{kind}"
+
+    stats = Throughput(total)
+    batches = queue.Queue(maxsize=4)
+    writer = threading.Thread(target=writer_loop, args=(sink, checkpoint, stats, batches, args.flush_size),
+                              name='writer', daemon=True)
+    writer.start()
+
+    prefetch = args.decode_workers * 2 + args.batch_size
+    batch = []
+    with ThreadPoolExecutor(max_workers=max(1, engine.concurrency), thread_name_prefix='infer') as pool:
+        def flush():
+            started = time.perf_counter()
+            run_inference(engine, batch, pool, usage_engine)
+            stats.busy('inferencia', time.perf_counter() - started)
+            batches.put(list(batch))
+            batch.clear()
+
+        for sample in decoded(items, args.decode_workers, prefetch, args.max_side, engine.needs_image, stats):
+            if sample.result is not None:
+                # Falló la decodificación: se anota sin pasar por el modelo.
+                batches.put([sample])
+                continue
+            batch.append(sample)
+            if len(batch) >= args.batch_size:
+                flush()
+        if batch:
+            flush()
+
+    batches.put(None)
+    writer.join()
+    checkpoint.close()
+    engine.unload()
+    print(stats.line())
+    print(f"Checkpoint en {checkpoint_path}")
+
+
+if __name__ == '__main__':
+    main()
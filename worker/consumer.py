@@ -0,0 +1,73 @@
+import os
+import random
+import signal
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+RECONNECT_BASE_DELAY = float(os.getenv('CONSUMER_RECONNECT_BASE_DELAY', 0.5))
+RECONNECT_MAX_DELAY = float(os.getenv('CONSUMER_RECONNECT_MAX_DELAY', 30))
+# Una conexión que sobrevivió este tiempo se considera estable y reinicia el backoff.
+STABLE_CONNECTION_SECONDS = float(os.getenv('CONSUMER_STABLE_CONNECTION_SECONDS', 60))
+EVENT_POLL_INTERVAL = 1
+
+shutdown_requested = threading.Event()
+
+
+def backoff_delay(attempt: int) -> float:
+    return random.uniform(0, min(RECONNECT_MAX_DELAY, RECONNECT_BASE_DELAY * (2 ** attempt)))
+
+
+def _request_shutdown(signum, frame):
+    if not shutdown_requested.is_set():
+        logger.info(f"Señal {signum} recibida, terminando tareas en curso antes de salir...")
+    shutdown_requested.set()
+
+
+def install_signal_handlers():
+    signal.signal(signal.SIGTERM, _request_shutdown)
+    signal.signal(signal.SIGINT, _request_shutdown)
+
+
+def consume_until_shutdown(connection, channel, pipeline=None):
+    # La inferencia corre en los hilos del pipeline, así que este bucle
+    # sigue atendiendo heartbeats y confirmaciones durante todo el análisis.
+    while not shutdown_requested.is_set():
+        connection.process_data_events(time_limit=EVENT_POLL_INTERVAL)
+
+    logger.info("Cancelando consumidores...")
+    for consumer_tag in list(channel.consumer_tags):
+        channel.basic_cancel(consumer_tag)
+
+    while pipeline is not None and pipeline.inflight > 0:
+        logger.info(f"Esperando {pipeline.inflight} tareas en curso...")
+        connection.process_data_events(time_limit=EVENT_POLL_INTERVAL)
+    # Despacha las últimas confirmaciones encoladas desde el pipeline.
+    connection.process_data_events(time_limit=0)
+    connection.close()
+
+
+def run_supervised(consume_once):
+    install_signal_handlers()
+    attempt = 0
+
+    while not shutdown_requested.is_set():
+        started = time.monotonic()
+        try:
+            consume_once()
+        except Exception as e:
+            logger.error(f"Error en consumidor: {e}")
+
+        if shutdown_requested.is_set():
+            break
+
+        if time.monotonic() - started >= STABLE_CONNECTION_SECONDS:
+            attempt = 0
+        delay = backoff_delay(attempt)
+        attempt += 1
+        logger.info(f"Reconectando en {delay:.1f} segundos (intento {attempt})...")
+        shutdown_requested.wait(delay)
+
+    logger.info("Worker detenido")
@@ -0,0 +1,104 @@
+import argparse
+import json
+import os
+import time
+import pika
+from redis_topology import create_redis
+
+
+def publish(args, command: dict):
+    credentials = pika.PlainCredentials(os.getenv('RABBITMQ_USER', 'admin'), os.getenv('RABBITMQ_PASS', 'password'))
+    connection = pika.BlockingConnection(pika.ConnectionParameters(host=args.rabbitmq, credentials=credentials))
+    channel = connection.channel()
+    channel.exchange_declare(exchange=args.exchange, exchange_type='fanout', durable=True)
+    channel.basic_publish(exchange=args.exchange, routing_key='', body=json.dumps(command))
+    connection.close()
+
+
+def show_status(args):
+    conn = create_redis(host=args.host, port=args.port)
+    conn.delete(f"engine:{args.engine}:status")
+    publish(args, {'action': 'status', 'engine': args.engine})
+    time.sleep(args.wait)
+    statuses = conn.hgetall(f"engine:{args.engine}:status")
+    if not statuses:
+        print(f"Ningún worker del motor {args.engine} respondió")
+    for worker_id, status in sorted(statuses.items()):
+        status = json.loads(status)
+        print(f"{worker_id}: {status['label']} listo={status['ready']} cambiando={status['swapping']}")
+
+
+def collect_profiles(args):
+    # Los workers perfilan en segundo plano y dejan el resultado en Redis; aquí se
+    # guardan los .folded para flamegraph.pl / speedscope y los informes de memoria.
+    conn = create_redis(host=args.host, port=args.port)
+    key = f"engine:{args.engine}:profiles"
+    conn.delete(key)
+    command = {'action': 'profile', 'engine': args.engine, 'seconds': args.seconds, 'memory': args.memory}
+    if args.worker:
+        command['worker'] = args.worker
+    publish(args, command)
+    print(f"Perfilando los workers de {args.engine} durante {args.seconds:.0f}s...")
+    time.sleep(args.seconds + args.wait)
+
+    profiles = conn.hgetall(key)
+    if not profiles:
+        print(f"Ningún worker del motor {args.engine} respondió")
+    os.makedirs(args.out, exist_ok=True)
+    for worker_id, report in sorted(profiles.items()):
+        report = json.loads(report)
+        if 'error' in report:
+            print(f"{worker_id}: {report['error']}")
+            continue
+        base = os.path.join(args.out, f"{args.engine}-{worker_id.replace(':', '-')}")
+        with open(base + '.folded', 'w', encoding='utf-8') as f:
+            f.write(report['folded'] + '\n')
+        if 'tracemalloc' in report:
+            with open(base + '.tracemalloc.txt', 'w', encoding='utf-8') as f:
+                f.write('\n'.join(report['tracemalloc']) + '\n')
+        if report.get('torch'):
+            with open(base + '.torch.txt', 'w', encoding='utf-8') as f:
+                f.write(report['torch'] + '\n')
+        print(f"{worker_id}: {report['samples']} muestras en {base}.folded")
+        for frame in report['top'][:5]:
+            print(f"  {frame['percent']:5.1f}%  {frame['frame']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cambia en caliente el modelo de los workers, consulta su estado "
+                                                 "o los perfila")
+    parser.add_argument('action', choices=['swap', 'status', 'profile'])
+    parser.add_argument('--engine', default='llava', help="Motor (colas) de los workers a los que va la orden, '*' para todos")
+    parser.add_argument('--kind', help="Implementación a cargar (llava, gpt4); por defecto la actual")
+    parser.add_argument('--option', action='append', default=[], metavar='CLAVE=VALOR',
+                        help="Opción del motor, p. ej. model_name=llava-hf/llava-v1.6-mistral-7b-hf")
+    parser.add_argument('--worker', help="Limita la orden a un worker (host:pid)")
+    parser.add_argument('--exchange', default=os.getenv('WORKER_CONTROL_EXCHANGE', 'worker_control'))
+    parser.add_argument('--rabbitmq', default=os.getenv('RABBITMQ_HOST', 'localhost'))
+    parser.add_argument('--host', default=os.getenv('REDIS_HOST', 'localhost'))
+    parser.add_argument('--port', type=int, default=int(os.getenv('REDIS_PORT', 6379)))
+    parser.add_argument('--wait', type=float, default=2, help="Segundos de espera a las respuestas de estado")
+    parser.add_argument('--seconds', type=float, default=30, help="Duración del perfil")
+    parser.add_argument('--memory', action='store_true', help="Incluye tracemalloc en el perfil (más lento mientras dura)")
+    parser.add_argument('--out', default='perfiles', help="Directorio donde se guardan los perfiles")
+    args = parser.parse_args()
+
+    if args.action == 'status':
+        show_status(args)
+        return
+    if args.action == 'profile':
+        collect_profiles(args)
+        return
+
+    command = {'action': 'swap', 'engine': args.engine,
+               'options': dict(option.split('=', 1) for option in args.option)}
+    if args.kind:
+        command['kind'] = args.kind
+    if args.worker:
+        command['worker'] = args.worker
+    publish(args, command)
+    print(f"Orden de cambio enviada a los workers de {args.engine}; consulta el progreso con 'status'")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,228 @@
+import os
+import time
+import logging
+from openai import OpenAI
+from engines import Engine
+from openai_batch import OpenAIBatcher, OPENAI_BATCH_MAX_TASKS
+from accounting import UsageMeter, openai_cost
+from nutrition import parse_nutrition_with_langchain, structure_nutrition_result, error_result
+
+logger = logging.getLogger(__name__)
+
+OPENAI_API_KEY = os.getenv('OPENAI_API_KEY', '')
+OPENAI_MODEL = os.getenv('OPENAI_MODEL', 'gpt-4o')
+OPENAI_CONCURRENCY = int(os.getenv('OPENAI_CONCURRENCY', 4))
+# URL alternativa de la API (p. ej. el servidor simulado mock_openai.py).
+OPENAI_BASE_URL = os.getenv('OPENAI_BASE_URL') or None
+# Tareas no prioritarias que van por la Batch API: 'off', 'batch' (sólo las del
+# endpoint /api/analyze-food/batch) o 'normal' (toda la cola normal).
+OPENAI_BATCH_MODE = os.getenv('OPENAI_BATCH_MODE', 'off')
+
+SYSTEM_PROMPT = """Eres un experto nutricionista especializado en análisis de alimentos mediante imágenes.
+Tu trabajo es identificar alimentos en fotografías y estimar su información nutricional.
+IMPORTANTE: Solo analiza imágenes de comida. Si ves comida, SIEMPRE proporciona un análisis nutricional.
+Responde SIEMPRE en español y usa EXACTAMENTE el formato especificado."""
+
+USER_PROMPT = """Por favor, analiza esta imagen de comida.
+
+INSTRUCCIONES:
+1. Identifica qué alimentos ves en la imagen
+2. Estima la porción/cantidad visible
+3. Calcula los valores nutricionales aproximados TOTALES
+
+FORMATO REQUERIDO (copia esto y completa con números):
+Comida: [descripción detallada del plato]
+Calorías: [número] kcal
+Proteínas: [número] g
+Carbohidratos: [número] g
+Grasas: [número] g
+Fibra: [número] g
+Confianza: [número entre 60-95]%
+
+REGLAS:
+- Siempre proporciona números (nunca dejes valores vacíos)
+- Si no estás seguro, haz tu mejor estimación
+- La confianza debe reflejar qué tan seguro estás
+- NO agregues explicaciones extra, SOLO el formato especificado"""
+
+SIMPLE_PROMPT = """Esta es una imagen de comida. Por favor analízala y dame:
+
+Comida: [nombre del plato]
+Calorías: [número] kcal
+Proteínas: [número] g
+Carbohidratos: [número] g
+Grasas: [número] g
+Fibra: [número] g
+Confianza: 75%
+
+Proporciona valores estimados basados en lo que ves."""
+
+REJECTION_PHRASES = [
+    "lo siento",
+    "no puedo",
+    "cannot",
+    "sorry",
+    "unable to",
+    "not able",
+    "can't help",
+    "no es posible"
+]
+
+
+def image_url_of(image_base64: str) -> str:
+    if not image_base64.startswith('data:'):
+        return f"data:image/jpeg;base64,{image_base64}"
+    return image_base64
+
+
+def vision_content(prompt: str, image_url: str, detail: str = "high") -> list:
+    return [
+        {
+            "type": "text",
+            "text": prompt
+        },
+        {
+            "type": "image_url",
+            "image_url": {
+                "url": image_url,
+                "detail": detail
+            }
+        }
+    ]
+
+
+class GPT4Engine(Engine):
+    kind = 'gpt4'
+    label = 'GPT-4 Vision'
+    # Las llamadas a OpenAI esperan red, no GPU: varias pueden ir en paralelo.
+    concurrency = OPENAI_CONCURRENCY
+    needs_image = False
+    failover_engine = 'llava'
+
+    def __init__(self, options=None):
+        super().__init__(options)
+        self.client = None
+        self.model = self.options.get('model') or OPENAI_MODEL
+        self.label = f"GPT-4 Vision ({self.model})"
+        # Resolución con la que OpenAI procesa la imagen ('high', 'low') y tokens de respuesta.
+        self.detail = self.options.get('detail', 'high')
+        self.max_tokens = int(self.options.get('max_tokens', 500))
+        self.batch_mode = self.options.get('batch_mode', OPENAI_BATCH_MODE)
+        self.batcher = None
+        if self.batch_mode != 'off':
+            self.max_deferred = OPENAI_BATCH_MAX_TASKS
+
+    def load(self):
+        if not OPENAI_API_KEY:
+            logger.error("OPENAI_API_KEY no está configurada")
+            raise ValueError("OPENAI_API_KEY es requerida")
+
+        self.client = OpenAI(api_key=OPENAI_API_KEY, base_url=OPENAI_BASE_URL)
+        logger.info("Cliente OpenAI configurado correctamente")
+
+    def warm_up(self):
+        # Comprueba credenciales y que el modelo existe sin gastar tokens.
+        logger.info("Probando conexión con OpenAI...")
+        self.client.models.retrieve(self.model)
+        if self.batch_mode != 'off':
+            self.batcher = OpenAIBatcher(self, self.get_redis)
+            self.batcher.start()
+            logger.info(f"Batch API activada para tareas '{self.batch_mode}' "
+                        f"(ventana {self.batcher.window:.0f}s, máximo {self.batcher.max_tasks} tareas)")
+
+    def health(self) -> dict:
+        status = super().health()
+        status['model'] = self.model
+        if self.batcher is not None:
+            status['batch_pending'] = self.batcher.pending
+        return status
+
+    def source(self) -> str:
+        return 'OpenAI GPT-4 Vision'
+
+    def unload(self):
+        super().unload()
+        if self.batcher is not None:
+            self.batcher.stop()
+            self.batcher = None
+        if self.client is not None:
+            self.client.close()
+            self.client = None
+
+    def defer(self, delivery) -> bool:
+        # Las prioritarias siguen el camino síncrono; las demás esperan al lote.
+        if self.batcher is None or delivery.priority:
+            return False
+        if self.batch_mode == 'batch' and not delivery.message.get('batch_id'):
+            return False
+        self.batcher.add(delivery)
+        return True
+
+    def request_body(self, image_base64: str, prompt: str = USER_PROMPT) -> dict:
+        messages = [{"role": "user", "content": vision_content(prompt, image_url_of(image_base64), self.detail)}]
+        if prompt == USER_PROMPT:
+            messages.insert(0, {"role": "system", "content": SYSTEM_PROMPT})
+        return {
+            "model": self.model,
+            "messages": messages,
+            "max_tokens": self.max_tokens,
+            "temperature": 0.3
+        }
+
+    def _complete(self, image_base64: str, prompt: str = USER_PROMPT, meter=None) -> str:
+        response = self.client.chat.completions.create(**self.request_body(image_base64, prompt))
+        if meter is not None and response.usage is not None:
+            meter.add_tokens([response.usage.prompt_tokens], [response.usage.completion_tokens])
+        return response.choices[0].message.content.strip()
+
+    def usage(self, meter) -> dict:
+        usage = meter.report()
+        # El pico de memoria del proceso no depende de una llamada a la API.
+        del usage['peak_mb']
+        cost = openai_cost(self.model, usage.get('prefill_tokens', 0), usage.get('decode_tokens', 0))
+        if cost is not None:
+            usage['cost_usd'] = cost
+        return usage
+
+    def structure(self, raw_result: str) -> dict:
+        nutrition_info = parse_nutrition_with_langchain(raw_result, default_confidence=90)
+
+        if nutrition_info.calorias == 0 and nutrition_info.proteinas == 0 and nutrition_info.carbohidratos == 0:
+            logger.warning("No se pudieron extraer valores nutricionales válidos")
+            nutrition_info.comida = "Alimento no detectado"
+            nutrition_info.calorias = 0
+            nutrition_info.proteinas = 0
+            nutrition_info.carbohidratos = 0
+            nutrition_info.grasas = 0
+            nutrition_info.fibra = 0
+            nutrition_info.confianza = 30
+
+        return structure_nutrition_result(nutrition_info, raw_result, f"GPT-4 Vision ({self.model})")
+
+    def infer(self, delivery):
+        # Sólo el CPU de este hilo: los demás hilos de inferencia esperan a OpenAI en paralelo.
+        with UsageMeter(cpu_clock=time.thread_time) as meter:
+            result = self._infer(delivery, meter)
+        result['usage'] = self.usage(meter)
+        return result
+
+    def _infer(self, delivery, meter):
+        try:
+            logger.info(f"Iniciando análisis con GPT-4 Vision ({self.model})")
+            raw_result = self._complete(delivery.image_data, meter=meter)
+
+            logger.info(f"Respuesta de GPT-4 Vision recibida")
+            logger.info(f"Respuesta completa: {raw_result}")
+
+            if any(phrase in raw_result.lower() for phrase in REJECTION_PHRASES):
+                logger.warning(f"GPT-4 rechazó analizar la imagen: {raw_result}")
+                logger.info("Reintentando con prompt simplificado...")
+
+                raw_result = self._complete(delivery.image_data, SIMPLE_PROMPT, meter)
+                logger.info(f"Segunda respuesta: {raw_result}")
+
+            return self.structure(raw_result)
+
+        except Exception as e:
+            logger.error(f"Error en el análisis GPT-4 Vision: {e}")
+            return error_result(str(e), 'GPT-4 Vision (error)')
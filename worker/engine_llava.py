@@ -0,0 +1,436 @@
+import functools
+import gc
+import os
+import time
+import logging
+import torch
+from transformers import LlavaNextProcessor, LlavaNextForConditionalGeneration, LlavaProcessor, LlavaForConditionalGeneration, BitsAndBytesConfig
+from PIL import Image
+from engines import Engine, image_of
+from accounting import UsageMeter
+from assisted import AssistedDecoder
+from replica_pool import ReplicaPool, core_groups
+from nutrition import parse_nutrition_with_langchain, structure_nutrition_result, error_result
+
+logger = logging.getLogger(__name__)
+
+LLAVA_MODEL = os.getenv('LLAVA_MODEL', '')
+# Modelo de lenguaje pequeño con el mismo tokenizador (vacío = generación normal).
+LLAVA_DRAFT_MODEL = os.getenv('LLAVA_DRAFT_MODEL', '')
+MAX_NEW_TOKENS = 512
+# Pool de réplicas en CPU (motor llava-pool): 0 réplicas = tantas como grupos de núcleos quepan.
+LLAVA_REPLICAS = int(os.getenv('LLAVA_REPLICAS', 0))
+LLAVA_REPLICA_CORES = int(os.getenv('LLAVA_REPLICA_CORES', 4))
+LLAVA_REPLICA_TIMEOUT = float(os.getenv('LLAVA_REPLICA_TIMEOUT', 600))
+FALLBACK_MODEL = "llava-hf/llava-1.5-7b-hf"
+
+NUTRITION_PROMPT = """[INST] <image>
+Analiza esta imagen de comida de manera detallada y precisa.
+
+Identifica todos los alimentos visibles y calcula los valores nutricionales aproximados para la porción total mostrada en la imagen.
+
+Proporciona tu respuesta en este formato exacto:
+Comida: [descripción específica de lo que ves]
+Calorías: [número] kcal
+Proteínas: [número] g
+Carbohidratos: [número] g
+Grasas: [número] g
+Fibra: [número] g
+Confianza: [porcentaje]%
+
+Sé específico sobre qué alimentos ves y proporciona estimaciones nutricionales realistas basadas en las porciones visibles. [/INST]"""
+
+
+def extract_answer(generated_text: str) -> str:
+    if "[/INST]" in generated_text:
+        return generated_text.split("[/INST]")[-1].strip()
+    elif "assistant" in generated_text.lower():
+        return generated_text.split("assistant")[-1].strip()
+    return generated_text.strip()
+
+
+def count_tokens(meter, inputs, output, pad_token_id):
+    # Prefill: tokens del prompt sin relleno (incluye los de la imagen); decode: los generados.
+    if meter is None:
+        return
+    prompt_length = inputs['input_ids'].shape[1]
+    meter.add_tokens(inputs['attention_mask'].sum(dim=1).tolist(),
+                     (output[:, prompt_length:] != pad_token_id).sum(dim=1).tolist())
+
+
+def structure_llava_result(raw_result: str) -> dict:
+    analysis_text = str(raw_result).strip()
+    logger.info(f"Texto para parsing nutricional: {analysis_text}")
+    return structure_nutrition_result(parse_nutrition_with_langchain(analysis_text), raw_result, 'LLaVA-Next')
+
+
+def quantization_config_for(quantization: str, gpu_memory_gb: float):
+    # 'auto' mantiene el criterio de siempre: 8 bits sólo si la GPU se queda corta.
+    if quantization == 'auto':
+        quantization = '8bit' if gpu_memory_gb < 12 else 'none'
+    if quantization == '8bit':
+        logger.info("Usando cuantización 8-bit")
+        return BitsAndBytesConfig(
+            load_in_8bit=True,
+            llm_int8_threshold=6.0,
+            llm_int8_has_fp16_weight=False,
+        )
+    if quantization == '4bit':
+        logger.info("Usando cuantización 4-bit (NF4)")
+        return BitsAndBytesConfig(
+            load_in_4bit=True,
+            bnb_4bit_quant_type='nf4',
+            bnb_4bit_compute_dtype=torch.float16,
+        )
+    if quantization != 'none':
+        raise ValueError(f"Cuantización desconocida: {quantization}")
+    return None
+
+
+def pick_model_name(gpu_memory_gb: float) -> str:
+    if gpu_memory_gb >= 16:
+        logger.info("Usando LLaVA-Next 13B (requiere 16GB+ GPU)")
+        return "llava-hf/llava-v1.6-vicuna-13b-hf"
+    if gpu_memory_gb >= 8:
+        logger.info("Usando LLaVA-Next 7B (requiere 8GB+ GPU)")
+        return "llava-hf/llava-v1.6-mistral-7b-hf"
+    logger.info("Usando LLaVA 1.5 7B (GPU limitada)")
+    return FALLBACK_MODEL
+
+
+class LlavaEngine(Engine):
+    kind = 'llava'
+    label = 'LLaVA-Next'
+    supports_batch = True
+
+    def __init__(self, options=None):
+        super().__init__(options)
+        self.model = None
+        self.processor = None
+        self.model_name = self.options.get('model_name') or LLAVA_MODEL
+        self.draft_model = self.options.get('draft_model', LLAVA_DRAFT_MODEL)
+        # Ajustes que se comparan con eval_golden.py: cuantización ('auto', 'none', '8bit',
+        # '4bit'), tokens generados y lado máximo de la imagen (0 = sin reducir).
+        self.quantization = self.options.get('quantization', 'auto')
+        self.max_new_tokens = int(self.options.get('max_new_tokens', MAX_NEW_TOKENS))
+        self.image_size = int(self.options.get('image_size', 0))
+        self.assisted = None
+
+    def load(self):
+        try:
+            self._load()
+        except Exception as e:
+            logger.error(f"Error cargando LLaVA-Next: {e}")
+            logger.info("Intentando cargar modelo LLaVA básico como fallback...")
+            self.model_name = FALLBACK_MODEL
+            self.processor = LlavaProcessor.from_pretrained(FALLBACK_MODEL, use_fast=True)
+            self.model = LlavaForConditionalGeneration.from_pretrained(
+                FALLBACK_MODEL,
+                dtype=torch.float32,
+                device_map="cpu",
+            )
+            logger.info("Modelo LLaVA básico cargado exitosamente como fallback")
+        self.label = f"LLaVA-Next ({self.model_name})"
+        if self.draft_model:
+            self.setup_assisted(self.draft_model)
+
+    def setup_assisted(self, draft_model: str):
+        try:
+            assisted = AssistedDecoder(self.model, self.processor.tokenizer, draft_model)
+            assisted.load()
+            self.assisted = assisted
+        except Exception as e:
+            logger.error(f"No se pudo cargar el modelo borrador {draft_model}, se usa generación normal: {e}")
+            self.assisted = None
+
+    def _load(self):
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+            gpu_name = torch.cuda.get_device_name(0)
+            logger.info(f"GPU disponible: {gpu_name}")
+
+            gpu_memory_gb = torch.cuda.get_device_properties(0).total_memory / (1024**3)
+            logger.info(f"Memoria GPU total: {gpu_memory_gb:.1f} GB")
+
+            model_name = self.model_name or pick_model_name(gpu_memory_gb)
+
+            logger.info(f"Cargando processor para {model_name}...")
+            if "llava-v1.6" in model_name or "llava-next" in model_name:
+                processor = LlavaNextProcessor.from_pretrained(model_name, use_fast=True)
+                model_class = LlavaNextForConditionalGeneration
+            else:
+                processor = LlavaProcessor.from_pretrained(model_name, use_fast=True)
+                model_class = LlavaForConditionalGeneration
+
+            logger.info(f"Cargando modelo {model_name}...")
+
+            quantization_config = quantization_config_for(self.quantization, gpu_memory_gb)
+
+            model = model_class.from_pretrained(
+                model_name,
+                dtype=torch.float16,
+                device_map="auto",
+                low_cpu_mem_usage=True,
+                quantization_config=quantization_config,
+            )
+
+            model_device = next(model.parameters()).device
+            logger.info(f"Modelo LLaVA-Next cargado en dispositivo: {model_device}")
+
+        else:
+            logger.info("GPU no disponible, cargando modelo en CPU...")
+            if self.quantization not in ('auto', 'none'):
+                logger.warning(f"Cuantización {self.quantization} no disponible en CPU, se carga en float32")
+            model_name = self.model_name or FALLBACK_MODEL
+
+            processor = LlavaProcessor.from_pretrained(model_name, use_fast=True)
+            model = LlavaForConditionalGeneration.from_pretrained(
+                model_name,
+                dtype=torch.float32,
+                device_map="cpu",
+                low_cpu_mem_usage=True,
+            )
+
+            logger.info(f"Modelo LLaVA cargado en CPU")
+
+        self.model_name = model_name
+        self.processor = processor
+        self.model = model
+
+    def warm_up(self):
+        # Una generación corta compila kernels y reserva memoria antes de recibir tráfico.
+        model_device = next(self.model.parameters()).device
+        image = Image.new('RGB', (336, 336), (128, 128, 128))
+        inputs = self.processor(text=NUTRITION_PROMPT, images=image, return_tensors="pt").to(model_device)
+        with torch.no_grad():
+            self.model.generate(**inputs, max_new_tokens=4, do_sample=False,
+                                pad_token_id=self.processor.tokenizer.eos_token_id)
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+
+    def health(self) -> dict:
+        status = super().health()
+        status['model_name'] = self.model_name
+        if self.assisted is not None:
+            status['assisted'] = self.assisted.stats()
+        if torch.cuda.is_available():
+            status['gpu_memory_allocated_gb'] = round(torch.cuda.memory_allocated(0) / (1024**3), 2)
+        return status
+
+    def source(self) -> str:
+        return str(torch.cuda.get_device_name(0) if torch.cuda.is_available() else 'CPU')
+
+    def unload(self):
+        super().unload()
+        self.assisted = None
+        self.model = None
+        self.processor = None
+        gc.collect()
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+
+    def generate(self, inputs, meter=None) -> str:
+        if self.assisted is not None and self.assisted.enabled:
+            try:
+                tokens = self.assisted.generate(inputs, max_new_tokens=self.max_new_tokens)
+                if meter is not None:
+                    meter.add_tokens(inputs['attention_mask'].sum(dim=1).tolist(), [len(tokens)])
+                return self.processor.decode(tokens, skip_special_tokens=True).strip()
+            except Exception as e:
+                logger.warning(f"Error en la decodificación asistida, se desactiva: {e}")
+                self.assisted.disable()
+        return self.generate_plain(inputs, meter=meter)
+
+    def generate_plain(self, inputs, do_sample: bool = True, meter=None) -> str:
+        started = time.perf_counter()
+        with torch.no_grad():
+            output = self.model.generate(
+                **inputs,
+                max_new_tokens=self.max_new_tokens,
+                do_sample=do_sample,
+                temperature=0.2 if do_sample else None,
+                pad_token_id=self.processor.tokenizer.eos_token_id
+            )
+        elapsed = time.perf_counter() - started
+        count_tokens(meter, inputs, output, self.processor.tokenizer.eos_token_id)
+        new_tokens = output.shape[1] - inputs['input_ids'].shape[1]
+        logger.info(f"Generación: {new_tokens} tokens en {elapsed:.2f}s ({new_tokens / elapsed:.1f} tokens/s)")
+        return extract_answer(self.processor.decode(output[0], skip_special_tokens=True))
+
+    def fit_image(self, image):
+        if not self.image_size or max(image.size) <= self.image_size:
+            return image
+        image = image.copy()
+        image.thumbnail((self.image_size, self.image_size), Image.LANCZOS)
+        return image
+
+    def infer_batch(self, deliveries):
+        return self.analyze_batch([image_of(delivery) for delivery in deliveries])
+
+    def infer(self, delivery):
+        return self.analyze(image_of(delivery))
+
+    def analyze_batch(self, images):
+        model_device = next(self.model.parameters()).device
+        logger.info(f"Analizando lote de {len(images)} imágenes con LLaVA-Next en {model_device}")
+        images = [self.fit_image(image) for image in images]
+
+        self.processor.tokenizer.padding_side = 'left'
+        with UsageMeter(model_device.type) as meter:
+            inputs = self.processor(
+                text=[NUTRITION_PROMPT] * len(images),
+                images=images,
+                padding=True,
+                return_tensors="pt"
+            ).to(model_device)
+
+            with torch.no_grad():
+                output = self.model.generate(
+                    **inputs,
+                    max_new_tokens=self.max_new_tokens,
+                    do_sample=True,
+                    temperature=0.2,
+                    pad_token_id=self.processor.tokenizer.eos_token_id
+                )
+            count_tokens(meter, inputs, output, self.processor.tokenizer.eos_token_id)
+
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+
+        generated = self.processor.batch_decode(output, skip_special_tokens=True)
+        results = [structure_llava_result(extract_answer(text)) for text in generated]
+        for index, result in enumerate(results):
+            result['usage'] = meter.report(index, len(results))
+        return results
+
+    def analyze(self, image):
+        with UsageMeter(next(self.model.parameters()).device.type) as meter:
+            result = self._analyze(image, meter)
+        result['usage'] = meter.report()
+        return result
+
+    def _analyze(self, image, meter):
+        try:
+            processor = self.processor
+
+            model_device = next(self.model.parameters()).device
+            device_name = "GPU" if model_device.type == 'cuda' else "CPU"
+            logger.info(f"Iniciando análisis LLaVA-Next en {device_name} (device: {model_device})")
+
+            prompt = NUTRITION_PROMPT
+            image = self.fit_image(image)
+
+            logger.info(f"Imagen para análisis - Tamaño: {image.size}, Modo: {image.mode}")
+            logger.info("Procesando imagen con LLaVA-Next...")
+
+            if torch.cuda.is_available():
+                torch.cuda.empty_cache()
+
+            try:
+                inputs = processor(text=prompt, images=image, return_tensors="pt").to(model_device)
+
+                logger.info(f"Generando respuesta con LLaVA-Next en: {model_device}")
+                raw_result = self.generate(inputs, meter)
+
+            except RuntimeError as e:
+                if "Expected all tensors to be on the same device" in str(e) or "CUDA out of memory" in str(e):
+                    logger.warning(f"Error GPU detectado: {e}")
+                    logger.info("Intentando procesar en CPU como fallback...")
+
+                    analyzer_cpu = self.model.cpu()
+                    if torch.cuda.is_available():
+                        torch.cuda.empty_cache()
+
+                    inputs_cpu = processor(text=prompt, images=image, return_tensors="pt").to('cpu')
+
+                    with torch.no_grad():
+                        output = analyzer_cpu.generate(
+                            **inputs_cpu,
+                            max_new_tokens=self.max_new_tokens,
+                            do_sample=True,
+                            temperature=0.2,
+                            pad_token_id=processor.tokenizer.eos_token_id
+                        )
+
+                        count_tokens(meter, inputs_cpu, output, processor.tokenizer.eos_token_id)
+                        raw_result = extract_answer(processor.decode(output[0], skip_special_tokens=True))
+
+                    if torch.cuda.is_available():
+                        try:
+                            self.model = analyzer_cpu.cuda()
+                            logger.info("Modelo LLaVA-Next movido de vuelta a GPU")
+                        except:
+                            logger.warning("No se pudo mover LLaVA-Next de vuelta a GPU")
+                else:
+                    raise e
+
+            if torch.cuda.is_available():
+                torch.cuda.empty_cache()
+
+            logger.info(f"Análisis LLaVA-Next completado")
+            logger.info(f"Respuesta completa del modelo: {raw_result}")
+
+            return structure_llava_result(raw_result)
+
+        except Exception as e:
+            logger.error(f"Error en el análisis LLaVA-Next: {e}")
+            return error_result(str(e), 'LLaVA-Next (error)')
+
+
+class LlavaPoolEngine(LlavaEngine):
+    kind = 'llava-pool'
+
+    def __init__(self, options=None):
+        super().__init__(options)
+        self.groups = core_groups(int(self.options.get('replicas', LLAVA_REPLICAS)),
+                                  int(self.options.get('cores_per_replica', LLAVA_REPLICA_CORES)))
+        # Un hilo de inferencia del pipeline por réplica.
+        self.concurrency = len(self.groups)
+        self.pool = None
+
+    def load(self):
+        if torch.cuda.is_available():
+            raise ValueError("El pool de réplicas LLaVA es sólo para CPU; en GPU usa el motor llava")
+        # El proceso padre no infiere: sus hilos de OpenMP quedan para las réplicas.
+        torch.set_num_threads(1)
+        super().load()
+        # Los pesos pasan a memoria compartida de sólo lectura: las réplicas los
+        # reciben por referencia y los usan sin copiarlos.
+        self.model.requires_grad_(False)
+        self.model.share_memory()
+        if self.assisted is not None:
+            self.assisted.draft.requires_grad_(False)
+            self.assisted.draft.share_memory()
+        self.label = f"LLaVA-Next ({self.model_name}, {len(self.groups)} réplicas)"
+
+    def warm_up(self):
+        self.pool = ReplicaPool(self, functools.partial(LlavaEngine.warm_up, self), self.groups)
+        self.pool.start()
+        logger.info(f"Pool de {self.pool.size} réplicas LLaVA listo")
+
+    def infer(self, delivery):
+        return self.pool.run('analyze', image_of(delivery), LLAVA_REPLICA_TIMEOUT)
+
+    def infer_batch(self, deliveries):
+        images = [image_of(delivery) for delivery in deliveries]
+        return self.pool.run('analyze_batch', images, LLAVA_REPLICA_TIMEOUT)
+
+    def __getstate__(self):
+        # Lo que viaja a cada réplica: el motor sin el pool ni las conexiones del padre.
+        state = self.__dict__.copy()
+        state['pool'] = None
+        state['get_redis'] = None
+        return state
+
+    def health(self) -> dict:
+        status = super().health()
+        status['replicas'] = self.pool.alive if self.pool is not None else 0
+        status['cores'] = self.groups
+        return status
+
+    def unload(self):
+        if self.pool is not None:
+            self.pool.stop()
+            self.pool = None
+        super().unload()
+        torch.set_num_threads(len(os.sched_getaffinity(0)))
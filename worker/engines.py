@@ -0,0 +1,176 @@
+import base64
+import importlib
+import io
+import threading
+import time
+import logging
+from contextlib import contextmanager
+from typing import List, Optional
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+# Tipo de motor -> (módulo, clase). Los módulos se importan al cargar el motor,
+# así la imagen de GPT-4 no necesita torch ni transformers.
+ENGINE_TYPES = {
+    'llava': ('engine_llava', 'LlavaEngine'),
+    'llava-pool': ('engine_llava', 'LlavaPoolEngine'),
+    'gpt4': ('engine_gpt4', 'GPT4Engine'),
+}
+
+
+def image_of(delivery) -> Image.Image:
+    # La tarea pudo decodificarse para un motor que sólo usaba el base64.
+    if delivery.image is None:
+        image = Image.open(io.BytesIO(base64.b64decode(delivery.image_data)))
+        delivery.image = image.convert('RGB')
+    return delivery.image
+
+
+class Engine:
+    kind = ''
+    label = ''
+    # Hilos de inferencia en paralelo (llamadas de red) y si agrupa tareas en una pasada.
+    concurrency = 1
+    supports_batch = False
+    # Si necesita la imagen decodificada con PIL o le basta el base64.
+    needs_image = True
+    # Motor al que se reenvían las tareas que fallan aquí ('' = ninguno).
+    failover_engine = ''
+    # Mensajes sin confirmar que el motor puede retener (defer) además del prefetch del pipeline.
+    max_deferred = 0
+
+    def __init__(self, options: Optional[dict] = None):
+        self.options = options or {}
+        self.ready = False
+        self.loaded_at = None
+        self.get_redis = None
+
+    def load(self):
+        raise NotImplementedError
+
+    def warm_up(self):
+        pass
+
+    def defer(self, delivery) -> bool:
+        # Un motor que acepta la tarea para procesarla más tarde queda a cargo de
+        # confirmarla y de guardar su resultado.
+        return False
+
+    def infer(self, delivery) -> dict:
+        raise NotImplementedError
+
+    def infer_batch(self, deliveries) -> List[dict]:
+        return [self.infer(delivery) for delivery in deliveries]
+
+    def health(self) -> dict:
+        return {'kind': self.kind, 'label': self.label, 'ready': self.ready,
+                'options': self.options, 'loaded_at': self.loaded_at}
+
+    def source(self) -> str:
+        return self.label
+
+    def unload(self):
+        self.ready = False
+
+
+def create_engine(kind: str, options: Optional[dict] = None) -> Engine:
+    if kind not in ENGINE_TYPES:
+        raise ValueError(f"Motor desconocido: {kind}")
+    module_name, class_name = ENGINE_TYPES[kind]
+    engine_class = getattr(importlib.import_module(module_name), class_name)
+    return engine_class(options)
+
+
+def pipeline_shape(engine: Engine) -> tuple:
+    # Atributos con los que se montan el pipeline y el prefetch al arrancar el worker.
+    return engine.concurrency, engine.supports_batch, engine.max_deferred
+
+
+def start_engine(kind: str, options: Optional[dict] = None, get_redis=None) -> Engine:
+    return load_engine(create_engine(kind, options), get_redis)
+
+
+def load_engine(engine: Engine, get_redis=None) -> Engine:
+    engine.get_redis = get_redis
+    started = time.perf_counter()
+    engine.load()
+    engine.warm_up()
+    engine.ready = True
+    engine.loaded_at = time.time()
+    logger.info(f"Motor {engine.label} listo en {time.perf_counter() - started:.1f}s")
+    return engine
+
+
+class EngineManager:
+    def __init__(self, engine: Engine, on_swap=None, get_redis=None):
+        self._current = engine
+        self._on_swap = on_swap
+        self._get_redis = get_redis
+        self._active = {}
+        self._cond = threading.Condition()
+        self._swap_thread = None
+
+    @property
+    def current(self) -> Engine:
+        return self._current
+
+    @contextmanager
+    def use(self):
+        # Cada inferencia fija el motor al empezar; un cambio a mitad de tarea
+        # no le quita el modelo, sólo afecta a las tareas siguientes.
+        with self._cond:
+            engine = self._current
+            self._active[id(engine)] = self._active.get(id(engine), 0) + 1
+        try:
+            yield engine
+        finally:
+            with self._cond:
+                self._active[id(engine)] -= 1
+                if not self._active[id(engine)]:
+                    del self._active[id(engine)]
+                    self._cond.notify_all()
+
+    @property
+    def swapping(self) -> bool:
+        return self._swap_thread is not None and self._swap_thread.is_alive()
+
+    def swap(self, kind: str, options: Optional[dict] = None) -> bool:
+        if self.swapping:
+            logger.warning(f"Cambio de motor a {kind} ignorado: ya hay otro en curso")
+            return False
+        self._swap_thread = threading.Thread(target=self._swap, args=(kind, options),
+                                             name='engine-swap', daemon=True)
+        self._swap_thread.start()
+        return True
+
+    def _swap(self, kind: str, options: Optional[dict]):
+        old = self._current
+        logger.info(f"Cargando motor {kind} {options or {}} junto a {old.label}...")
+        try:
+            engine = create_engine(kind, options)
+            # Los hilos de inferencia, el agrupado y el prefetch del canal se fijan al
+            # arrancar: un motor que necesita otros valores requiere reiniciar el worker.
+            if pipeline_shape(engine) != pipeline_shape(old):
+                logger.error(f"Cambio a {kind} rechazado: necesita concurrencia, lotes y mensajes retenidos "
+                             f"{pipeline_shape(engine)} y el worker está montado para {pipeline_shape(old)}; "
+                             f"reinicia el worker con el nuevo motor")
+                return
+            # El motor actual sigue atendiendo tráfico mientras el nuevo carga y se calienta.
+            load_engine(engine, self._get_redis)
+        except Exception as e:
+            logger.error(f"No se pudo cargar el motor {kind}, se mantiene {old.label}: {e}")
+            return
+
+        with self._cond:
+            self._current = engine
+            logger.info(f"Tráfico cambiado de {old.label} a {engine.label}")
+            while self._active.get(id(old)):
+                self._cond.wait()
+        old.unload()
+        logger.info(f"Motor {old.label} descargado")
+        if self._on_swap is not None:
+            try:
+                self._on_swap()
+            except Exception as e:
+                logger.warning(f"No se pudo publicar el estado del motor: {e}")
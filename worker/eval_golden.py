@@ -0,0 +1,221 @@
+import argparse
+import base64
+import csv
+import json
+import logging
+import multiprocessing
+import os
+import queue
+import resource
+import sys
+import time
+from engines import start_engine
+
+# Evalúa configuraciones de motor sobre un conjunto de imágenes etiquetadas con las
+# calorías y macros de referencia. Cada configuración corre en su propio proceso con
+# el mismo camino que el worker (engine.infer -> parse_nutrition_with_langchain), así
+# la memoria medida es sólo la suya. Ejemplo:
+#   python eval_golden.py golden/etiquetas.csv \
+#       --config llava \
+#       --config llava:quantization=4bit \
+#       --config llava:max_new_tokens=160,image_size=336 \
+#       --config gpt4:model=gpt-4o-mini,detail=low
+# El CSV tiene columnas imagen,calorias,proteinas,carbohidratos,grasas,fibra; las
+# rutas de imagen son relativas al CSV.
+
+MACROS = ['calorias', 'proteinas', 'carbohidratos', 'grasas', 'fibra']
+# Clave de cada macro en el resultado estructurado del worker.
+RESULT_KEYS = {
+    'calorias': 'calorías',
+    'proteinas': 'proteínas',
+    'carbohidratos': 'carbohidratos',
+    'grasas': 'grasas',
+    'fibra': 'fibra',
+}
+
+
+class GoldenSample:
+    # Lo mínimo de una Delivery que usan los motores al inferir.
+    def __init__(self, path: str, labels: dict):
+        with open(path, 'rb') as f:
+            self.image_data = base64.b64encode(f.read()).decode('ascii')
+        self.image = None
+        self.filename = os.path.basename(path)
+        self.task_id = self.filename
+        self.message = {}
+        self.priority = False
+        self.labels = labels
+
+
+def load_golden_set(path: str) -> list:
+    base = os.path.dirname(os.path.abspath(path))
+    rows = []
+    with open(path, newline='', encoding='utf-8') as f:
+        for row in csv.DictReader(f):
+            labels = {macro: float(row[macro]) for macro in MACROS if row.get(macro) not in (None, '')}
+            rows.append((os.path.join(base, row['imagen']), labels))
+    return rows
+
+
+def parse_config(spec: str):
+    kind, _, options = spec.partition(':')
+    return kind, dict(option.split('=', 1) for option in options.split(',') if option)
+
+
+def percentile(values, fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def parse_failed(result: dict) -> bool:
+    # Mismo criterio que el motor GPT-4: sin calorías, proteínas ni carbohidratos no hubo análisis útil.
+    if 'error' in result:
+        return True
+    return all(not result.get(RESULT_KEYS[macro], {}).get('value') for macro in ('calorias', 'proteinas', 'carbohidratos'))
+
+
+def peak_memory() -> dict:
+    # ru_maxrss viene en KB en Linux.
+    memory = {'rss_peak_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024}
+    torch = sys.modules.get('torch')
+    if torch is not None and torch.cuda.is_available():
+        memory['gpu_peak_mb'] = torch.cuda.max_memory_allocated() / (1024 ** 2)
+    return memory
+
+
+def evaluate(spec: str, golden: list, results):
+    logging.basicConfig(level=logging.WARNING)
+    kind, options = parse_config(spec)
+    if kind == 'gpt4':
+        # Se mide la ruta síncrona: con la Batch API (OPENAI_BATCH_MODE) las imágenes
+        # irían a un lote de OpenAI y la evaluación esperaría o puntuaría otra ruta.
+        options['batch_mode'] = 'off'
+    try:
+        started = time.perf_counter()
+        engine = start_engine(kind, options)
+        load_seconds = time.perf_counter() - started
+    except Exception as e:
+        results.put({'config': spec, 'error': f"No se pudo cargar: {e}"})
+        return
+
+    latencies = []
+    failures = 0
+    errors = {macro: [] for macro in MACROS}
+    samples = []
+    for path, labels in golden:
+        sample = GoldenSample(path, labels)
+        started = time.perf_counter()
+        try:
+            result = engine.infer(sample)
+        except Exception as e:
+            result = {'error': str(e)}
+        latencies.append(time.perf_counter() - started)
+
+        failed = parse_failed(result)
+        failures += failed
+        predicted = {macro: result.get(RESULT_KEYS[macro], {}).get('value', 0) for macro in MACROS}
+        if not failed:
+            for macro, expected in labels.items():
+                errors[macro].append(abs(predicted[macro] - expected))
+        samples.append({'imagen': sample.filename, 'segundos': round(latencies[-1], 3), 'fallo': failed,
+                        'prediccion': predicted, 'referencia': labels})
+        outcome = 'fallo de parseo' if failed else f"{predicted['calorias']:.0f} kcal (ref {labels.get('calorias', 0):.0f})"
+        print(f"[{spec}] {sample.filename}: {latencies[-1]:.2f}s {outcome}", flush=True)
+
+    report = {
+        'config': spec,
+        'label': engine.label,
+        'load_seconds': load_seconds,
+        'p50': percentile(latencies, 0.50),
+        'p90': percentile(latencies, 0.90),
+        'p99': percentile(latencies, 0.99),
+        'mean': sum(latencies) / len(latencies),
+        'parse_failure_rate': failures / len(golden),
+        'mae': {macro: sum(values) / len(values) for macro, values in errors.items() if values},
+        'samples': samples,
+    }
+    report.update(peak_memory())
+    engine.unload()
+    results.put(report)
+
+
+def run_isolated(spec: str, golden: list) -> dict:
+    # Proceso nuevo (spawn) por configuración: el pico de memoria no arrastra el modelo anterior.
+    ctx = multiprocessing.get_context('spawn')
+    results = ctx.Queue()
+    process = ctx.Process(target=evaluate, args=(spec, golden, results), name=f'eval-{spec}')
+    process.start()
+    while True:
+        try:
+            report = results.get(timeout=5)
+            break
+        except queue.Empty:
+            if not process.is_alive():
+                return {'config': spec, 'error': f"El proceso terminó sin informe (código {process.exitcode})"}
+    process.join()
+    return report
+
+
+def memory_of(report: dict) -> float:
+    return report.get('gpu_peak_mb', report['rss_peak_mb'])
+
+
+def mark_pareto(reports: list):
+    # Una configuración queda en la frontera si ninguna otra es igual o mejor en latencia,
+    # memoria y error de calorías, y estrictamente mejor en alguna.
+    def costs(report):
+        return (report['p90'], memory_of(report), report['mae'].get('calorias', float('inf')),
+                report['parse_failure_rate'])
+
+    for report in reports:
+        report['pareto'] = not any(
+            all(a <= b for a, b in zip(costs(other), costs(report))) and costs(other) != costs(report)
+            for other in reports if other is not report
+        )
+
+
+def print_table(reports: list):
+    header = (f"{'configuración':<44} {'p50':>7} {'p90':>7} {'p99':>7} {'mem MB':>8} {'fallos':>7} "
+              + ' '.join(f"{'MAE ' + macro[:5]:>10}" for macro in MACROS) + '  pareto')
+    print(header)
+    print('-' * len(header))
+    for report in reports:
+        if 'error' in report:
+            print(f"{report['config']:<44} {report['error']}")
+            continue
+        mae = ' '.join(f"{report['mae'][macro]:>10.1f}" if macro in report['mae'] else f"{'-':>10}" for macro in MACROS)
+        print(f"{report['config']:<44} {report['p50']:>6.2f}s {report['p90']:>6.2f}s {report['p99']:>6.2f}s "
+              f"{memory_of(report):>8.0f} {report['parse_failure_rate']:>7.1%} {mae}  {'*' if report['pareto'] else ''}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Latencia, memoria y error nutricional de configuraciones de motor "
+                                                 "sobre un conjunto de imágenes etiquetadas")
+    parser.add_argument('labels', help="CSV con imagen,calorias,proteinas,carbohidratos,grasas,fibra")
+    parser.add_argument('--config', action='append', required=True, metavar='MOTOR[:CLAVE=VALOR,...]',
+                        help="Configuración a evaluar, p. ej. llava:quantization=4bit,max_new_tokens=256")
+    parser.add_argument('--limit', type=int, help="Evalúa sólo las primeras N imágenes")
+    parser.add_argument('--save', help="Guarda el informe completo (con cada imagen) en un JSON")
+    args = parser.parse_args()
+
+    golden = load_golden_set(args.labels)[:args.limit]
+    if not golden:
+        print("El conjunto de evaluación está vacío")
+        return
+    print(f"Evaluando {len(args.config)} configuraciones sobre {len(golden)} imágenes")
+
+    reports = [run_isolated(spec, golden) for spec in args.config]
+    evaluated = [report for report in reports if 'error' not in report]
+    mark_pareto(evaluated)
+    print()
+    print_table(reports)
+    print("\n* = frontera de Pareto en latencia p90, memoria, MAE de calorías y tasa de fallos")
+
+    if args.save:
+        with open(args.save, 'w', encoding='utf-8') as f:
+            json.dump(reports, f, ensure_ascii=False, indent=2)
+        print(f"Informe guardado en {args.save}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,181 @@
+import csv
+import os
+import time
+import logging
+from typing import List, Optional
+from PIL import Image
+from NutritionInfo import NutritionInfo
+
+try:
+    import numpy as np
+    import onnxruntime as ort
+except ImportError:
+    np = None
+    ort = None
+
+logger = logging.getLogger(__name__)
+
+FAST_TIER_MODEL = os.getenv('FAST_TIER_MODEL', '')
+FAST_TIER_LABELS = os.getenv('FAST_TIER_LABELS', '')
+FAST_TIER_TABLE = os.getenv('FAST_TIER_TABLE', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'nutrient_table.csv'))
+FAST_TIER_THRESHOLD = float(os.getenv('FAST_TIER_THRESHOLD', 0.85))
+FAST_TIER_BATCH_SIZE = int(os.getenv('FAST_TIER_BATCH_SIZE', 8))
+FAST_TIER_INPUT_SIZE = int(os.getenv('FAST_TIER_INPUT_SIZE', 224))
+FAST_TIER_THREADS = int(os.getenv('FAST_TIER_THREADS', 2))
+
+STATS_KEY = 'stats:fast_tier'
+MODEL_NAME = 'Clasificador rápido (ONNX)'
+
+IMAGENET_MEAN = (0.485, 0.456, 0.406)
+IMAGENET_STD = (0.229, 0.224, 0.225)
+
+
+def load_nutrient_table(path: str = FAST_TIER_TABLE) -> dict:
+    table = {}
+    with open(path, newline='', encoding='utf-8') as f:
+        for row in csv.DictReader(f):
+            table[row['label']] = {
+                'comida': row['comida'],
+                'porcion_g': float(row['porcion_g']),
+                'calorias': float(row['calorias_100g']),
+                'proteinas': float(row['proteinas_100g']),
+                'carbohidratos': float(row['carbohidratos_100g']),
+                'grasas': float(row['grasas_100g']),
+                'fibra': float(row['fibra_100g']),
+            }
+    return table
+
+
+def lookup_nutrition(table: dict, label: str, probability: float, portion_g: Optional[float] = None) -> Optional[NutritionInfo]:
+    entry = table.get(label)
+    if entry is None:
+        return None
+    factor = (portion_g or entry['porcion_g']) / 100
+    return NutritionInfo(
+        comida=entry['comida'],
+        calorias=round(entry['calorias'] * factor, 1),
+        proteinas=round(entry['proteinas'] * factor, 1),
+        carbohidratos=round(entry['carbohidratos'] * factor, 1),
+        grasas=round(entry['grasas'] * factor, 1),
+        fibra=round(entry['fibra'] * factor, 1),
+        confianza=round(probability * 100, 1),
+    )
+
+
+def build_result(info: NutritionInfo, portion_g: float) -> dict:
+    raw = (f"Comida: {info.comida} (porción estimada {portion_g:g} g)\n"
+           f"Calorías: {info.calorias} kcal\nProteínas: {info.proteinas} g\n"
+           f"Carbohidratos: {info.carbohidratos} g\nGrasas: {info.grasas} g\n"
+           f"Fibra: {info.fibra} g\nConfianza: {info.confianza}%")
+    return {
+        'nombre': info.comida,
+        'alimento': info.comida,
+        'food_type': info.comida,
+        'calorías': {'value': info.calorias, 'unit': 'kcal'},
+        'proteínas': {'value': info.proteinas, 'unit': 'g'},
+        'carbohidratos': {'value': info.carbohidratos, 'unit': 'g'},
+        'grasas': {'value': info.grasas, 'unit': 'g'},
+        'fibra': {'value': info.fibra, 'unit': 'g'},
+        'confianza': {'value': info.confianza, 'unit': '%'},
+        'raw_analysis': raw,
+        'model': MODEL_NAME,
+    }
+
+
+class FastTier:
+    def __init__(self, get_redis=None, threshold: float = FAST_TIER_THRESHOLD):
+        self.threshold = threshold
+        self._get_redis = get_redis
+        self._session = None
+        self._input_name = None
+        self._labels = []
+        self._table = {}
+
+    @property
+    def enabled(self) -> bool:
+        return self._session is not None
+
+    def load(self) -> bool:
+        if not FAST_TIER_MODEL:
+            return False
+        if ort is None:
+            logger.warning("FAST_TIER_MODEL configurado pero onnxruntime/numpy no están instalados")
+            return False
+        try:
+            options = ort.SessionOptions()
+            options.intra_op_num_threads = FAST_TIER_THREADS
+            self._session = ort.InferenceSession(FAST_TIER_MODEL, options, providers=['CPUExecutionProvider'])
+            self._input_name = self._session.get_inputs()[0].name
+            with open(FAST_TIER_LABELS, encoding='utf-8') as f:
+                self._labels = [line.strip() for line in f if line.strip()]
+            self._table = load_nutrient_table()
+            logger.info(f"Clasificador rápido cargado: {len(self._labels)} clases, "
+                        f"{len(self._table)} alimentos en tabla, umbral {self.threshold}")
+            return True
+        except Exception as e:
+            logger.error(f"No se pudo cargar el clasificador rápido: {e}")
+            self._session = None
+            return False
+
+    def _preprocess(self, image: Image.Image):
+        size = FAST_TIER_INPUT_SIZE
+        resize = int(size * 256 / 224)
+        image = image.convert('RGB')
+        scale = resize / min(image.size)
+        image = image.resize((max(resize, round(image.width * scale)), max(resize, round(image.height * scale))),
+                             Image.BILINEAR)
+        left = (image.width - size) // 2
+        top = (image.height - size) // 2
+        image = image.crop((left, top, left + size, top + size))
+        array = np.asarray(image, dtype=np.float32) / 255.0
+        array = (array - np.array(IMAGENET_MEAN, dtype=np.float32)) / np.array(IMAGENET_STD, dtype=np.float32)
+        return array.transpose(2, 0, 1)
+
+    def classify(self, images: List[Image.Image]):
+        batch = np.stack([self._preprocess(image) for image in images])
+        logits = self._session.run(None, {self._input_name: batch})[0]
+        logits = logits - logits.max(axis=1, keepdims=True)
+        probabilities = np.exp(logits)
+        probabilities /= probabilities.sum(axis=1, keepdims=True)
+        best = probabilities.argmax(axis=1)
+        return [(self._labels[index], float(probabilities[row, index])) for row, index in enumerate(best)]
+
+    def resolve(self, deliveries) -> List[bool]:
+        started = time.perf_counter()
+        predictions = self.classify([delivery.image for delivery in deliveries])
+        resolved = []
+        for delivery, (label, probability) in zip(deliveries, predictions):
+            info = lookup_nutrition(self._table, label, probability) if probability >= self.threshold else None
+            if info is None:
+                logger.info(f"Tarea {delivery.task_id}: '{label}' ({probability:.2f}) escalada al modelo grande")
+                resolved.append(False)
+                continue
+            portion_g = self._table[label]['porcion_g']
+            delivery.result = dict(build_result(info, portion_g), task_id=delivery.task_id,
+                                   filename=delivery.filename, status='completed', timestamp=MODEL_NAME)
+            delivery.image = None
+            logger.info(f"Tarea {delivery.task_id} resuelta por el clasificador rápido: {info.comida} ({probability:.2f})")
+            resolved.append(True)
+
+        hits = sum(resolved)
+        self._record(classified=len(deliveries), resolved=hits, escalated=len(deliveries) - hits,
+                     fast_seconds=time.perf_counter() - started)
+        return resolved
+
+    def record_escalated(self, seconds: float, count: int = 1):
+        self._record(llm_tasks=count, llm_seconds=seconds)
+
+    def _record(self, **counters):
+        redis_conn = self._get_redis() if self._get_redis else None
+        if redis_conn is None:
+            return
+        try:
+            pipe = redis_conn.pipeline(transaction=False)
+            for field, value in counters.items():
+                if isinstance(value, float):
+                    pipe.hincrbyfloat(STATS_KEY, field, value)
+                else:
+                    pipe.hincrby(STATS_KEY, field, value)
+            pipe.execute()
+        except Exception as e:
+            logger.warning(f"No se pudieron registrar estadísticas del clasificador rápido: {e}")
@@ -0,0 +1,43 @@
+import argparse
+import os
+from redis_topology import create_redis
+from fast_classifier import STATS_KEY
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Reporte de escalamiento y ahorro de latencia del clasificador rápido")
+    parser.add_argument('--host', default=os.getenv('REDIS_HOST', 'localhost'))
+    parser.add_argument('--port', type=int, default=int(os.getenv('REDIS_PORT', 6379)))
+    parser.add_argument('--reset', action='store_true', help="Reinicia los contadores después del reporte")
+    args = parser.parse_args()
+
+    conn = create_redis(host=args.host, port=args.port)
+    stats = {k: float(v) for k, v in conn.hgetall(STATS_KEY).items()}
+    classified = stats.get('classified', 0)
+    if not classified:
+        print("Sin datos: el clasificador rápido no ha procesado tareas")
+        return
+
+    resolved = stats.get('resolved', 0)
+    escalated = stats.get('escalated', 0)
+    fast_avg = stats.get('fast_seconds', 0) / classified
+    llm_tasks = stats.get('llm_tasks', 0)
+    llm_avg = stats.get('llm_seconds', 0) / llm_tasks if llm_tasks else 0
+
+    # Sin el primer nivel, todas las tareas habrían pagado la latencia del modelo grande.
+    baseline = classified * llm_avg
+    actual = classified * fast_avg + escalated * llm_avg
+    print(f"Tareas clasificadas:       {classified:.0f}")
+    print(f"Resueltas en primer nivel: {resolved:.0f} ({resolved / classified:.1%})")
+    print(f"Escaladas al modelo:       {escalated:.0f} ({escalated / classified:.1%})")
+    print(f"Latencia media clasificador: {fast_avg * 1000:.1f} ms")
+    print(f"Latencia media modelo grande: {llm_avg:.2f} s")
+    if baseline:
+        print(f"Tiempo de inferencia ahorrado: {baseline - actual:.1f} s ({1 - actual / baseline:.1%})")
+
+    if args.reset:
+        conn.delete(STATS_KEY)
+
+
+if __name__ == '__main__':
+    main()
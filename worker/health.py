@@ -0,0 +1,71 @@
+import os
+import socket
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+HEARTBEAT_INTERVAL = int(os.getenv('ENGINE_HEARTBEAT_INTERVAL', 10))
+WORKER_ALIVE_SECONDS = int(os.getenv('WORKER_ALIVE_SECONDS', 30))
+HEALTH_BUCKET_SECONDS = 10
+LATENCY_SAMPLES = 100
+
+
+def engine_queue(base_queue: str, engine: str) -> str:
+    return f"{base_queue}.{engine}"
+
+
+class EngineHealth:
+    def __init__(self, engine: str, get_redis):
+        self.engine = engine
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self._get_redis = get_redis
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._heartbeat_loop, name='engine-heartbeat', daemon=True)
+            self._thread.start()
+
+    def _heartbeat_loop(self):
+        while True:
+            self.heartbeat()
+            time.sleep(HEARTBEAT_INTERVAL)
+
+    def heartbeat(self):
+        redis_conn = self._get_redis()
+        if redis_conn is None:
+            return
+        try:
+            now = time.time()
+            key = f"engine:{self.engine}:workers"
+            pipe = redis_conn.pipeline(transaction=False)
+            pipe.zadd(key, {self.worker_id: now})
+            pipe.zremrangebyscore(key, '-inf', now - WORKER_ALIVE_SECONDS * 10)
+            pipe.execute()
+        except Exception as e:
+            logger.warning(f"No se pudo enviar heartbeat del motor {self.engine}: {e}")
+
+    def record(self, seconds: float, ok: bool = True, count: int = 1):
+        redis_conn = self._get_redis()
+        if redis_conn is None:
+            return
+        try:
+            bucket = f"engine:{self.engine}:outcomes:{int(time.time() // HEALTH_BUCKET_SECONDS)}"
+            pipe = redis_conn.pipeline(transaction=False)
+            if ok:
+                latency = f"engine:{self.engine}:latency"
+                pipe.lpush(latency, *[round(seconds, 3)] * count)
+                pipe.ltrim(latency, 0, LATENCY_SAMPLES - 1)
+            pipe.hincrby(bucket, 'ok' if ok else 'error', count)
+            pipe.expire(bucket, HEALTH_BUCKET_SECONDS * 12)
+            pipe.execute()
+        except Exception as e:
+            logger.warning(f"No se pudieron registrar métricas del motor {self.engine}: {e}")
+
+    def workers_alive(self, engine: str) -> int:
+        redis_conn = self._get_redis()
+        if redis_conn is None:
+            return 0
+        return redis_conn.zcount(f"engine:{engine}:workers", time.time() - WORKER_ALIVE_SECONDS, '+inf')
@@ -0,0 +1,184 @@
+import os
+import time
+import logging
+import pika
+from typing import Optional
+from pika.exceptions import NackError, UnroutableError
+from storage import store_result
+
+logger = logging.getLogger(__name__)
+
+RETRY_EXCHANGE = os.getenv('RABBITMQ_RETRY_EXCHANGE', 'food_analysis_retry')
+DEAD_LETTER_EXCHANGE = os.getenv('RABBITMQ_DEAD_LETTER_EXCHANGE', 'food_analysis_dlx')
+DEAD_LETTER_QUEUE = os.getenv('RABBITMQ_DEAD_LETTER_QUEUE', 'food_analysis_dead_letter')
+
+MAX_ATTEMPTS = int(os.getenv('TASK_MAX_ATTEMPTS', 5))
+RETRY_DELAYS_MS = [int(d) for d in os.getenv('TASK_RETRY_DELAYS_MS', '2000,10000,30000,120000').split(',')]
+# Límite por cola de reintentos: si se llena, el broker rechaza la publicación
+# y el mensaje pasa a la cola de mensajes muertos en lugar de acumularse.
+RETRY_QUEUE_MAX_LENGTH = int(os.getenv('TASK_RETRY_QUEUE_MAX_LENGTH', 10000))
+
+ATTEMPTS_HEADER = 'x-attempts'
+ORIGINAL_QUEUE_HEADER = 'x-original-queue'
+REASON_HEADER = 'x-failure-reason'
+# Instante (epoch, segundos) a partir del cual nadie espera ya el resultado.
+DEADLINE_HEADER = 'x-deadline'
+
+
+def retry_queue_name(queue: str, delay_ms: int) -> str:
+    return f"{queue}.retry.{delay_ms}ms"
+
+
+def declare_topology(channel, queues):
+    channel.exchange_declare(exchange=RETRY_EXCHANGE, exchange_type='direct', durable=True)
+    channel.exchange_declare(exchange=DEAD_LETTER_EXCHANGE, exchange_type='fanout', durable=True)
+    channel.queue_declare(queue=DEAD_LETTER_QUEUE, durable=True)
+    channel.queue_bind(queue=DEAD_LETTER_QUEUE, exchange=DEAD_LETTER_EXCHANGE)
+
+    for queue in queues:
+        for delay_ms in RETRY_DELAYS_MS:
+            name = retry_queue_name(queue, delay_ms)
+            channel.queue_declare(
+                queue=name,
+                durable=True,
+                arguments={
+                    'x-message-ttl': delay_ms,
+                    'x-dead-letter-exchange': '',
+                    'x-dead-letter-routing-key': queue,
+                    'x-max-length': RETRY_QUEUE_MAX_LENGTH,
+                    'x-overflow': 'reject-publish',
+                }
+            )
+            channel.queue_bind(queue=name, exchange=RETRY_EXCHANGE, routing_key=name)
+
+    # Con confirmaciones activas, basic_publish lanza NackError si la cola de
+    # reintentos está llena, lo que permite desviar el mensaje al DLQ.
+    channel.confirm_delivery()
+
+
+def get_attempts(properties) -> int:
+    headers = (properties.headers or {}) if properties else {}
+    try:
+        return int(headers.get(ATTEMPTS_HEADER, 0))
+    except (TypeError, ValueError):
+        return 0
+
+
+def is_expired(properties) -> bool:
+    headers = (properties.headers or {}) if properties else {}
+    try:
+        deadline = float(headers.get(DEADLINE_HEADER) or 0)
+    except (TypeError, ValueError):
+        return False
+    return 0 < deadline < time.time()
+
+
+def _original_queue(method, properties) -> str:
+    headers = (properties.headers or {}) if properties else {}
+    return headers.get(ORIGINAL_QUEUE_HEADER) or method.routing_key
+
+
+def _republish_properties(properties, attempts: int, extra_headers: Optional[dict] = None):
+    headers = dict((properties.headers or {}) if properties else {})
+    headers[ATTEMPTS_HEADER] = attempts
+    if extra_headers:
+        headers.update(extra_headers)
+    return pika.BasicProperties(
+        delivery_mode=2,
+        content_type=getattr(properties, 'content_type', None),
+        headers=headers,
+    )
+
+
+def write_terminal_error(redis_conn, task_id: Optional[str], filename: Optional[str], reason: str, attempts: int,
+                         image_hash: Optional[str] = None):
+    if not task_id:
+        return False
+    if redis_conn is None:
+        logger.error(f"No se pudo registrar el error terminal de la tarea {task_id}: Redis no disponible")
+        return False
+    try:
+        store_result(redis_conn, task_id, {
+            'filename': filename or 'unknown',
+            'error': reason,
+            'status': 'error',
+            'terminal': True,
+            'attempts': attempts,
+        }, image_hash=image_hash)
+        return True
+    except Exception as e:
+        logger.error(f"Error registrando error terminal de la tarea {task_id}: {e}")
+        return False
+
+
+def dead_letter(ch, method, properties, body, reason: str, redis_conn=None,
+                task_id: Optional[str] = None, filename: Optional[str] = None, image_hash: Optional[str] = None):
+    attempts = get_attempts(properties)
+    try:
+        ch.basic_publish(
+            exchange=DEAD_LETTER_EXCHANGE,
+            routing_key='',
+            body=body,
+            properties=_republish_properties(properties, attempts, {
+                ORIGINAL_QUEUE_HEADER: _original_queue(method, properties),
+                REASON_HEADER: reason[:512],
+            })
+        )
+    except Exception as e:
+        logger.error(f"No se pudo publicar en la cola de mensajes muertos: {e}")
+
+    write_terminal_error(redis_conn, task_id, filename, reason, attempts, image_hash)
+    ch.basic_ack(delivery_tag=method.delivery_tag)
+    logger.warning(f"Tarea {task_id or 'desconocida'} enviada a {DEAD_LETTER_QUEUE} tras {attempts} intentos: {reason}")
+
+
+def retry_later(ch, method, properties, body, reason: str, redis_conn=None,
+                task_id: Optional[str] = None, filename: Optional[str] = None, image_hash: Optional[str] = None):
+    attempts = get_attempts(properties) + 1
+    if attempts >= MAX_ATTEMPTS:
+        properties = _republish_properties(properties, attempts)
+        dead_letter(ch, method, properties, body, reason, redis_conn, task_id, filename, image_hash)
+        return
+
+    delay_ms = RETRY_DELAYS_MS[min(attempts - 1, len(RETRY_DELAYS_MS) - 1)]
+    queue = _original_queue(method, properties)
+    try:
+        ch.basic_publish(
+            exchange=RETRY_EXCHANGE,
+            routing_key=retry_queue_name(queue, delay_ms),
+            body=body,
+            properties=_republish_properties(properties, attempts, {
+                ORIGINAL_QUEUE_HEADER: queue,
+                REASON_HEADER: reason[:512],
+            })
+        )
+    except (NackError, UnroutableError) as e:
+        logger.warning(f"Cola de reintentos saturada para la tarea {task_id}: {e}")
+        properties = _republish_properties(properties, attempts)
+        dead_letter(ch, method, properties, body, f"Reintentos saturados: {reason}", redis_conn, task_id, filename,
+                    image_hash)
+        return
+
+    ch.basic_ack(delivery_tag=method.delivery_tag)
+    logger.info(f"Tarea {task_id} reprogramada en {delay_ms} ms (intento {attempts}/{MAX_ATTEMPTS}): {reason}")
+
+
+def reroute(ch, method, properties, body, queue: str, reason: str, redis_conn=None,
+            task_id: Optional[str] = None, filename: Optional[str] = None, image_hash: Optional[str] = None):
+    try:
+        ch.basic_publish(
+            exchange='',
+            routing_key=queue,
+            body=body,
+            properties=_republish_properties(properties, get_attempts(properties), {
+                ORIGINAL_QUEUE_HEADER: queue,
+                REASON_HEADER: reason[:512],
+            })
+        )
+    except (NackError, UnroutableError) as e:
+        logger.warning(f"No se pudo redirigir la tarea {task_id} a {queue}: {e}")
+        retry_later(ch, method, properties, body, reason, redis_conn, task_id, filename, image_hash)
+        return
+
+    ch.basic_ack(delivery_tag=method.delivery_tag)
+    logger.warning(f"Tarea {task_id or 'desconocida'} redirigida a {queue}: {reason}")
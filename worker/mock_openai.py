@@ -0,0 +1,162 @@
+import argparse
+import hashlib
+import json
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Servidor local que imita las rutas de OpenAI que usa el worker GPT-4 (chat,
+# archivos y Batch API) para probar el modo por lotes sin gastar en la API real:
+#   OPENAI_BASE_URL=http://localhost:8000/v1 OPENAI_API_KEY=mock OPENAI_BATCH_MODE=normal python worker.py
+
+files = {}
+batches = {}
+lock = threading.RLock()
+batch_delay = 10.0
+
+
+def fake_analysis(seed: str) -> str:
+    value = int(hashlib.sha256(seed.encode('utf-8')).hexdigest()[:8], 16)
+    calories = 200 + value % 600
+    return (f"Comida: Plato simulado {value % 100}\n"
+            f"Calorías: {calories} kcal\n"
+            f"Proteínas: {calories // 20} g\n"
+            f"Carbohidratos: {calories // 8} g\n"
+            f"Grasas: {calories // 30} g\n"
+            f"Fibra: {value % 10} g\n"
+            f"Confianza: 80%")
+
+
+def chat_completion(body: dict, seed: str) -> dict:
+    return {
+        'id': f"chatcmpl-{uuid.uuid4().hex}",
+        'object': 'chat.completion',
+        'created': int(time.time()),
+        'model': body.get('model', 'gpt-4o'),
+        'choices': [{
+            'index': 0,
+            'message': {'role': 'assistant', 'content': fake_analysis(seed)},
+            'finish_reason': 'stop',
+        }],
+        'usage': {'prompt_tokens': 800, 'completion_tokens': 60, 'total_tokens': 860},
+    }
+
+
+def store_file(content: bytes, filename: str, purpose: str) -> dict:
+    file_id = f"file-{uuid.uuid4().hex}"
+    meta = {'id': file_id, 'object': 'file', 'bytes': len(content), 'created_at': int(time.time()),
+            'filename': filename, 'purpose': purpose, 'status': 'processed'}
+    with lock:
+        files[file_id] = (meta, content)
+    return meta
+
+
+def batch_view(batch: dict) -> dict:
+    # El lote se completa batch_delay segundos después de crearse.
+    if batch['status'] == 'in_progress' and time.time() - batch['created_at'] >= batch_delay:
+        lines = []
+        for line in files[batch['input_file_id']][1].decode('utf-8').splitlines():
+            request = json.loads(line)
+            lines.append(json.dumps({
+                'id': f"batch_req_{uuid.uuid4().hex}",
+                'custom_id': request['custom_id'],
+                'response': {'status_code': 200, 'request_id': uuid.uuid4().hex,
+                             'body': chat_completion(request['body'], request['custom_id'])},
+                'error': None,
+            }))
+        output = store_file('\n'.join(lines).encode('utf-8'), 'output.jsonl', 'batch_output')
+        batch.update(status='completed', output_file_id=output['id'], completed_at=int(time.time()))
+        batch['request_counts'] = {'total': len(lines), 'completed': len(lines), 'failed': 0}
+    return batch
+
+
+def parse_multipart(body: bytes, content_type: str) -> dict:
+    boundary = re.search(r'boundary="?([^";]+)"?', content_type).group(1).encode('utf-8')
+    fields = {}
+    for part in body.split(b'--' + boundary):
+        if b'\r\n\r\n' not in part:
+            continue
+        headers, _, value = part.partition(b'\r\n\r\n')
+        name = re.search(rb'name="([^"]+)"', headers)
+        filename = re.search(rb'filename="([^"]*)"', headers)
+        if name:
+            fields[name.group(1).decode('utf-8')] = (value[:-2] if value.endswith(b'\r\n') else value,
+                                                     filename.group(1).decode('utf-8') if filename else None)
+    return fields
+
+
+class MockOpenAIHandler(BaseHTTPRequestHandler):
+    def _send(self, payload, status: int = 200, raw: bool = False):
+        body = payload if raw else json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/octet-stream' if raw else 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _body(self) -> bytes:
+        return self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+    def do_GET(self):
+        path = self.path.split('?')[0]
+        if path.startswith('/v1/models/'):
+            self._send({'id': path.rsplit('/', 1)[1], 'object': 'model', 'created': 0, 'owned_by': 'mock'})
+        elif match := re.fullmatch(r'/v1/files/([^/]+)/content', path):
+            with lock:
+                entry = files.get(match.group(1))
+            self._send(entry[1], raw=True) if entry else self._send({'error': {'message': 'No existe'}}, 404)
+        elif match := re.fullmatch(r'/v1/batches/([^/]+)', path):
+            with lock:
+                batch = batches.get(match.group(1))
+                view = dict(batch_view(batch)) if batch else None
+            self._send(view) if view else self._send({'error': {'message': 'No existe'}}, 404)
+        else:
+            self._send({'error': {'message': f"Ruta no simulada: {path}"}}, 404)
+
+    def do_POST(self):
+        path = self.path.split('?')[0]
+        if path == '/v1/chat/completions':
+            body = json.loads(self._body())
+            self._send(chat_completion(body, uuid.uuid4().hex))
+        elif path == '/v1/files':
+            fields = parse_multipart(self._body(), self.headers['Content-Type'])
+            content, filename = fields['file']
+            self._send(store_file(content, filename or 'upload.jsonl', fields.get('purpose', (b'batch',))[0].decode('utf-8')))
+        elif path == '/v1/batches':
+            body = json.loads(self._body())
+            batch_id = f"batch_{uuid.uuid4().hex}"
+            batch = {
+                'id': batch_id, 'object': 'batch', 'endpoint': body['endpoint'], 'errors': None,
+                'input_file_id': body['input_file_id'], 'completion_window': body['completion_window'],
+                'status': 'in_progress', 'output_file_id': None, 'error_file_id': None,
+                'created_at': int(time.time()), 'completed_at': None, 'metadata': body.get('metadata'),
+                'request_counts': {'total': 0, 'completed': 0, 'failed': 0},
+            }
+            with lock:
+                if body['input_file_id'] not in files:
+                    self._send({'error': {'message': 'Archivo de entrada inexistente'}}, 400)
+                    return
+                batches[batch_id] = batch
+            print(f"Lote {batch_id} recibido, se completará en {batch_delay:.0f}s")
+            self._send(batch)
+        else:
+            self._send({'error': {'message': f"Ruta no simulada: {path}"}}, 404)
+
+
+def main():
+    global batch_delay
+    parser = argparse.ArgumentParser(description="Servidor OpenAI simulado para probar el worker GPT-4 y la Batch API")
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--batch-delay', type=float, default=10, help="Segundos hasta que un lote se completa")
+    args = parser.parse_args()
+    batch_delay = args.batch_delay
+
+    server = ThreadingHTTPServer(('0.0.0.0', args.port), MockOpenAIHandler)
+    print(f"OpenAI simulado escuchando en http://localhost:{args.port}/v1")
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,134 @@
+import re
+import logging
+from NutritionInfo import NutritionInfo
+
+logger = logging.getLogger(__name__)
+
+
+def parse_nutrition_with_langchain(raw_text: str, default_confidence: float = 85) -> NutritionInfo:
+    try:
+        def extract_value(text: str, keywords: list, default: float = 0) -> float:
+            for keyword in keywords:
+                patterns = [
+                    rf"{keyword}[^:]*:\s*(\d+(?:\.\d+)?)",
+                    rf"{keyword}[^\d]*(\d+(?:\.\d+)?)",
+                    rf"(\d+(?:\.\d+)?)\s*(?:g|kcal|cal)?\s*{keyword}",
+                ]
+                for pattern in patterns:
+                    match = re.search(pattern, text, re.IGNORECASE)
+                    if match:
+                        return float(match.group(1))
+            return default
+
+        def extract_food_name(text: str) -> str:
+            patterns = [
+                r"[Cc]omida:\s*([^\n\r]+)",
+                r"[Aa]limento:\s*([^\n\r]+)",
+                r"[Tt]ipo:\s*([^\n\r]+)",
+            ]
+            for pattern in patterns:
+                match = re.search(pattern, text)
+                if match:
+                    name = match.group(1).strip()
+                    name = re.sub(r'[.,!?]+$', '', name)
+                    return name
+
+            lines = text.split('\n')
+            for line in lines:
+                line = line.strip()
+                if line and not any(kw in line.lower() for kw in ['calorías', 'proteínas', 'carbohidratos', 'grasas', 'fibra']):
+                    words = line.split()[:8]
+                    if words:
+                        return " ".join(words)
+
+            return "Alimento no identificado"
+
+        nutrition_data = NutritionInfo(
+            comida=extract_food_name(raw_text),
+            calorias=extract_value(raw_text, ['calor', 'kcal', 'cal'], 0),
+            proteinas=extract_value(raw_text, ['prote', 'protein'], 0),
+            carbohidratos=extract_value(raw_text, ['carboh', 'carb', 'hidrat'], 0),
+            grasas=extract_value(raw_text, ['gras', 'fat', 'lip'], 0),
+            fibra=extract_value(raw_text, ['fibra', 'fiber'], 0),
+            confianza=extract_value(raw_text, ['confianza', 'confidence', 'certeza'], default_confidence)
+        )
+
+        logger.info(f"Datos parseados con Pydantic: {nutrition_data.comida}")
+        logger.info(f"   Calorías: {nutrition_data.calorias}, Proteínas: {nutrition_data.proteinas}g, "
+                   f"Carbohidratos: {nutrition_data.carbohidratos}g, Grasas: {nutrition_data.grasas}g")
+
+        return nutrition_data
+
+    except Exception as e:
+        logger.error(f"Error parseando con LangChain: {e}")
+        return NutritionInfo(
+            comida="Error al analizar",
+            calorias=0,
+            proteinas=0,
+            carbohidratos=0,
+            grasas=0,
+            fibra=0,
+            confianza=0
+        )
+
+
+def structure_nutrition_result(nutrition_info: NutritionInfo, raw_result: str, model: str) -> dict:
+    structured_result = {
+        'nombre': nutrition_info.comida,
+        'alimento': nutrition_info.comida,
+        'food_type': nutrition_info.comida,
+        'calorías': {
+            'value': nutrition_info.calorias,
+            'unit': 'kcal',
+            'description': 'Energía proporcionada por el alimento'
+        },
+        'proteínas': {
+            'value': nutrition_info.proteinas,
+            'unit': 'g',
+            'description': 'Esenciales para el crecimiento y reparación muscular'
+        },
+        'carbohidratos': {
+            'value': nutrition_info.carbohidratos,
+            'unit': 'g',
+            'description': 'Fuente principal de energía'
+        },
+        'grasas': {
+            'value': nutrition_info.grasas,
+            'unit': 'g',
+            'description': 'Importantes para la absorción de vitaminas'
+        },
+        'fibra': {
+            'value': nutrition_info.fibra,
+            'unit': 'g',
+            'description': 'Ayuda a la digestión y salud intestinal'
+        },
+        'confianza': {
+            'value': nutrition_info.confianza,
+            'unit': '%',
+            'description': 'Nivel de confianza del análisis'
+        },
+        'raw_analysis': raw_result,
+        'model': model
+    }
+
+    logger.info(f"Análisis {model}: {nutrition_info.comida}, "
+               f"Calorías: {nutrition_info.calorias}, Proteínas: {nutrition_info.proteinas}g, "
+               f"Carbohidratos: {nutrition_info.carbohidratos}g, Grasas: {nutrition_info.grasas}g, "
+               f"Fibra: {nutrition_info.fibra}g, Confianza: {nutrition_info.confianza}%")
+
+    return structured_result
+
+
+def error_result(error: str, model: str) -> dict:
+    return {
+        'error': error,
+        'raw_analysis': f'Error en el análisis: {error}',
+        'nombre': 'Error al analizar',
+        'calorías': {'value': 0, 'unit': 'kcal', 'description': 'Error'},
+        'proteínas': {'value': 0, 'unit': 'g', 'description': 'Error'},
+        'carbohidratos': {'value': 0, 'unit': 'g', 'description': 'Error'},
+        'grasas': {'value': 0, 'unit': 'g', 'description': 'Error'},
+        'fibra': {'value': 0, 'unit': 'g', 'description': 'Error'},
+        'food_type': 'No identificado',
+        'model': model
+    }
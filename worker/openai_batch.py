@@ -0,0 +1,219 @@
+import json
+import os
+import socket
+import threading
+import time
+import uuid
+import logging
+from storage import store_results
+from redis_topology import atomic_pipeline
+from nutrition import error_result
+from accounting import openai_cost, record_usage
+
+logger = logging.getLogger(__name__)
+
+OPENAI_BATCH_WINDOW = float(os.getenv('OPENAI_BATCH_WINDOW', 60))
+OPENAI_BATCH_MAX_TASKS = int(os.getenv('OPENAI_BATCH_MAX_TASKS', 50))
+OPENAI_BATCH_POLL_INTERVAL = float(os.getenv('OPENAI_BATCH_POLL_INTERVAL', 30))
+OPENAI_BATCH_COMPLETION_WINDOW = '24h'
+# Registro de lotes con una sola etiqueta de hash: todas sus claves van al mismo nodo.
+BATCHES_KEY = 'openai:{batches}'
+BATCH_LOCK_SECONDS = 300
+FINAL_STATUSES = ('completed', 'failed', 'expired', 'cancelled')
+# Nombre con el que el worker agrega el consumo (el mismo que ENGINE_NAME en worker.py).
+ENGINE_NAME = os.getenv('ENGINE_NAME', 'gpt4')
+
+
+def batch_key(batch_id: str) -> str:
+    return f"openai:{{batches}}:{batch_id}"
+
+
+class OpenAIBatcher:
+    # Acumula tareas normales durante la ventana y las envía como un archivo JSONL a la
+    # Batch API. Los mensajes se confirman en RabbitMQ cuando el lote queda creado y
+    # registrado en Redis; cualquier worker GPT-4 recoge después los resultados.
+    def __init__(self, engine, get_redis, window: float = OPENAI_BATCH_WINDOW,
+                 max_tasks: int = OPENAI_BATCH_MAX_TASKS, poll_interval: float = OPENAI_BATCH_POLL_INTERVAL):
+        self._engine = engine
+        self._get_redis = get_redis
+        self.window = window
+        self.max_tasks = max_tasks
+        self.poll_interval = poll_interval
+        self._pending = []
+        self._oldest = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._threads = []
+        self._owner = f"{socket.gethostname()}:{os.getpid()}"
+
+    def start(self):
+        self._threads = [threading.Thread(target=self._flush_loop, name='openai-batch-flush', daemon=True),
+                         threading.Thread(target=self._poll_loop, name='openai-batch-poll', daemon=True)]
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self.flush()
+
+    @property
+    def pending(self) -> int:
+        with self._lock:
+            return len(self._pending)
+
+    def add(self, delivery):
+        with self._lock:
+            if not self._pending:
+                self._oldest = time.monotonic()
+            self._pending.append(delivery)
+            full = len(self._pending) >= self.max_tasks
+        if full:
+            self.flush()
+
+    def _flush_loop(self):
+        while not self._stop.wait(1):
+            with self._lock:
+                due = self._pending and time.monotonic() - self._oldest >= self.window
+            if due:
+                self.flush()
+
+    def flush(self):
+        with self._lock:
+            deliveries, self._pending = self._pending, []
+        if not deliveries:
+            return
+        try:
+            self.submit(deliveries)
+        except Exception as e:
+            logger.error(f"No se pudo enviar el lote de {len(deliveries)} tareas a OpenAI: {e}")
+            for delivery in deliveries:
+                delivery.retry(f"No se pudo enviar el lote a OpenAI: {e}", self._get_redis())
+            return
+        for delivery in deliveries:
+            delivery.ack()
+
+    def submit(self, deliveries) -> str:
+        lines = []
+        tasks = {}
+        for delivery in deliveries:
+            custom_id = uuid.uuid4().hex
+            lines.append(json.dumps({
+                'custom_id': custom_id,
+                'method': 'POST',
+                'url': '/v1/chat/completions',
+                'body': self._engine.request_body(delivery.image_data),
+            }))
+            tasks[custom_id] = json.dumps({
+                'task_id': delivery.task_id,
+                'filename': delivery.filename,
+                'image_hash': delivery.image_hash,
+                'user': delivery.message.get('user'),
+            })
+            delivery.image_data = None
+
+        # Sin Redis el lote no se podría registrar: se comprueba antes de subir nada.
+        redis_conn = self._get_redis()
+        if redis_conn is None:
+            raise ConnectionError("Redis no disponible para registrar el lote")
+        redis_conn.ping()
+
+        client = self._engine.client
+        upload = client.files.create(file=('tareas.jsonl', '\n'.join(lines).encode('utf-8')), purpose='batch')
+        batch = client.batches.create(input_file_id=upload.id, endpoint='/v1/chat/completions',
+                                      completion_window=OPENAI_BATCH_COMPLETION_WINDOW)
+
+        try:
+            pipe = atomic_pipeline(redis_conn)
+            pipe.hset(batch_key(batch.id), mapping=tasks)
+            pipe.sadd(BATCHES_KEY, batch.id)
+            pipe.execute()
+        except Exception:
+            # Un lote sin registrar no lo recogería nadie y las tareas se reintentan: se
+            # cancela para no pagar dos veces las mismas imágenes.
+            try:
+                client.batches.cancel(batch.id)
+                logger.warning(f"Lote {batch.id} cancelado: no se pudo registrar en Redis")
+            except Exception as e:
+                logger.error(f"No se pudo cancelar el lote {batch.id} sin registrar: {e}")
+            raise
+        logger.info(f"Lote {batch.id} enviado a OpenAI con {len(deliveries)} tareas")
+        return batch.id
+
+    def _poll_loop(self):
+        while not self._stop.wait(self.poll_interval):
+            try:
+                self.poll()
+            except Exception as e:
+                logger.error(f"Error consultando lotes de OpenAI: {e}")
+
+    def poll(self):
+        redis_conn = self._get_redis()
+        if redis_conn is None:
+            return
+        for batch_id in redis_conn.smembers(BATCHES_KEY):
+            lock = f"{batch_key(batch_id)}:lock"
+            # Varios workers GPT-4 consultan el mismo registro; sólo uno reparte cada lote.
+            if not redis_conn.set(lock, self._owner, nx=True, ex=BATCH_LOCK_SECONDS):
+                continue
+            try:
+                self._collect(redis_conn, batch_id)
+            finally:
+                redis_conn.delete(lock)
+
+    def _read_file(self, file_id: str):
+        for line in self._engine.client.files.content(file_id).text.splitlines():
+            if line.strip():
+                yield json.loads(line)
+
+    def _usage(self, usage: dict) -> dict:
+        prompt_tokens = usage.get('prompt_tokens', 0)
+        completion_tokens = usage.get('completion_tokens', 0)
+        result = {'engine': ENGINE_NAME, 'priority': False,
+                  'prefill_tokens': prompt_tokens, 'decode_tokens': completion_tokens}
+        cost = openai_cost(self._engine.model, prompt_tokens, completion_tokens, batch=True)
+        if cost is not None:
+            result['cost_usd'] = cost
+        return result
+
+    def _collect(self, redis_conn, batch_id: str):
+        batch = self._engine.client.batches.retrieve(batch_id)
+        if batch.status not in FINAL_STATUSES:
+            return
+
+        results = {}
+        if batch.output_file_id:
+            for entry in self._read_file(batch.output_file_id):
+                response = entry.get('response') or {}
+                if response.get('status_code') == 200:
+                    raw_result = response['body']['choices'][0]['message']['content'].strip()
+                    results[entry['custom_id']] = self._engine.structure(raw_result)
+                    results[entry['custom_id']]['usage'] = self._usage(response['body'].get('usage') or {})
+                else:
+                    results[entry['custom_id']] = error_result(f"HTTP {response.get('status_code')}",
+                                                               'GPT-4 Vision (error)')
+        if batch.error_file_id:
+            for entry in self._read_file(batch.error_file_id):
+                error = (entry.get('error') or {}).get('message') or 'Error en la Batch API'
+                results[entry['custom_id']] = error_result(error, 'GPT-4 Vision (error)')
+
+        tasks = redis_conn.hgetall(batch_key(batch_id))
+        items = []
+        for custom_id, meta in tasks.items():
+            meta = json.loads(meta)
+            result = results.get(custom_id) or error_result(f"Lote de OpenAI {batch.status} sin respuesta",
+                                                            'GPT-4 Vision (error)')
+            result['task_id'] = meta['task_id']
+            result['filename'] = meta['filename']
+            result['status'] = 'error' if 'error' in result else 'completed'
+            if result['status'] == 'error':
+                result['terminal'] = True
+            result['timestamp'] = 'OpenAI Batch API'
+            items.append((meta['task_id'], result, meta['image_hash'], meta['user']))
+        stored = store_results(redis_conn, items)
+        record_usage(redis_conn, [(result.get('usage'), ok) for (_, result, _, _), ok in zip(items, stored)])
+
+        pipe = atomic_pipeline(redis_conn)
+        pipe.delete(batch_key(batch_id))
+        pipe.srem(BATCHES_KEY, batch_id)
+        pipe.execute()
+        logger.info(f"Lote {batch_id} {batch.status}: {len(results)}/{len(tasks)} respuestas guardadas")
@@ -0,0 +1,189 @@
+import json
+import os
+import threading
+import time
+import logging
+from typing import List
+from redis.exceptions import ConnectionError as RedisConnectionError, TimeoutError as RedisTimeoutError, ClusterDownError
+from consumer import shutdown_requested
+from messaging import write_terminal_error
+from storage import store_results, record_stat, HEDGING_STATS_KEY
+from accounting import record_usage
+
+logger = logging.getLogger(__name__)
+
+PERSIST_RETRY_INTERVAL = float(os.getenv('PERSIST_RETRY_INTERVAL', 2))
+# Directorio (volumen) donde se vuelcan los resultados mientras Redis no responde;
+# vacío = los mensajes esperan sin confirmar en memoria, acotados por el prefetch.
+PERSIST_SPILL_DIR = os.getenv('PERSIST_SPILL_DIR', '')
+PERSIST_SPILL_MAX = int(os.getenv('PERSIST_SPILL_MAX', 10000))
+# Sólo estos fallos se tratan como una caída de Redis y se reintentan; cualquier otro
+# (error de un script, WRONGTYPE, un resultado que no se puede serializar) se repetiría
+# igual y bloquearía la etapa de persistencia.
+TRANSIENT_ERRORS = (ConnectionError, TimeoutError, RedisConnectionError, RedisTimeoutError, ClusterDownError)
+
+
+class ResultWriter:
+    # Etapa de persistencia: escribe los resultados de varias tareas en un pipeline y
+    # confirma cada mensaje sólo cuando su resultado está en Redis o en el disco local.
+    # Si Redis cae, la inferencia ya hecha no se repite: se reintenta la escritura.
+    def __init__(self, get_redis, spill_dir: str = PERSIST_SPILL_DIR, spill_max: int = PERSIST_SPILL_MAX,
+                 retry_interval: float = PERSIST_RETRY_INTERVAL):
+        self._get_redis = get_redis
+        self._spill_dir = spill_dir
+        self._spill_max = spill_max
+        self._retry_interval = retry_interval
+        self._spill_lock = threading.Lock()
+        self._outage_since = None
+        if spill_dir:
+            os.makedirs(spill_dir, exist_ok=True)
+            threading.Thread(target=self._replay_loop, name='persist-replay', daemon=True).start()
+
+    def write(self, deliveries):
+        while True:
+            try:
+                self._store(deliveries)
+            except TRANSIENT_ERRORS as e:
+                if self._outage_since is None:
+                    self._outage_since = time.monotonic()
+                    logger.error(f"No se pudieron guardar {len(deliveries)} resultados en Redis, reintentando: {e}")
+                if self._spill(deliveries):
+                    self._ack(deliveries)
+                    return
+                if shutdown_requested.is_set():
+                    logger.warning(f"Apagado con Redis caído: {len(deliveries)} tareas quedan sin confirmar "
+                                   f"y el broker las reentregará")
+                    return
+                shutdown_requested.wait(self._retry_interval)
+                continue
+            except Exception as e:
+                self._isolate(deliveries, e)
+                return
+
+            if self._outage_since is not None:
+                logger.info(f"Redis disponible de nuevo tras {time.monotonic() - self._outage_since:.0f}s")
+                self._outage_since = None
+            self._ack(deliveries)
+            return
+
+    def _store(self, deliveries):
+        redis_conn = self._get_redis()
+        if redis_conn is None:
+            raise ConnectionError("Redis no disponible")
+        items = [(d.task_id, d.result, d.image_hash, d.message.get('user')) for d in deliveries]
+        stored = store_results(redis_conn, items)
+        hedge_wins = sum(1 for d, ok in zip(deliveries, stored) if ok and d.message.get('hedged'))
+        if hedge_wins:
+            record_stat(redis_conn, HEDGING_STATS_KEY, 'hedge_wins', hedge_wins)
+        record_usage(redis_conn, [(d.result.get('usage'), ok) for d, ok in zip(deliveries, stored)])
+        logger.info(f"{sum(stored)} resultados guardados en Redis en un pipeline ({len(deliveries)} tareas)")
+
+    def _isolate(self, deliveries, error: Exception):
+        # Se guarda cada resultado por separado: los que fallan van a la cola de mensajes
+        # muertos con un error terminal y el resto se confirma con normalidad.
+        if len(deliveries) > 1:
+            logger.error(f"Error guardando {len(deliveries)} resultados, se guardan uno a uno: {error}")
+            for delivery in deliveries:
+                self.write([delivery])
+            return
+        delivery = deliveries[0]
+        logger.error(f"No se puede guardar el resultado de la tarea {delivery.task_id}: {error}")
+        delivery.dead_letter(f"Error guardando el resultado: {error}", self._get_redis())
+
+    def _ack(self, deliveries):
+        for delivery in deliveries:
+            delivery.ack()
+            logger.info(f"Tarea {delivery.task_id} procesada exitosamente")
+
+    def _spill_files(self) -> List[str]:
+        return sorted(name for name in os.listdir(self._spill_dir) if name.endswith('.json'))
+
+    def _spill(self, deliveries) -> bool:
+        if not self._spill_dir:
+            return False
+        with self._spill_lock:
+            if len(self._spill_files()) + len(deliveries) > self._spill_max:
+                logger.warning(f"Volcado local lleno ({self._spill_max} resultados), se espera a Redis")
+                return False
+            for delivery in deliveries:
+                entry = {
+                    'task_id': delivery.task_id,
+                    'result': delivery.result,
+                    'image_hash': delivery.image_hash,
+                    'user': delivery.message.get('user'),
+                    'hedged': bool(delivery.message.get('hedged')),
+                }
+                path = os.path.join(self._spill_dir, f"{time.time_ns()}-{delivery.task_id}.json")
+                # Escritura atómica y en disco antes de confirmar el mensaje.
+                with open(path + '.tmp', 'w', encoding='utf-8') as f:
+                    json.dump(entry, f, ensure_ascii=False)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(path + '.tmp', path)
+        logger.info(f"{len(deliveries)} resultados volcados a {self._spill_dir} hasta que vuelva Redis")
+        return True
+
+    def _replay_loop(self):
+        while True:
+            try:
+                self._replay()
+            except Exception as e:
+                logger.warning(f"No se pudo reenviar el volcado local a Redis: {e}")
+            time.sleep(self._retry_interval)
+
+    def _replay(self, batch_size: int = 100):
+        redis_conn = self._get_redis()
+        if redis_conn is None:
+            return
+        with self._spill_lock:
+            names = self._spill_files()[:batch_size]
+            if not names:
+                return
+            entries = []
+            for name in list(names):
+                path = os.path.join(self._spill_dir, name)
+                try:
+                    with open(path, encoding='utf-8') as f:
+                        entries.append(json.load(f))
+                except ValueError as e:
+                    # Se aparta para no bloquear el resto del volcado.
+                    logger.error(f"Volcado ilegible {name}, se renombra a .bad: {e}")
+                    os.replace(path, path + '.bad')
+                    names.remove(name)
+            if not entries:
+                return
+            try:
+                self._store_spilled(redis_conn, entries)
+            except TRANSIENT_ERRORS:
+                raise
+            except Exception as e:
+                logger.error(f"Error guardando {len(entries)} resultados del volcado local, se guardan uno a uno: {e}")
+                for name, entry in zip(names, entries):
+                    self._replay_one(redis_conn, name, entry)
+                return
+            for name in names:
+                os.remove(os.path.join(self._spill_dir, name))
+        logger.info(f"{len(names)} resultados del volcado local guardados en Redis")
+
+    def _replay_one(self, redis_conn, name: str, entry: dict):
+        path = os.path.join(self._spill_dir, name)
+        try:
+            self._store_spilled(redis_conn, [entry])
+        except TRANSIENT_ERRORS:
+            raise
+        except Exception as e:
+            # El mensaje ya se confirmó: el cliente recibe un error terminal en su lugar.
+            logger.error(f"Resultado volcado de {entry['task_id']} no guardable, se renombra a .bad: {e}")
+            os.replace(path, path + '.bad')
+            write_terminal_error(redis_conn, entry['task_id'], entry['result'].get('filename'),
+                                 f"Error guardando el resultado: {e}", 0, entry['image_hash'])
+            return
+        os.remove(path)
+
+    def _store_spilled(self, redis_conn, entries):
+        stored = store_results(redis_conn, [(e['task_id'], e['result'], e['image_hash'], e['user'])
+                                            for e in entries])
+        hedge_wins = sum(1 for e, ok in zip(entries, stored) if ok and e['hedged'])
+        if hedge_wins:
+            record_stat(redis_conn, HEDGING_STATS_KEY, 'hedge_wins', hedge_wins)
+        record_usage(redis_conn, [(e['result'].get('usage'), ok) for e, ok in zip(entries, stored)])
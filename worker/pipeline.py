@@ -0,0 +1,225 @@
+import functools
+import itertools
+import os
+import queue
+import threading
+import time
+import logging
+from messaging import retry_later, dead_letter, reroute
+
+logger = logging.getLogger(__name__)
+
+DECODE_WORKERS = int(os.getenv('PIPELINE_DECODE_WORKERS', 2))
+PIPELINE_PREFETCH = int(os.getenv('PIPELINE_PREFETCH', 4))
+MICRO_BATCH_SIZE = int(os.getenv('MICRO_BATCH_SIZE', 1))
+PERSIST_BATCH_SIZE = int(os.getenv('PERSIST_BATCH_SIZE', 32))
+
+
+class Delivery:
+    def __init__(self, channel, method, properties, body):
+        self.connection = channel.connection
+        self.channel = channel
+        self.method = method
+        self.properties = properties
+        self.body = body
+        self.message = None
+        self.task_id = None
+        self.filename = None
+        self.priority = False
+        self.image = None
+        self.image_data = None
+        self.result = None
+
+    @property
+    def image_hash(self):
+        return self.message.get('image_hash') if isinstance(self.message, dict) else None
+
+    def _on_connection_thread(self, fn, *args):
+        def run():
+            try:
+                fn(*args)
+            except Exception as e:
+                logger.error(f"Error confirmando la tarea {self.task_id} en RabbitMQ: {e}")
+        try:
+            self.connection.add_callback_threadsafe(run)
+        except Exception as e:
+            # La conexión original se cerró; el broker reentregará el mensaje.
+            logger.warning(f"Conexión cerrada, la tarea {self.task_id} será reentregada: {e}")
+
+    def ack(self):
+        self._on_connection_thread(self.channel.basic_ack, self.method.delivery_tag)
+
+    def retry(self, reason: str, redis_conn=None):
+        self._on_connection_thread(
+            functools.partial(retry_later, self.channel, self.method, self.properties, self.body, reason,
+                              redis_conn, self.task_id, self.filename, self.image_hash)
+        )
+
+    def dead_letter(self, reason: str, redis_conn=None):
+        self._on_connection_thread(
+            functools.partial(dead_letter, self.channel, self.method, self.properties, self.body, reason,
+                              redis_conn, self.task_id, self.filename, self.image_hash)
+        )
+
+    def reroute(self, queue: str, reason: str, redis_conn=None):
+        self._on_connection_thread(
+            functools.partial(reroute, self.channel, self.method, self.properties, self.body, queue, reason,
+                              redis_conn, self.task_id, self.filename, self.image_hash)
+        )
+
+
+class TaskPipeline:
+    def __init__(self, decode, infer, persist, decode_workers: int = DECODE_WORKERS, infer_workers: int = 1,
+                 infer_batch=None, max_batch_size: int = MICRO_BATCH_SIZE,
+                 fast_path=None, fast_batch_size: int = 8, on_infer_time=None,
+                 persist_batch_size: int = PERSIST_BATCH_SIZE, get_redis=None):
+        self._decode = decode
+        # Conexión para registrar el error terminal de las tareas que fallan sin control.
+        self._get_redis = get_redis or (lambda: None)
+        self._infer = infer
+        self._fast_path = fast_path
+        self._fast_batch_size = fast_batch_size
+        self._on_infer_time = on_infer_time
+        self._infer_batch = infer_batch
+        self._max_batch_size = max_batch_size if infer_batch is not None else 1
+        self._persist = persist
+        self._persist_batch_size = persist_batch_size
+        self._decode_queue = queue.Queue()
+        self._fast_queue = queue.Queue()
+        self._infer_queue = queue.PriorityQueue()
+        self._persist_queue = queue.Queue()
+        self._sequence = itertools.count()
+        self._inflight = 0
+        self._lock = threading.Lock()
+
+        threads = [threading.Thread(target=self._decode_loop, name=f'decode-{i}', daemon=True)
+                   for i in range(decode_workers)]
+        if fast_path is not None:
+            threads.append(threading.Thread(target=self._fast_loop, name='fast-tier', daemon=True))
+        threads += [threading.Thread(target=self._infer_loop, name=f'infer-{i}', daemon=True)
+                    for i in range(infer_workers)]
+        threads.append(threading.Thread(target=self._persist_loop, name='persist', daemon=True))
+        for thread in threads:
+            thread.start()
+
+    @property
+    def inflight(self) -> int:
+        with self._lock:
+            return self._inflight
+
+    def submit(self, delivery: Delivery):
+        with self._lock:
+            self._inflight += 1
+        self._decode_queue.put(delivery)
+
+    def _finish(self):
+        with self._lock:
+            self._inflight -= 1
+
+    def _run_stage(self, stage, delivery: Delivery) -> bool:
+        try:
+            if stage(delivery):
+                return True
+        except Exception as e:
+            logger.error(f"Error general procesando tarea {delivery.task_id}: {e}")
+            delivery.dead_letter(f"Error general: {e}", self._get_redis())
+        self._finish()
+        return False
+
+    def _enqueue_infer(self, delivery: Delivery):
+        # Las tareas prioritarias adelantan a las normales ya prefetcheadas.
+        rank = 0 if delivery.priority else 1
+        self._infer_queue.put((rank, next(self._sequence), delivery))
+
+    def _decode_loop(self):
+        while True:
+            delivery = self._decode_queue.get()
+            if self._run_stage(self._decode, delivery):
+                if self._fast_path is not None:
+                    self._fast_queue.put(delivery)
+                else:
+                    self._enqueue_infer(delivery)
+
+    def _fast_loop(self):
+        while True:
+            batch = [self._fast_queue.get()]
+            while len(batch) < self._fast_batch_size:
+                try:
+                    batch.append(self._fast_queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                resolved = self._fast_path(batch)
+            except Exception as e:
+                logger.error(f"Error en el clasificador rápido, escalando {len(batch)} tareas: {e}")
+                resolved = [False] * len(batch)
+            for delivery, ok in zip(batch, resolved):
+                if ok:
+                    self._persist_queue.put(delivery)
+                else:
+                    self._enqueue_infer(delivery)
+
+    def _next_batch(self):
+        rank, sequence, delivery = self._infer_queue.get()
+        batch = [delivery]
+        # Agrupa las tareas ya decodificadas de la misma clase de prioridad
+        # (p. ej. imágenes de un mismo lote) en una sola pasada del modelo.
+        while len(batch) < self._max_batch_size:
+            try:
+                item = self._infer_queue.get_nowait()
+            except queue.Empty:
+                break
+            if item[0] != rank:
+                self._infer_queue.put(item)
+                break
+            batch.append(item[2])
+        return batch
+
+    def _infer_loop(self):
+        while True:
+            batch = self._next_batch()
+            started = time.perf_counter()
+            self._infer_stage(batch)
+            if self._on_infer_time is not None:
+                self._on_infer_time(time.perf_counter() - started, len(batch))
+
+    def _infer_stage(self, batch):
+        if len(batch) == 1:
+            if self._run_stage(self._infer, batch[0]):
+                self._persist_queue.put(batch[0])
+            return
+
+        try:
+            succeeded = self._infer_batch(batch)
+        except Exception as e:
+            logger.error(f"Error en inferencia por lotes, procesando {len(batch)} tareas una a una: {e}")
+            succeeded = [self._run_stage(self._infer, delivery) for delivery in batch]
+            for delivery, ok in zip(batch, succeeded):
+                if ok:
+                    self._persist_queue.put(delivery)
+            return
+
+        for delivery, ok in zip(batch, succeeded):
+            if ok:
+                self._persist_queue.put(delivery)
+            else:
+                self._finish()
+
+    def _persist_loop(self):
+        while True:
+            # Los resultados que esperan juntos se escriben en un solo viaje a Redis.
+            batch = [self._persist_queue.get()]
+            while len(batch) < self._persist_batch_size:
+                try:
+                    batch.append(self._persist_queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._persist(batch)
+            except Exception as e:
+                logger.error(f"Error general guardando {len(batch)} tareas: {e}")
+                redis_conn = self._get_redis()
+                for delivery in batch:
+                    delivery.dead_letter(f"Error general: {e}", redis_conn)
+            for _ in batch:
+                self._finish()
@@ -0,0 +1,126 @@
+import collections
+import os
+import sys
+import threading
+import time
+import tracemalloc
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Perfil bajo demanda de un proceso en marcha (worker o backend; este archivo está
+# duplicado en backend/ y worker/). Muestrea las pilas de todos los hilos durante una
+# ventana acotada y las devuelve en formato "folded" (flamegraph.pl, inferno, speedscope).
+# Sin una petición no hay hilo de muestreo ni tracemalloc: desactivado no cuesta nada.
+PROFILE_INTERVAL = float(os.getenv('PROFILE_INTERVAL', 0.005))
+PROFILE_MAX_SECONDS = float(os.getenv('PROFILE_MAX_SECONDS', 120))
+# Directorio donde además se guardan los perfiles (vacío = sólo se devuelven).
+PROFILE_DIR = os.getenv('PROFILE_DIR', '')
+TRACEMALLOC_TOP = 25
+TOP_FRAMES = 15
+
+_lock = threading.Lock()
+
+
+def _frame_label(frame) -> str:
+    # Línea de definición y no la actual: cada función queda en una sola caja del flamegraph.
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def sample_stacks(seconds: float, interval: float = PROFILE_INTERVAL):
+    # Perfil de reloj: también aparecen los hilos que esperan (colas, red, GIL).
+    counts = collections.Counter()
+    own = threading.get_ident()
+    samples = 0
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == own:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(_frame_label(frame))
+                frame = frame.f_back
+            stack.append(names.get(ident, f"hilo-{ident}"))
+            counts[';'.join(reversed(stack))] += 1
+        samples += 1
+        time.sleep(interval)
+    return counts, samples
+
+
+def top_frames(counts: collections.Counter) -> list:
+    leaves = collections.Counter()
+    for stack, count in counts.items():
+        leaves[stack.rsplit(';', 1)[-1]] += count
+    total = sum(leaves.values()) or 1
+    return [{'frame': frame, 'percent': round(100 * count / total, 1)} for frame, count in leaves.most_common(TOP_FRAMES)]
+
+
+def tracemalloc_report(snapshot) -> list:
+    lines = []
+    for stat in snapshot.statistics('lineno')[:TRACEMALLOC_TOP]:
+        frame = stat.traceback[0]
+        lines.append(f"{stat.size / 1024:10.1f} KiB {stat.count:8d} bloques  {frame.filename}:{frame.lineno}")
+    return lines
+
+
+def torch_memory_summary():
+    torch = sys.modules.get('torch')
+    if torch is None or not torch.cuda.is_available():
+        return None
+    return torch.cuda.memory_summary(abbreviated=True)
+
+
+def _save(report: dict, label: str) -> list:
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    base = os.path.join(PROFILE_DIR, f"{label}-{time.strftime('%Y%m%d-%H%M%S')}")
+    files = {'.folded': report['folded']}
+    if 'tracemalloc' in report:
+        files['.tracemalloc.txt'] = '\n'.join(report['tracemalloc'])
+    if report.get('torch'):
+        files['.torch.txt'] = report['torch']
+    for suffix, content in files.items():
+        with open(base + suffix, 'w', encoding='utf-8') as f:
+            f.write(content + '\n')
+    return [base + suffix for suffix in files]
+
+
+def run_profile(seconds: float, memory: bool = False, label: str = 'perfil') -> dict:
+    # memory=True activa tracemalloc sólo durante la ventana: muestra lo que se asignó
+    # en ella y sigue vivo, a cambio de ralentizar el proceso mientras dura.
+    if not _lock.acquire(blocking=False):
+        raise RuntimeError("Ya hay un perfil en curso en este proceso")
+    try:
+        seconds = max(0.1, min(float(seconds), PROFILE_MAX_SECONDS))
+        logger.info(f"Perfilando el proceso {os.getpid()} durante {seconds:.0f}s (memoria: {memory})")
+        started_tracing = memory and not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start()
+        try:
+            counts, samples = sample_stacks(seconds)
+            snapshot = tracemalloc.take_snapshot() if memory else None
+            traced = tracemalloc.get_traced_memory() if memory else None
+        finally:
+            if started_tracing:
+                tracemalloc.stop()
+
+        report = {
+            'pid': os.getpid(),
+            'seconds': seconds,
+            'samples': samples,
+            'top': top_frames(counts),
+            'folded': '\n'.join(f"{stack} {count}" for stack, count in counts.most_common()),
+        }
+        if snapshot is not None:
+            report['tracemalloc'] = tracemalloc_report(snapshot)
+            report['traced_mb'] = {'current': traced[0] / (1024 ** 2), 'peak': traced[1] / (1024 ** 2)}
+        torch_summary = torch_memory_summary()
+        if torch_summary:
+            report['torch'] = torch_summary
+        if PROFILE_DIR:
+            report['files'] = _save(report, label)
+        return report
+    finally:
+        _lock.release()
@@ -0,0 +1,212 @@
+import itertools
+import multiprocessing
+import os
+import queue
+import threading
+import time
+import logging
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from typing import List
+import torch
+
+logger = logging.getLogger(__name__)
+
+REPLICA_READY_TIMEOUT = float(os.getenv('REPLICA_READY_TIMEOUT', 600))
+
+
+def core_groups(replicas: int, cores_per_replica: int) -> List[List[int]]:
+    cores = sorted(os.sched_getaffinity(0))
+    if replicas <= 0:
+        replicas = max(1, len(cores) // cores_per_replica)
+    replicas = min(replicas, max(1, len(cores) // cores_per_replica))
+    return [cores[i * cores_per_replica:(i + 1) * cores_per_replica] or cores for i in range(replicas)]
+
+
+def _replica_main(index: int, target, warm_up, cores: List[int], jobs, results):
+    # Proceso hijo creado con spawn: recibe los tensores en memoria compartida
+    # (share_memory) por referencia, sin copiar los pesos, y sólo usa sus núcleos.
+    logging.basicConfig(level=logging.INFO, format=f'%(levelname)s:replica-{index}:%(name)s:%(message)s')
+    os.sched_setaffinity(0, cores)
+    torch.set_num_threads(len(cores))
+    try:
+        warm_up()
+    except Exception as e:
+        results.put((None, index, 'failed', str(e)))
+        return
+    results.put((None, index, 'ready', None))
+
+    while True:
+        job = jobs.get()
+        if job is None:
+            return
+        job_id, method, payload, deadline = job
+        # El padre ya dejó de esperar este trabajo mientras estaba en la cola: no se ejecuta.
+        if deadline is not None and time.time() >= deadline:
+            results.put((job_id, index, 'expired', None))
+            continue
+        results.put((job_id, index, 'started', None))
+        try:
+            results.put((job_id, index, 'done', getattr(target, method)(payload)))
+        except Exception as e:
+            results.put((job_id, index, 'error', str(e)))
+
+
+class ReplicaPool:
+    def __init__(self, target, warm_up, groups: List[List[int]]):
+        self._target = target
+        self._warm_up = warm_up
+        self._groups = groups
+        # spawn y no fork: el pool se crea con el worker en marcha (también en un cambio
+        # de modelo en caliente) y fork copiaría cerrojos tomados por otros hilos
+        # (logging, redis, torch) al hijo. torch registra en el pickler de
+        # multiprocessing el paso de tensores compartidos por descriptor.
+        self._ctx = multiprocessing.get_context('spawn')
+        self._jobs = self._ctx.Queue()
+        self._results = self._ctx.Queue()
+        self._processes = {}
+        self._futures = {}
+        self._running = {}
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+        self._restart_lock = threading.Lock()
+        self._stopping = False
+        self._collector = None
+
+    @property
+    def size(self) -> int:
+        return len(self._groups)
+
+    @property
+    def alive(self) -> int:
+        return sum(1 for process in self._processes.values() if process.is_alive())
+
+    def start(self):
+        for index in range(self.size):
+            self._spawn(index)
+
+        pending = set(range(self.size))
+        while pending:
+            try:
+                _, index, status, detail = self._results.get(timeout=REPLICA_READY_TIMEOUT)
+            except queue.Empty:
+                self.stop()
+                raise TimeoutError(f"Réplicas sin responder tras {REPLICA_READY_TIMEOUT:.0f}s: {sorted(pending)}")
+            if status == 'failed':
+                self.stop()
+                raise RuntimeError(f"La réplica {index} no pudo arrancar: {detail}")
+            pending.discard(index)
+            logger.info(f"Réplica {index} lista en núcleos {self._groups[index]}")
+
+        self._collector = threading.Thread(target=self._collect, name='replica-results', daemon=True)
+        self._collector.start()
+
+    def _spawn(self, index: int):
+        process = self._ctx.Process(
+            target=_replica_main,
+            args=(index, self._target, self._warm_up, self._groups[index], self._jobs, self._results),
+            name=f'replica-{index}',
+            daemon=True
+        )
+        process.start()
+        self._processes[index] = process
+
+    def submit(self, method: str, payload, deadline=None) -> Future:
+        # deadline: instante (time.time()) a partir del cual una réplica descarta el trabajo sin empezarlo.
+        future = Future()
+        job_id = next(self._ids)
+        future.job_id = job_id
+        with self._lock:
+            self._futures[job_id] = future
+        self._jobs.put((job_id, method, payload, deadline))
+        return future
+
+    def run(self, method: str, payload, timeout: float):
+        future = self.submit(method, payload, time.time() + timeout)
+        job_id = future.job_id
+        try:
+            return future.result(timeout=timeout)
+        except FutureTimeoutError:
+            # Una réplica colgada no vuelve a quedar libre: se descarta el trabajo y se
+            # reinicia la réplica que lo tenía (si aún estaba en la cola, la réplica lo descarta).
+            with self._lock:
+                self._futures.pop(job_id, None)
+                index = self._running.pop(job_id, None)
+            if index is not None:
+                self._restart(index, f"sin respuesta tras {timeout:.0f}s")
+            raise TimeoutError(f"La réplica no respondió en {timeout:.0f}s") from None
+
+    def _collect(self):
+        while not self._stopping:
+            try:
+                job_id, index, status, detail = self._results.get(timeout=1)
+            except queue.Empty:
+                self._check_replicas()
+                continue
+            except (EOFError, OSError):
+                return
+
+            with self._lock:
+                if status == 'started':
+                    # Un trabajo abandonado por tiempo antes de empezar ya no tiene quien lo espere.
+                    if job_id in self._futures:
+                        self._running[job_id] = index
+                    continue
+                if status == 'ready':
+                    logger.info(f"Réplica {index} reiniciada y lista")
+                    continue
+                if status == 'failed':
+                    logger.error(f"La réplica {index} no pudo reiniciarse: {detail}")
+                    continue
+                self._running.pop(job_id, None)
+                future = self._futures.pop(job_id, None)
+            if future is None:
+                continue
+            if status == 'expired':
+                future.set_exception(TimeoutError("El trabajo caducó antes de llegar a una réplica"))
+            elif status == 'done':
+                future.set_result(detail)
+            else:
+                future.set_exception(RuntimeError(detail))
+
+    def _check_replicas(self):
+        for index, process in list(self._processes.items()):
+            if process.is_alive() or self._stopping:
+                continue
+            self._restart(index, f"terminó inesperadamente (código {process.exitcode})", process)
+
+    def _restart(self, index: int, reason: str, process=None):
+        with self._restart_lock:
+            # El colector y un tiempo agotado pueden llegar a la vez: sólo reinicia el primero.
+            if self._stopping or (process is not None and self._processes.get(index) is not process):
+                return
+            process = self._processes[index]
+            logger.error(f"Réplica {index} {reason}, reiniciando...")
+            if process.is_alive():
+                process.terminate()
+                process.join(timeout=10)
+                if process.is_alive():
+                    process.kill()
+                    process.join()
+            with self._lock:
+                lost = [job_id for job_id, replica in self._running.items() if replica == index]
+                futures = [self._futures.pop(job_id) for job_id in lost if job_id in self._futures]
+                for job_id in lost:
+                    del self._running[job_id]
+            for future in futures:
+                future.set_exception(RuntimeError(f"La réplica {index} terminó durante la inferencia"))
+            self._spawn(index)
+
+    def stop(self):
+        self._stopping = True
+        for _ in self._processes:
+            self._jobs.put(None)
+        for process in self._processes.values():
+            process.join(timeout=10)
+            if process.is_alive():
+                process.terminate()
+        with self._lock:
+            futures = list(self._futures.values())
+            self._futures.clear()
+            self._running.clear()
+        for future in futures:
+            future.set_exception(RuntimeError("Pool de réplicas detenido"))
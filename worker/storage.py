@@ -0,0 +1,318 @@
+import os
+import zlib
+import logging
+from typing import List, Optional
+from redis_topology import LUA_TAGGED, tagged, is_cluster
+
+logger = logging.getLogger(__name__)
+
+RESULT_TTL = int(os.getenv('RESULT_TTL', 3600))
+STORE_RAW_ANALYSIS = os.getenv('STORE_RAW_ANALYSIS', 'true').lower() in ('1', 'true', 'yes')
+RESULT_FORMAT_VERSION = '2'
+HEDGING_STATS_KEY = 'stats:hedging'
+SKIPPED_STATS_KEY = 'stats:skipped'
+# Cada resultado completado se anota en este stream; history.py lo vuelca a SQLite.
+# En Cluster es una clave de otro slot: se escribe fuera de los scripts.
+HISTORY_STREAM = 'history:stream'
+HISTORY_STREAM_MAXLEN = int(os.getenv('HISTORY_STREAM_MAXLEN', 100000))
+
+# Campo compacto en el hash -> clave del nutriente en el resultado estructurado.
+NUTRIENT_FIELDS = {
+    'cal': 'calorías',
+    'prot': 'proteínas',
+    'carb': 'carbohidratos',
+    'gras': 'grasas',
+    'fib': 'fibra',
+    'conf': 'confianza',
+}
+LEGACY_NUTRIENT_KEYS = {
+    'cal': 'calories',
+    'prot': 'proteins',
+    'carb': 'carbohydrates',
+    'gras': 'fats',
+}
+META_FIELDS = ('status', 'filename', 'model', 'timestamp', 'error', 'attempts')
+# Consumo de la inferencia (accounting.py) guardado junto al resultado.
+USAGE_FIELDS = {
+    'u_eng': 'engine',
+    'u_pt': 'prefill_tokens',
+    'u_dt': 'decode_tokens',
+    'u_gpu': 'gpu_seconds',
+    'u_cpu': 'cpu_seconds',
+    'u_wall': 'wall_seconds',
+    'u_mem': 'peak_mb',
+    'u_usd': 'cost_usd',
+}
+
+
+def result_key(task_id: str) -> str:
+    return f"analysis:{tagged(task_id)}"
+
+
+def raw_key(task_id: str) -> str:
+    return f"analysis:{tagged(task_id)}:raw"
+
+
+def inflight_key(image_hash: str) -> str:
+    return f"inflight:{tagged(image_hash)}"
+
+
+def cache_key(image_hash: str) -> str:
+    return f"imagecache:{tagged(image_hash)}"
+
+
+def _nutrient_value(result: dict, field: str) -> float:
+    value = result.get(NUTRIENT_FIELDS[field])
+    if value is None and field in LEGACY_NUTRIENT_KEYS:
+        value = result.get(LEGACY_NUTRIENT_KEYS[field])
+    if isinstance(value, dict):
+        value = value.get('value')
+    try:
+        return float(value or 0)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def _format_number(value: float) -> str:
+    return str(int(value)) if value == int(value) else f"{value:g}"
+
+
+def encode_result(result: dict) -> dict:
+    fields = {'v': RESULT_FORMAT_VERSION}
+    for field in META_FIELDS:
+        if result.get(field) is not None:
+            fields[field] = str(result[field])
+    if 'error' in fields:
+        fields['error'] = fields['error'][:200]
+    if result.get('terminal'):
+        fields['terminal'] = '1'
+
+    name = result.get('nombre') or result.get('alimento') or result.get('food_type')
+    if name:
+        fields['comida'] = name
+    if result.get('status') != 'error' or name:
+        for field in NUTRIENT_FIELDS:
+            fields[field] = _format_number(_nutrient_value(result, field))
+    usage = result.get('usage') or {}
+    for field, key in USAGE_FIELDS.items():
+        value = usage.get(key)
+        if isinstance(value, str):
+            fields[field] = value
+        elif value is not None:
+            fields[field] = _format_number(round(value, 6))
+    return fields
+
+
+def compress_raw(raw_analysis: str) -> bytes:
+    return zlib.compress(raw_analysis.encode('utf-8'), 9)
+
+
+# Un resultado completado es definitivo: si otra copia de la tarea (hedging,
+# reentrega) ya lo escribió, la escritura se descarta.
+# KEYS: analysis, history (opcional). ARGV: task_id, ttl, raw, completado, usuario, maxlen, campos...
+STORE_SCRIPT = """
+if redis.call('HGET', KEYS[1], 'status') == 'completed' then
+    return 0
+end
+redis.call('DEL', KEYS[1])
+redis.call('HSET', KEYS[1], unpack(ARGV, 7))
+redis.call('EXPIRE', KEYS[1], ARGV[2])
+if ARGV[3] ~= '' then
+    redis.call('SET', KEYS[1] .. ':raw', ARGV[3], 'EX', ARGV[2])
+end
+if ARGV[4] == '1' and KEYS[2] then
+    redis.call('XADD', KEYS[2], 'MAXLEN', '~', ARGV[6], '*', 'task_id', ARGV[1], 'user', ARGV[5], unpack(ARGV, 7))
+end
+return 1
+"""
+
+# Escribe el resultado del análisis líder y de todas las subidas idénticas que
+# esperaban por él, libera el marcador en curso y cachea el resultado por hash.
+# Las esperas se guardan como "task_id|usuario" para anotar el historial de cada una;
+# todas comparten la etiqueta de hash de la imagen. Devuelve las entradas escritas.
+# KEYS: inflight, waiters, imagecache, history (opcional).
+# ARGV: task_id, ttl, raw, completado, usuario, maxlen, campos...
+FULFILL_SCRIPT = LUA_TAGGED + """
+if redis.call('HGET', 'analysis:' .. tagged(ARGV[1]), 'status') == 'completed' then
+    return {}
+end
+local entries = redis.call('LRANGE', KEYS[2], 0, -1)
+table.insert(entries, 1, ARGV[1] .. '|' .. ARGV[5])
+for _, entry in ipairs(entries) do
+    local id, user = string.match(entry, '^([^|]*)|?(.*)$')
+    local key = 'analysis:' .. tagged(id)
+    redis.call('DEL', key)
+    redis.call('HSET', key, unpack(ARGV, 7))
+    redis.call('EXPIRE', key, ARGV[2])
+    if ARGV[3] ~= '' then
+        redis.call('SET', key .. ':raw', ARGV[3], 'EX', ARGV[2])
+    end
+    if ARGV[4] == '1' and KEYS[4] then
+        redis.call('XADD', KEYS[4], 'MAXLEN', '~', ARGV[6], '*', 'task_id', id, 'user', user, unpack(ARGV, 7))
+    end
+end
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    redis.call('DEL', KEYS[1])
+end
+redis.call('DEL', KEYS[2])
+if ARGV[4] == '1' then
+    redis.call('SET', KEYS[3], ARGV[1], 'EX', ARGV[2])
+end
+return entries
+"""
+
+_store_script = None
+_fulfill_script = None
+
+
+def waiters_key(task_id: str) -> str:
+    return f"waiters:{tagged(task_id)}"
+
+
+def _script_args(result: dict):
+    raw_analysis = result.get('raw_analysis')
+    raw = compress_raw(str(raw_analysis)) if STORE_RAW_ANALYSIS and raw_analysis else b''
+    fields = [item for pair in encode_result(result).items() for item in pair]
+    return raw, fields
+
+
+def _history_keys(redis_conn, history: bool = True) -> list:
+    return [HISTORY_STREAM] if history and not is_cluster(redis_conn) else []
+
+
+def _append_history(redis_conn, written):
+    # Sólo en Cluster: el script no puede tocar el stream, que vive en otro slot.
+    pipe = redis_conn.pipeline(transaction=False)
+    for result, entries in written:
+        if result.get('status') != 'completed':
+            continue
+        fields = encode_result(result)
+        for entry in entries:
+            task_id, _, user = entry.partition('|')
+            pipe.xadd(HISTORY_STREAM, dict({'task_id': task_id, 'user': user}, **fields),
+                      maxlen=HISTORY_STREAM_MAXLEN, approximate=True)
+    if len(pipe):
+        pipe.execute()
+
+
+def _call_store(redis_conn, client, task_id: str, result: dict, ttl: int, image_hash: Optional[str], user: str,
+                history: bool = True):
+    # client es la conexión o un pipeline; en un pipeline la llamada sólo se encola.
+    global _store_script, _fulfill_script
+    if _store_script is None:
+        _store_script = redis_conn.register_script(STORE_SCRIPT)
+        _fulfill_script = redis_conn.register_script(FULFILL_SCRIPT)
+
+    raw, fields = _script_args(result)
+    completed = '1' if result.get('status') == 'completed' else '0'
+    args = [task_id, ttl, raw, completed, user, HISTORY_STREAM_MAXLEN] + fields
+    if image_hash:
+        keys = [inflight_key(image_hash), waiters_key(task_id), cache_key(image_hash)]
+        return _fulfill_script(keys=keys + _history_keys(redis_conn, history), args=args, client=client)
+    return _store_script(keys=[result_key(task_id)] + _history_keys(redis_conn, history), args=args, client=client)
+
+
+def _written_entries(reply, task_id: str, image_hash: Optional[str], user: str) -> list:
+    # Tareas cuyo resultado se escribió, como "task_id|usuario"; vacía si ya estaba completado.
+    if image_hash:
+        return [entry.decode('utf-8') if isinstance(entry, bytes) else entry for entry in reply]
+    return [f"{task_id}|{user}"] if reply else []
+
+
+def _log_written(task_id: str, entries: list):
+    if not entries:
+        logger.info(f"Tarea {task_id} ya tenía un resultado completado, se descarta esta copia")
+    elif len(entries) > 1:
+        logger.info(f"Resultado de {task_id} entregado también a {len(entries) - 1} subidas idénticas")
+
+
+# Decide tras sacar la tarea de la cola si todavía merece inferencia. Una tarea
+# cancelada o vencida sigue en marcha si otras subidas idénticas esperan por
+# ella; si no, libera el marcador en curso para que no se le unan más.
+# KEYS: analysis, cancelled, waiters, inflight. ARGV: task_id, vencida.
+SKIP_SCRIPT = """
+if redis.call('HGET', KEYS[1], 'status') == 'completed' then
+    return 'completed'
+end
+local cancelled = redis.call('EXISTS', KEYS[2]) == 1
+if not cancelled and ARGV[2] ~= '1' then
+    return ''
+end
+if redis.call('LLEN', KEYS[3]) > 0 then
+    return ''
+end
+if redis.call('GET', KEYS[4]) == ARGV[1] then
+    redis.call('DEL', KEYS[4])
+end
+if cancelled then
+    return 'cancelled'
+end
+return 'expired'
+"""
+
+_skip_script = None
+
+
+def cancelled_key(task_id: str) -> str:
+    return f"cancelled:{tagged(task_id)}"
+
+
+def skip_reason(redis_conn, task_id: str, image_hash: Optional[str] = None, expired: bool = False) -> Optional[str]:
+    global _skip_script
+    if _skip_script is None:
+        _skip_script = redis_conn.register_script(SKIP_SCRIPT)
+    reason = _skip_script(
+        keys=[result_key(task_id), cancelled_key(task_id), waiters_key(task_id), inflight_key(image_hash or task_id)],
+        args=[task_id, '1' if expired else '0'],
+        client=redis_conn
+    )
+    if isinstance(reason, bytes):
+        reason = reason.decode('utf-8')
+    return reason or None
+
+
+def record_stat(redis_conn, key: str, field: str, amount: int = 1):
+    try:
+        redis_conn.hincrby(key, field, amount)
+    except Exception as e:
+        logger.warning(f"No se pudieron registrar estadísticas en {key}: {e}")
+
+
+def store_result(redis_conn, task_id: str, result: dict, ttl: int = RESULT_TTL, image_hash: Optional[str] = None,
+                 user: Optional[str] = None) -> bool:
+    reply = _call_store(redis_conn, redis_conn, task_id, result, ttl, image_hash, user or '')
+    entries = _written_entries(reply, task_id, image_hash, user or '')
+    if entries and is_cluster(redis_conn):
+        _append_history(redis_conn, [(result, entries)])
+    _log_written(task_id, entries)
+    return bool(entries)
+
+
+def store_results(redis_conn, items: List[tuple], ttl: int = RESULT_TTL, history: bool = True) -> List[bool]:
+    # Guarda varios resultados (task_id, resultado, image_hash, usuario) en un pipeline
+    # por nodo: una ida y vuelta para todo el grupo. En Cluster, redis-py no admite
+    # scripts en su pipeline, así que se agrupan por nodo y se usa su conexión directa.
+    # history=False no anota los resultados en el historial de comidas (p. ej. backfills).
+    cluster = is_cluster(redis_conn)
+    groups = {}
+    for index, (task_id, _, _, _) in enumerate(items):
+        client = redis_conn.get_node_from_key(result_key(task_id)).redis_connection if cluster else redis_conn
+        groups.setdefault(id(client), (client, []))[1].append(index)
+
+    replies = [None] * len(items)
+    for client, indexes in groups.values():
+        pipe = client.pipeline(transaction=False)
+        for index in indexes:
+            task_id, result, image_hash, user = items[index]
+            _call_store(redis_conn, pipe, task_id, result, ttl, image_hash, user or '', history)
+        for index, reply in zip(indexes, pipe.execute()):
+            replies[index] = reply
+
+    written = []
+    for (task_id, result, image_hash, user), reply in zip(items, replies):
+        entries = _written_entries(reply, task_id, image_hash, user or '')
+        _log_written(task_id, entries)
+        written.append((result, entries))
+    if cluster and history:
+        _append_history(redis_conn, [(result, entries) for result, entries in written if entries])
+    return [bool(entries) for _, entries in written]
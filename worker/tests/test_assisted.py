@@ -0,0 +1,108 @@
+from types import SimpleNamespace
+import pytest
+import torch
+from assisted import AssistedDecoder
+
+EOS = 2
+IMAGE = 99
+PROMPT = [5, IMAGE, IMAGE, 6, 7]
+
+
+class ScriptedLM:
+    # Modelo de juguete voraz: el token siguiente sólo depende de cuántos se han
+    # generado, así que un recorte de caché mal hecho desplaza la salida. Lleva sus
+    # propios tokens alineados con la longitud de la caché que recibe.
+    def __init__(self, script, vocab_size, mistakes=()):
+        self.script = script
+        self.mistakes = set(mistakes)
+        self.config = SimpleNamespace(vocab_size=vocab_size, image_token_index=IMAGE)
+        self.calls = 0
+        self.tokens = []
+        self.prompt_length = 0
+
+    def parameters(self):
+        return iter([torch.zeros(1)])
+
+    def next_token(self, generated: int) -> int:
+        token = self.script[min(generated, len(self.script) - 1)]
+        return (token + 1) % self.config.vocab_size if generated in self.mistakes else token
+
+    def __call__(self, input_ids, past_key_values, use_cache=True, **kwargs):
+        self.calls += 1
+        cached = past_key_values.get_seq_length()
+        if cached == 0:
+            self.tokens = []
+            self.prompt_length = input_ids.shape[1]
+        assert len(self.tokens) >= cached
+        self.tokens = self.tokens[:cached] + input_ids[0].tolist()
+        length = input_ids.shape[1]
+        states = torch.zeros(1, 1, length, 1)
+        past_key_values.update(states, states.clone(), 0)
+        logits = torch.zeros(1, length, self.config.vocab_size)
+        for i in range(length):
+            logits[0, i, self.next_token(cached + i + 1 - self.prompt_length)] = 1
+        return SimpleNamespace(logits=logits, past_key_values=past_key_values)
+
+
+def decoder(target_script, draft_script, draft_vocab=50, mistakes=(), **kwargs):
+    target = ScriptedLM(target_script, vocab_size=200)
+    tokenizer = SimpleNamespace(eos_token_id=EOS)
+    assisted = AssistedDecoder(target, tokenizer, 'borrador', **kwargs)
+    assisted.draft = ScriptedLM(draft_script, vocab_size=draft_vocab, mistakes=mistakes)
+    assisted.enabled = True
+    return assisted
+
+
+def inputs():
+    ids = torch.tensor([PROMPT])
+    return {'input_ids': ids, 'attention_mask': torch.ones_like(ids)}
+
+
+SCRIPT = [10, 11, 12, 13, 14, 15, 16, 17, 18, 19, 20, 21, EOS]
+
+
+def test_perfect_draft_matches_target_and_accepts_everything():
+    assisted = decoder(SCRIPT, SCRIPT, draft_tokens=4)
+    assert assisted.generate(inputs()) == SCRIPT
+    assert assisted.acceptance == 1.0
+    # Verificar en bloque hace menos pasadas del modelo grande que tokens generados.
+    assert assisted.model.calls < len(SCRIPT)
+
+
+def test_rejected_proposals_still_give_target_output():
+    # El borrador se equivoca en varias posiciones: las cachés deben recortarse bien
+    # para que la salida siga siendo exactamente la del modelo grande.
+    assisted = decoder(SCRIPT, SCRIPT, mistakes=(2, 5, 6, 9), draft_tokens=3)
+    assert assisted.generate(inputs()) == SCRIPT
+    assert 0 < assisted.acceptance < 1
+
+
+def test_draft_sees_prompt_without_image_tokens():
+    assisted = decoder(SCRIPT, SCRIPT)
+    assisted.generate(inputs())
+    assert assisted.draft.tokens[:3] == [5, 6, 7]
+
+
+def test_max_new_tokens_is_respected():
+    assisted = decoder(SCRIPT, SCRIPT, draft_tokens=5)
+    assert assisted.generate(inputs(), max_new_tokens=7) == SCRIPT[:7]
+
+
+def test_token_outside_draft_vocabulary_falls_back_to_target():
+    script = [10, 11, 150, 12, 13, 160, 14, EOS]
+    assisted = decoder(script, [10, 11, 30, 12, 13, 31, 14, EOS], draft_vocab=50)
+    assert assisted.generate(inputs()) == script
+
+
+def test_low_acceptance_disables_assisted_decoding():
+    assisted = decoder(SCRIPT, SCRIPT, mistakes=range(100), draft_tokens=4, window=2, min_acceptance=0.5)
+    assert assisted.generate(inputs()) == SCRIPT
+    assert assisted.enabled
+    assert assisted.generate(inputs()) == SCRIPT
+    assert not assisted.enabled and assisted.draft is None
+
+
+def test_rejects_batches():
+    assisted = decoder(SCRIPT, SCRIPT)
+    with pytest.raises(ValueError):
+        assisted.generate({'input_ids': torch.ones(2, 3, dtype=torch.long)})
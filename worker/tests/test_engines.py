@@ -0,0 +1,40 @@
+from engines import ENGINE_TYPES, Engine, EngineManager, start_engine
+
+
+class FakeEngine(Engine):
+    kind = 'fake'
+
+    def __init__(self, options=None):
+        super().__init__(options)
+        self.label = f"Fake {self.options.get('model', 'base')}"
+        self.concurrency = int(self.options.get('concurrency', 1))
+        self.unloaded = False
+
+    def load(self):
+        pass
+
+    def unload(self):
+        super().unload()
+        self.unloaded = True
+
+
+def swap(manager, options):
+    manager.swap('fake', options)
+    manager._swap_thread.join(5)
+
+
+def test_swap_with_same_shape(monkeypatch):
+    monkeypatch.setitem(ENGINE_TYPES, 'fake', (__name__, 'FakeEngine'))
+    old = start_engine('fake')
+    manager = EngineManager(old)
+    swap(manager, {'model': 'nuevo'})
+    assert manager.current.label == 'Fake nuevo' and manager.current.ready
+    assert old.unloaded
+
+
+def test_swap_refused_when_concurrency_differs(monkeypatch):
+    monkeypatch.setitem(ENGINE_TYPES, 'fake', (__name__, 'FakeEngine'))
+    old = start_engine('fake')
+    manager = EngineManager(old)
+    swap(manager, {'concurrency': 4})
+    assert manager.current is old and not old.unloaded
@@ -0,0 +1,63 @@
+import types
+import fakeredis
+import pytest
+from redis.exceptions import ConnectionError as RedisConnectionError
+import openai_batch
+from openai_batch import OpenAIBatcher, BATCHES_KEY, batch_key
+
+
+class FakeClient:
+    def __init__(self):
+        self.uploads = 0
+        self.cancelled = []
+        self.files = types.SimpleNamespace(create=self._upload)
+        self.batches = types.SimpleNamespace(create=self._create, cancel=self.cancelled.append)
+
+    def _upload(self, file, purpose):
+        self.uploads += 1
+        return types.SimpleNamespace(id='file-1')
+
+    def _create(self, input_file_id, endpoint, completion_window):
+        return types.SimpleNamespace(id='batch-1')
+
+
+class FakeEngine:
+    def __init__(self):
+        self.client = FakeClient()
+
+    def request_body(self, image_data):
+        return {'model': 'gpt-4o'}
+
+
+class FakeDelivery:
+    task_id = 't1'
+    filename = 'a.jpg'
+    image_hash = None
+    image_data = b'imagen'
+    message = {'user': 'ana'}
+
+
+def test_submit_registers_batch():
+    redis_conn = fakeredis.FakeRedis(decode_responses=True)
+    batcher = OpenAIBatcher(FakeEngine(), lambda: redis_conn)
+    assert batcher.submit([FakeDelivery()]) == 'batch-1'
+    assert redis_conn.smembers(BATCHES_KEY) == {'batch-1'}
+    assert len(redis_conn.hgetall(batch_key('batch-1'))) == 1
+
+
+def test_submit_without_redis_uploads_nothing():
+    engine = FakeEngine()
+    with pytest.raises(ConnectionError):
+        OpenAIBatcher(engine, lambda: None).submit([FakeDelivery()])
+    assert engine.client.uploads == 0
+
+
+def test_submit_cancels_batch_it_cannot_register(monkeypatch):
+    def broken_pipeline(redis_conn):
+        raise RedisConnectionError('sin conexión')
+    monkeypatch.setattr(openai_batch, 'atomic_pipeline', broken_pipeline)
+    engine = FakeEngine()
+    batcher = OpenAIBatcher(engine, lambda: fakeredis.FakeRedis(decode_responses=True))
+    with pytest.raises(RedisConnectionError):
+        batcher.submit([FakeDelivery()])
+    assert engine.client.cancelled == ['batch-1']
@@ -0,0 +1,81 @@
+import json
+import os
+import fakeredis
+import pytest
+from redis.exceptions import ConnectionError as RedisConnectionError, ResponseError
+import persistence
+import storage
+from persistence import ResultWriter
+from storage import result_key
+
+
+class FakeDelivery:
+    def __init__(self, task_id):
+        self.task_id = task_id
+        self.image_hash = None
+        self.message = {'user': 'ana'}
+        self.result = {'status': 'completed', 'nombre': 'paella', 'calorías': {'value': 500}}
+        self.acked = False
+        self.dead = None
+
+    def ack(self):
+        self.acked = True
+
+    def dead_letter(self, reason, redis_conn=None):
+        self.dead = (reason, redis_conn)
+
+
+@pytest.fixture
+def redis_conn(monkeypatch):
+    monkeypatch.setattr(storage, '_store_script', None)
+    monkeypatch.setattr(storage, '_fulfill_script', None)
+    return fakeredis.FakeRedis(decode_responses=True)
+
+
+def failing_store(bad_ids, error):
+    real = persistence.store_results
+
+    def store(redis_conn, items, *args, **kwargs):
+        if any(task_id in bad_ids for task_id, _, _, _ in items):
+            raise error
+        return real(redis_conn, items, *args, **kwargs)
+    return store
+
+
+def test_write_stores_and_acks(redis_conn):
+    deliveries = [FakeDelivery('abcdef12-1'), FakeDelivery('abcdef12-2')]
+    ResultWriter(lambda: redis_conn).write(deliveries)
+    assert all(d.acked for d in deliveries)
+    assert redis_conn.hget(result_key('abcdef12-2'), 'comida') == 'paella'
+
+
+def test_deterministic_error_dead_letters_only_the_failing_result(redis_conn, monkeypatch):
+    monkeypatch.setattr(persistence, 'store_results', failing_store({'abcdef12-bad'}, ResponseError('WRONGTYPE')))
+    good, bad = FakeDelivery('abcdef12-ok'), FakeDelivery('abcdef12-bad')
+    ResultWriter(lambda: redis_conn).write([good, bad])
+    assert good.acked and good.dead is None
+    assert not bad.acked and 'WRONGTYPE' in bad.dead[0] and bad.dead[1] is redis_conn
+
+
+def test_connection_error_spills_instead_of_dead_lettering(redis_conn, monkeypatch, tmp_path):
+    monkeypatch.setattr(persistence, 'store_results', failing_store({'abcdef12-1'}, RedisConnectionError('caído')))
+    delivery = FakeDelivery('abcdef12-1')
+    writer = ResultWriter(lambda: redis_conn, spill_dir='', retry_interval=0)
+    writer._spill_dir = str(tmp_path)
+    writer.write([delivery])
+    assert delivery.acked and delivery.dead is None
+    assert len(os.listdir(tmp_path)) == 1
+
+
+def test_replay_sets_aside_unstorable_spill(redis_conn, monkeypatch, tmp_path):
+    writer = ResultWriter(lambda: redis_conn, spill_dir='', retry_interval=0)
+    writer._spill_dir = str(tmp_path)
+    for task_id in ('abcdef12-ok', 'abcdef12-bad'):
+        entry = {'task_id': task_id, 'result': FakeDelivery(task_id).result, 'image_hash': None,
+                 'user': 'ana', 'hedged': False}
+        (tmp_path / f"1-{task_id}.json").write_text(json.dumps(entry))
+    monkeypatch.setattr(persistence, 'store_results', failing_store({'abcdef12-bad'}, ResponseError('script')))
+    writer._replay()
+    assert sorted(os.listdir(tmp_path)) == ['1-abcdef12-bad.json.bad']
+    assert redis_conn.hget(result_key('abcdef12-ok'), 'status') == 'completed'
+    assert redis_conn.hget(result_key('abcdef12-bad'), 'terminal') == '1'
@@ -0,0 +1,36 @@
+import threading
+from pipeline import TaskPipeline
+
+
+class FakeDelivery:
+    def __init__(self, task_id):
+        self.task_id = task_id
+        self.priority = False
+        self.dead = threading.Event()
+        self.dead_reason = None
+
+    def dead_letter(self, reason, redis_conn=None):
+        self.dead_reason = (reason, redis_conn)
+        self.dead.set()
+
+
+def fail(delivery):
+    raise RuntimeError('fallo inesperado')
+
+
+def test_stage_failure_dead_letters_with_redis():
+    redis_conn = object()
+    pipeline = TaskPipeline(fail, None, None, decode_workers=1, get_redis=lambda: redis_conn)
+    delivery = FakeDelivery('t1')
+    pipeline.submit(delivery)
+    assert delivery.dead.wait(2)
+    assert delivery.dead_reason == ('Error general: fallo inesperado', redis_conn)
+
+
+def test_persist_failure_dead_letters_with_redis():
+    redis_conn = object()
+    pipeline = TaskPipeline(lambda d: True, lambda d: True, fail, decode_workers=1, get_redis=lambda: redis_conn)
+    delivery = FakeDelivery('t1')
+    pipeline.submit(delivery)
+    assert delivery.dead.wait(2)
+    assert delivery.dead_reason == ('Error general: fallo inesperado', redis_conn)
@@ -0,0 +1,116 @@
+import os
+import time
+import pytest
+import torch
+from replica_pool import ReplicaPool, core_groups
+
+
+class Target:
+    # Se envía a cada réplica; sus tensores compartidos no se copian.
+    def __init__(self, fail_warm_up: bool = False):
+        self.weights = torch.zeros(4).share_memory_()
+        self.fail_warm_up = fail_warm_up
+
+    def warm_up(self):
+        if self.fail_warm_up:
+            raise ValueError("sin pesos")
+
+    def echo(self, payload):
+        return payload
+
+    def pid(self, _):
+        return os.getpid()
+
+    def fill(self, value):
+        self.weights.fill_(value)
+        return float(self.weights.sum())
+
+    def fail(self, message):
+        raise ValueError(message)
+
+    def crash(self, _):
+        # A mitad de la inferencia: el aviso de inicio ya llegó al padre.
+        time.sleep(0.5)
+        os._exit(3)
+
+    def hang(self, _):
+        time.sleep(3600)
+
+    def slow(self, seconds):
+        time.sleep(seconds)
+
+    def touch(self, path):
+        open(path, 'w').close()
+
+
+@pytest.fixture(scope='module')
+def target():
+    return Target()
+
+
+@pytest.fixture(scope='module')
+def pool(target):
+    pool = ReplicaPool(target, target.warm_up, core_groups(1, 1))
+    pool.start()
+    yield pool
+    pool.stop()
+
+
+def wait_alive(pool, timeout: float = 60):
+    deadline = time.monotonic() + timeout
+    while pool.alive < pool.size and time.monotonic() < deadline:
+        time.sleep(0.1)
+    return pool.alive == pool.size
+
+
+def test_core_groups_caps_replicas_to_cores():
+    cores = len(os.sched_getaffinity(0))
+    groups = core_groups(cores + 5, 1)
+    assert len(groups) == cores
+    assert all(len(group) == 1 for group in groups)
+
+
+def test_run_returns_result(pool):
+    assert pool.run('echo', {'a': 1}, timeout=30) == {'a': 1}
+
+
+def test_weights_are_shared_with_replicas(pool, target):
+    assert pool.run('fill', 2.0, timeout=30) == 8.0
+    assert float(target.weights.sum()) == 8.0
+
+
+def test_target_error_becomes_runtime_error(pool):
+    with pytest.raises(RuntimeError, match="fallo controlado"):
+        pool.run('fail', "fallo controlado", timeout=30)
+
+
+def test_crashed_replica_fails_job_and_restarts(pool):
+    with pytest.raises(RuntimeError, match="terminó durante la inferencia"):
+        pool.run('crash', None, timeout=60)
+    assert wait_alive(pool)
+    assert pool.run('echo', 'de nuevo', timeout=120) == 'de nuevo'
+
+
+def test_timeout_restarts_hung_replica(pool):
+    before = pool.run('pid', None, timeout=30)
+    with pytest.raises(TimeoutError):
+        pool.run('hang', None, timeout=2)
+    assert not pool._futures and not pool._running
+    assert pool.run('pid', None, timeout=120) != before
+
+
+def test_timed_out_queued_job_is_skipped(pool, tmp_path):
+    marker = tmp_path / 'ejecutado'
+    busy = pool.submit('slow', 3)
+    with pytest.raises(TimeoutError):
+        pool.run('touch', str(marker), timeout=1)
+    busy.result(timeout=30)
+    assert pool.run('echo', 'siguiente', timeout=30) == 'siguiente'
+    assert not marker.exists()
+
+
+def test_failed_warm_up_aborts_start():
+    target = Target(fail_warm_up=True)
+    pool = ReplicaPool(target, target.warm_up, core_groups(1, 1))
+    with pytest.raises(RuntimeError, match="no pudo arrancar"):
+        pool.start()
@@ -0,0 +1,123 @@
+import importlib.util
+import os
+import fakeredis
+import pytest
+import storage
+from storage import (encode_result, store_result, store_results, result_key, cache_key, inflight_key,
+                     waiters_key, HISTORY_STREAM)
+
+BACKEND_RESULTS = os.path.join(os.path.dirname(__file__), '..', '..', 'backend', 'results.py')
+
+
+@pytest.fixture
+def server():
+    return fakeredis.FakeServer()
+
+
+@pytest.fixture
+def redis_conn(server, monkeypatch):
+    # Los scripts se registran una vez por proceso; cada prueba usa un servidor nuevo.
+    monkeypatch.setattr(storage, '_store_script', None)
+    monkeypatch.setattr(storage, '_fulfill_script', None)
+    return fakeredis.FakeRedis(server=server, decode_responses=True)
+
+
+@pytest.fixture(scope='module')
+def backend_results():
+    spec = importlib.util.spec_from_file_location('backend_results', BACKEND_RESULTS)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def completed(name: str, calories: float = 450) -> dict:
+    return {
+        'status': 'completed',
+        'filename': 'plato.jpg',
+        'model': 'llava',
+        'nombre': name,
+        'calorías': {'value': calories, 'unit': 'kcal'},
+        'proteínas': {'value': 20.5, 'unit': 'g'},
+        'carbohidratos': {'value': 60, 'unit': 'g'},
+        'grasas': {'value': 12, 'unit': 'g'},
+        'fibra': {'value': 4, 'unit': 'g'},
+        'raw_analysis': 'Paella con marisco',
+        'usage': {'engine': 'llava', 'prefill_tokens': 900, 'gpu_seconds': 1.25},
+    }
+
+
+def test_encode_result_is_compact():
+    fields = encode_result(completed('paella'))
+    assert fields['comida'] == 'paella'
+    assert fields['cal'] == '450'
+    assert fields['prot'] == '20.5'
+    assert fields['u_pt'] == '900'
+    assert 'raw_analysis' not in fields
+
+
+def test_encode_accepts_legacy_keys():
+    fields = encode_result({'status': 'completed', 'nombre': 'sopa', 'calories': 120, 'proteins': '3'})
+    assert fields['cal'] == '120' and fields['prot'] == '3'
+
+
+def test_round_trip_through_backend_reader(server, redis_conn, backend_results):
+    # El backend lee los resultados con una conexión binaria (raw comprimido).
+    binary = fakeredis.FakeRedis(server=server)
+    store_result(redis_conn, 'abcdef12-0001', completed('paella'))
+    result = backend_results.load_result(binary, 'abcdef12-0001')
+    assert result['nombre'] == 'paella'
+    assert result['calorías'] == {'value': 450, 'unit': 'kcal', 'description': backend_results.NUTRIENTS['cal'][2]}
+    assert result['proteínas']['value'] == 20.5
+    assert result['raw_analysis'] == 'Paella con marisco'
+    assert result['status'] == 'completed'
+
+
+def test_store_first_completed_writer_wins(redis_conn):
+    assert store_result(redis_conn, 'abcdef12-0002', completed('paella'))
+    assert not store_result(redis_conn, 'abcdef12-0002', completed('arroz'))
+    assert redis_conn.hget(result_key('abcdef12-0002'), 'comida') == 'paella'
+    assert redis_conn.xlen(HISTORY_STREAM) == 1
+
+
+def test_store_error_can_be_replaced(redis_conn):
+    error = {'status': 'error', 'error': 'tiempo agotado', 'filename': 'plato.jpg'}
+    assert store_result(redis_conn, 'abcdef12-0003', error)
+    assert store_result(redis_conn, 'abcdef12-0003', completed('paella'))
+    assert redis_conn.hget(result_key('abcdef12-0003'), 'status') == 'completed'
+    # Sólo el resultado completado entra en el historial.
+    assert redis_conn.xlen(HISTORY_STREAM) == 1
+
+
+def test_fulfill_serves_waiters_and_caches_completed(redis_conn):
+    image_hash = 'abcdef12' + '0' * 56
+    leader = 'abcdef12-lead'
+    redis_conn.set(inflight_key(image_hash), leader)
+    redis_conn.rpush(waiters_key(leader), 'abcdef12-wait|ana')
+    assert store_result(redis_conn, leader, completed('paella'), image_hash=image_hash, user='luis')
+    assert redis_conn.hget(result_key('abcdef12-wait'), 'comida') == 'paella'
+    assert redis_conn.get(cache_key(image_hash)) == leader
+    assert not redis_conn.exists(inflight_key(image_hash))
+    users = sorted(entry['user'] for _, entry in redis_conn.xrange(HISTORY_STREAM))
+    assert users == ['ana', 'luis']
+    # Una copia posterior (hedging) no sobrescribe a nadie.
+    assert not store_result(redis_conn, leader, completed('arroz'), image_hash=image_hash)
+
+
+def test_fulfill_error_is_not_cached_or_recorded(redis_conn):
+    image_hash = 'abcdef12' + '1' * 56
+    leader = 'abcdef12-fail'
+    redis_conn.set(inflight_key(image_hash), leader)
+    error = {'status': 'error', 'error': 'motor caído', 'nombre': 'Error al analizar'}
+    assert store_result(redis_conn, leader, error, image_hash=image_hash)
+    assert not redis_conn.exists(cache_key(image_hash))
+    assert not redis_conn.exists(HISTORY_STREAM)
+    assert store_result(redis_conn, leader, completed('paella'), image_hash=image_hash)
+    assert redis_conn.get(cache_key(image_hash)) == leader
+
+
+def test_store_results_pipeline_and_history_flag(redis_conn):
+    items = [('abcdef12-b1', completed('paella'), None, 'ana'),
+             ('abcdef12-b2', completed('sopa'), None, 'ana')]
+    assert store_results(redis_conn, items, history=False) == [True, True]
+    assert not redis_conn.exists(HISTORY_STREAM)
+    assert store_results(redis_conn, items) == [False, False]
@@ -2,169 +2,69 @@ import json
 import os
 import pika
 import logging
-import redis
-import torch
 import base64
 import io
-import re
-from typing import Optional
-from worker.NutritionInfo import NutritionInfo
-from transformers import LlavaNextProcessor, LlavaNextForConditionalGeneration, LlavaProcessor, LlavaForConditionalGeneration, BitsAndBytesConfig
+import time
+import threading
+from messaging import declare_topology, is_expired
+from consumer import run_supervised, consume_until_shutdown
+from pipeline import TaskPipeline, Delivery, PIPELINE_PREFETCH
+from persistence import ResultWriter
+from storage import skip_reason, record_stat, SKIPPED_STATS_KEY
+from fast_classifier import FastTier, FAST_TIER_BATCH_SIZE
+from health import EngineHealth, engine_queue
+from engines import EngineManager, start_engine
+from redis_topology import create_redis
+from profiling import run_profile
 from PIL import Image
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-REDIS_HOST = os.getenv('REDIS_HOST', 'redis')
-REDIS_PORT = int(os.getenv('REDIS_PORT', 6379))
-
-analyzer = None
-processor = None
 redis_client = None
+pipeline = None
+result_writer = None
+fast_tier = None
+engine_health = None
+engines = None
 
 rabbitmq_host = os.getenv('RABBITMQ_HOST', 'rabbitmq')
 rabbitmq_user = os.getenv('RABBITMQ_USER', 'admin')
 rabbitmq_pass = os.getenv('RABBITMQ_PASS', 'password')
 queue_name = os.getenv('RABBITMQ_QUEUE', 'food_analysis_queue')
 priority_queue_name = os.getenv('RABBITMQ_PRIORITY_QUEUE', 'food_analysis_priority_queue')
+rabbitmq_heartbeat = int(os.getenv('RABBITMQ_HEARTBEAT', 60))
+# ENGINE_NAME fija las colas y métricas del worker; ENGINE_KIND, la implementación que se carga.
+ENGINE_NAME = os.getenv('ENGINE_NAME', 'llava')
+ENGINE_KIND = os.getenv('ENGINE_KIND', ENGINE_NAME)
+FAILOVER_ENGINE = os.getenv('FAILOVER_ENGINE')
+CONTROL_EXCHANGE = os.getenv('WORKER_CONTROL_EXCHANGE', 'worker_control')
+PROFILE_RESULT_TTL = 3600
 
 def get_rabbitmq_connection():
-    import time
-    max_retries = 30
-    retry_interval = 2
-    
-    for attempt in range(max_retries):
-        try:
-            credentials = pika.PlainCredentials(rabbitmq_user, rabbitmq_pass)
-            parameters = pika.ConnectionParameters(
-                host=rabbitmq_host,
-                port=5672,
-                virtual_host='/',
-                credentials=credentials,
-                heartbeat=600,
-                blocked_connection_timeout=300,
-                connection_attempts=3,
-                retry_delay=2
-            )
-            connection = pika.BlockingConnection(parameters)
-            logger.info(f"Conectado a RabbitMQ exitosamente (intento {attempt + 1})")
-            return connection
-        except Exception as e:
-            logger.warning(f"Intento {attempt + 1}/{max_retries} de conexión a RabbitMQ falló: {e}")
-            if attempt < max_retries - 1:
-                time.sleep(retry_interval)
-            else:
-                logger.error("No se pudo conectar a RabbitMQ después de todos los intentos")
-                raise
-
-def setup_analyzer():
-    global analyzer, processor
-    if analyzer is None or processor is None:
-        try:
-            if torch.cuda.is_available():
-                torch.cuda.empty_cache()
-                gpu_name = torch.cuda.get_device_name(0)
-                logger.info(f"GPU disponible: {gpu_name}")
-                
-                gpu_memory_gb = torch.cuda.get_device_properties(0).total_memory / (1024**3)
-                logger.info(f"Memoria GPU total: {gpu_memory_gb:.1f} GB")
-                
-                if gpu_memory_gb >= 16:
-                    model_name = "llava-hf/llava-v1.6-vicuna-13b-hf"
-                    logger.info("Usando LLaVA-Next 13B (requiere 16GB+ GPU)")
-                elif gpu_memory_gb >= 8:
-                    model_name = "llava-hf/llava-v1.6-mistral-7b-hf"  
-                    logger.info("Usando LLaVA-Next 7B (requiere 8GB+ GPU)")
-                else:
-                    model_name = "llava-hf/llava-1.5-7b-hf"
-                    logger.info("Usando LLaVA 1.5 7B (GPU limitada)")
-                
-                logger.info(f"Cargando processor para {model_name}...")
-                if "llava-v1.6" in model_name or "llava-next" in model_name:
-                    processor = LlavaNextProcessor.from_pretrained(model_name, use_fast=True)
-                    model_class = LlavaNextForConditionalGeneration
-                else:
-                    processor = LlavaProcessor.from_pretrained(model_name, use_fast=True)  
-                    model_class = LlavaForConditionalGeneration
-                
-                logger.info(f"Cargando modelo {model_name}...")
-                
-                quantization_config = None
-                if gpu_memory_gb < 12:
-                    quantization_config = BitsAndBytesConfig(
-                        load_in_8bit=True,
-                        llm_int8_threshold=6.0,
-                        llm_int8_has_fp16_weight=False,
-                    )
-                    logger.info("Usando cuantización 8-bit para GPU limitada")
-                
-                analyzer = model_class.from_pretrained(
-                    model_name,
-                    dtype=torch.float16,
-                    device_map="auto",
-                    low_cpu_mem_usage=True,
-                    quantization_config=quantization_config,
-                )
-                
-                model_device = next(analyzer.parameters()).device
-                logger.info(f"Modelo LLaVA-Next cargado en dispositivo: {model_device}")
-                
-            else:
-                logger.info("GPU no disponible, cargando modelo en CPU...")
-                model_name = "llava-hf/llava-1.5-7b-hf"
-                
-                processor = LlavaProcessor.from_pretrained(model_name, use_fast=True)
-                analyzer = LlavaForConditionalGeneration.from_pretrained(
-                    model_name,
-                    dtype=torch.float32,
-                    device_map="cpu",
-                    low_cpu_mem_usage=True,
-                )
-                
-                logger.info(f"Modelo LLaVA cargado en CPU")
-            
-            device = "GPU" if torch.cuda.is_available() else "CPU" 
-            logger.info(f"LLaVA-Next analizador listo en {device}")
-            
-        except Exception as e:
-            logger.error(f"Error cargando LLaVA-Next: {e}")
-            try:
-                logger.info("Intentando cargar modelo LLaVA básico como fallback...")
-                model_name = "llava-hf/llava-1.5-7b-hf"
-                
-                processor = LlavaProcessor.from_pretrained(model_name, use_fast=True)
-                analyzer = LlavaForConditionalGeneration.from_pretrained(
-                    model_name,
-                    dtype=torch.float32,
-                    device_map="cpu",
-                )
-                
-                logger.info("Modelo LLaVA básico cargado exitosamente como fallback")
-                
-            except Exception as e2:
-                logger.error(f"Error en fallback: {e2}")
-                analyzer = None
-                processor = None
-                
-    return analyzer, processor
+    credentials = pika.PlainCredentials(rabbitmq_user, rabbitmq_pass)
+    parameters = pika.ConnectionParameters(
+        host=rabbitmq_host,
+        port=5672,
+        virtual_host='/',
+        credentials=credentials,
+        heartbeat=rabbitmq_heartbeat,
+        blocked_connection_timeout=300,
+        connection_attempts=1
+    )
+    connection = pika.BlockingConnection(parameters)
+    logger.info("Conectado a RabbitMQ exitosamente")
+    return connection
 
 def get_redis_client():
     global redis_client
     if redis_client is None:
-        import time
         max_retries = 10
         retry_interval = 2
         
         for attempt in range(max_retries):
             try:
-                redis_client = redis.Redis(
-                    host=REDIS_HOST,
-                    port=REDIS_PORT,
-                    db=0,
-                    decode_responses=True,
-                    socket_connect_timeout=5,
-                    socket_timeout=5
-                )
+                redis_client = create_redis(decode_responses=True)
                 redis_client.ping()
                 logger.info(f"Conectado a Redis exitosamente (intento {attempt + 1})")
                 break
@@ -177,362 +77,275 @@ def get_redis_client():
                     redis_client = None
     return redis_client
 
-def callback(ch, method, properties, body):
-    global analyzer, processor
+def failover_engine(engine):
+    failover = engine.failover_engine if FAILOVER_ENGINE is None else FAILOVER_ENGINE
+    return failover if failover != ENGINE_NAME else ''
+
+def decode_task(delivery):
     try:
-        message = json.loads(body.decode('utf-8'))
-        task_id = message['task_id']
-        image_data = message['image_data']
-        filename = message.get('filename', 'unknown')
-            
-        logger.info(f"Procesando tarea: {task_id}")
+        delivery.message = json.loads(delivery.body.decode('utf-8'))
+        delivery.task_id = delivery.message['task_id']
+        image_data = delivery.message['image_data']
+        delivery.filename = delivery.message.get('filename', 'unknown')
+        delivery.priority = bool(delivery.message.get('priority', False))
+    except Exception as e:
+        logger.error(f"Mensaje malformado: {e}")
+        delivery.dead_letter(f"Mensaje malformado: {e}", get_redis_client())
+        return False
         
-        try:
-            if ',' in image_data:
-                image_data = image_data.split(',')[1]
-            
-            image_bytes = base64.b64decode(image_data)
-            
-            image = Image.open(io.BytesIO(image_bytes))
-            logger.info(f"Imagen decodificada exitosamente: {image.size}")
-            
-        except Exception as e:
-            logger.error(f"Error decodificando imagen: {e}")
-            ch.basic_nack(delivery_tag=method.delivery_tag, requeue=False)
-            return
+    redis_conn = get_redis_client()
+    try:
+        # Completada por otra copia (hedging, reentrega), cancelada o vencida:
+        # se descarta antes de decodificar la imagen y de ocupar el modelo.
+        reason = skip_reason(redis_conn, delivery.task_id, delivery.image_hash,
+                             is_expired(delivery.properties)) if redis_conn else None
+        if reason:
+            logger.info(f"Tarea {delivery.task_id} omitida ({reason}), no se ejecuta la inferencia")
+            record_stat(redis_conn, SKIPPED_STATS_KEY, reason)
+            delivery.ack()
+            return False
+    except Exception as e:
+        logger.warning(f"No se pudo comprobar el estado de la tarea {delivery.task_id}: {e}")
+    
+    logger.info(f"Procesando tarea: {delivery.task_id}")
+    
+    try:
+        if ',' in image_data:
+            image_data = image_data.split(',')[1]
         
-        if analyzer is None or processor is None:
-            analyzer, processor = setup_analyzer()
-            if analyzer is None or processor is None:
-                logger.error("No se pudo cargar el analizador LLaVA-Next")
-                ch.basic_nack(delivery_tag=method.delivery_tag, requeue=True)
-                return
+        image_bytes = base64.b64decode(image_data)
+        
+        image = Image.open(io.BytesIO(image_bytes))
+        delivery.image_data = image_data
+        # Los motores remotos sólo envían el base64; la imagen se decodifica si el
+        # motor o el clasificador rápido la necesitan.
+        if engines.current.needs_image or (fast_tier is not None and fast_tier.enabled):
+            if image.mode != 'RGB':
+                image = image.convert('RGB')
+            else:
+                image.load()
+            delivery.image = image
+        logger.info(f"Imagen decodificada exitosamente: {image.size}")
+        
+    except Exception as e:
+        logger.error(f"Error decodificando imagen: {e}")
+        delivery.dead_letter(f"Imagen no decodificable: {e}", get_redis_client())
+        return False
+    
+    return True
+
+def infer_task(delivery):
+    task_id = delivery.task_id
+    filename = delivery.filename
+    
+    with engines.use() as engine:
+        if not engine.ready:
+            logger.error(f"Motor {engine.label} no disponible")
+            delivery.retry(f"Motor {engine.label} no disponible", get_redis_client())
+            return False
+        
+        if engine.defer(delivery):
+            return False
         
         try:
-            logger.info(f"Comenzando análisis nutricional para: {filename}")
-            nutrition_result = query_nutrition_analyzer(image, analyzer, processor)
+            logger.info(f"Comenzando análisis nutricional con {engine.label} para: {filename}")
+            started = time.perf_counter()
+            nutrition_result = engine.infer(delivery)
+            failed = 'error' in nutrition_result
+            engine_health.record(time.perf_counter() - started, ok=not failed)
+            if failed and failover_available(engine):
+                base_queue = priority_queue_name if delivery.priority else queue_name
+                delivery.reroute(engine_queue(base_queue, failover_engine(engine)),
+                                 f"{engine.label} falló: {nutrition_result['error']}", get_redis_client())
+                return False
             logger.info(f"Análisis completado para tarea: {task_id}")
             
-            nutrition_result['task_id'] = task_id
-            nutrition_result['filename'] = filename
-            nutrition_result['status'] = 'completed'
-            nutrition_result['timestamp'] = str(torch.cuda.get_device_name(0) if torch.cuda.is_available() else 'CPU')
-            
-            result = nutrition_result
+            complete_result(delivery, nutrition_result, engine)
             
         except Exception as e:
             logger.error(f"Error en análisis nutricional: {e}")
-            result = {
+            engine_health.record(0, ok=False)
+            delivery.result = {
                 'task_id': task_id,
                 'filename': filename,
                 'error': str(e),
-                'status': 'error'
+                'status': 'error',
+                'terminal': True,
+                'nombre': 'Error al analizar',
+                'calorías': {'value': 0, 'unit': 'kcal', 'description': 'Error en el análisis'},
+                'proteínas': {'value': 0, 'unit': 'g', 'description': 'Error en el análisis'},
+                'carbohidratos': {'value': 0, 'unit': 'g', 'description': 'Error en el análisis'},
+                'grasas': {'value': 0, 'unit': 'g', 'description': 'Error en el análisis'},
             }
-        try:
-            redis_conn = get_redis_client()
-            if redis_conn:
-                redis_conn.setex(
-                    f"analysis:{task_id}", 
-                    3600, 
-                    json.dumps(result)
-                )
-                logger.info(f"Resultado guardado en Redis para tarea: {task_id}")
-            else:
-                logger.error("No se pudo conectar a Redis")
-                ch.basic_nack(delivery_tag=method.delivery_tag, requeue=True)
-                return
-                
-        except Exception as e:
-            logger.error(f"Error guardando en Redis: {e}")
-            ch.basic_nack(delivery_tag=method.delivery_tag, requeue=True)
-            return
-        
-        ch.basic_ack(delivery_tag=method.delivery_tag)
-        logger.info(f"Tarea {task_id} procesada exitosamente")
+    delivery.image_data = None
+    delivery.image = None
+    return True
+
+def complete_result(delivery, nutrition_result, engine):
+    nutrition_result['task_id'] = delivery.task_id
+    nutrition_result['filename'] = delivery.filename
+    # Un fallo del motor no entra en la caché de imágenes ni en el historial. Ya no se
+    # reintenta, así que queda como terminal y el cliente deja de sondear; otra copia de
+    # la tarea (hedging) que termine bien todavía lo sustituye.
+    nutrition_result['status'] = 'error' if 'error' in nutrition_result else 'completed'
+    if nutrition_result['status'] == 'error':
+        nutrition_result['terminal'] = True
+    nutrition_result['timestamp'] = engine.source()
+    usage = nutrition_result.get('usage')
+    if usage is not None:
+        # Agregados por nombre de motor (el de las colas y el enrutado) y prioridad.
+        usage['engine'] = ENGINE_NAME
+        usage['priority'] = delivery.priority
+    delivery.result = nutrition_result
+    delivery.image_data = None
+    delivery.image = None
+
+def infer_batch_tasks(deliveries):
+    with engines.use() as engine:
+        if not engine.ready:
+            raise RuntimeError(f"Motor {engine.label} no disponible")
         
-    except Exception as e:
-        logger.error(f"Error general procesando tarea: {e}")
-        ch.basic_nack(delivery_tag=method.delivery_tag, requeue=False)
+        logger.info(f"Micro-lote de {len(deliveries)} tareas: {[d.task_id for d in deliveries]}")
+        started = time.perf_counter()
+        results = engine.infer_batch(deliveries)
+        engine_health.record(time.perf_counter() - started, count=len(deliveries))
+        for delivery, nutrition_result in zip(deliveries, results):
+            complete_result(delivery, nutrition_result, engine)
+    return [True] * len(deliveries)
 
-def parse_nutrition_with_langchain(raw_text: str) -> NutritionInfo:
+def failover_available(engine) -> bool:
+    failover = failover_engine(engine)
+    if not failover:
+        return False
     try:
-        def extract_value(text: str, keywords: list, default: float = 0) -> float:
-            for keyword in keywords:
-                patterns = [
-                    rf"{keyword}[^:]*:\s*(\d+(?:\.\d+)?)",
-                    rf"{keyword}[^\d]*(\d+(?:\.\d+)?)",
-                    rf"(\d+(?:\.\d+)?)\s*(?:g|kcal|cal)?\s*{keyword}",
-                ]
-                for pattern in patterns:
-                    match = re.search(pattern, text, re.IGNORECASE)
-                    if match:
-                        return float(match.group(1))
-            return default
-        
-        def extract_food_name(text: str) -> str:
-            patterns = [
-                r"[Cc]omida:\s*([^\n\r]+)",
-                r"[Aa]limento:\s*([^\n\r]+)",
-                r"[Tt]ipo:\s*([^\n\r]+)",
-            ]
-            for pattern in patterns:
-                match = re.search(pattern, text)
-                if match:
-                    name = match.group(1).strip()
-                    name = re.sub(r'[.,!?]+$', '', name)
-                    return name
-            
-            lines = text.split('\n')
-            for line in lines:
-                line = line.strip()
-                if line and not any(kw in line.lower() for kw in ['calorías', 'proteínas', 'carbohidratos', 'grasas', 'fibra']):
-                    words = line.split()[:8]
-                    if words:
-                        return " ".join(words)
-            
-            return "Alimento no identificado"
-        
-        nutrition_data = NutritionInfo(
-            comida=extract_food_name(raw_text),
-            calorias=extract_value(raw_text, ['calor', 'kcal', 'cal'], 0),
-            proteinas=extract_value(raw_text, ['prote', 'protein'], 0),
-            carbohidratos=extract_value(raw_text, ['carboh', 'carb', 'hidrat'], 0),
-            grasas=extract_value(raw_text, ['gras', 'fat', 'lip'], 0),
-            fibra=extract_value(raw_text, ['fibra', 'fiber'], 0),
-            confianza=extract_value(raw_text, ['confianza', 'confidence', 'certeza'], 85)
-        )
-        
-        logger.info(f"Datos parseados con Pydantic: {nutrition_data.comida}")
-        logger.info(f"   Calorías: {nutrition_data.calorias}, Proteínas: {nutrition_data.proteinas}g, "
-                   f"Carbohidratos: {nutrition_data.carbohidratos}g, Grasas: {nutrition_data.grasas}g")
-        
-        return nutrition_data
-        
+        return engine_health.workers_alive(failover) > 0
     except Exception as e:
-        logger.error(f"Error parseando con LangChain: {e}")
-        return NutritionInfo(
-            comida="Error al analizar",
-            calorias=0,
-            proteinas=0,
-            carbohidratos=0,
-            grasas=0,
-            fibra=0,
-            confianza=0
-        )
+        logger.warning(f"No se pudo consultar el motor de respaldo {failover}: {e}")
+        return False
 
-def query_nutrition_analyzer(image: Image.Image, analyzer, processor):
-    try:
-        if image.mode != 'RGB':
-            image = image.convert('RGB')
-        
-        model_device = next(analyzer.parameters()).device
-        device_name = "GPU" if model_device.type == 'cuda' else "CPU"
-        logger.info(f"Iniciando análisis LLaVA-Next en {device_name} (device: {model_device})")
-        
-        prompt = """[INST] <image>
-Analiza esta imagen de comida de manera detallada y precisa.
+def persist_tasks(deliveries):
+    # Confirma cada mensaje sólo cuando su resultado es durable (Redis o volcado local).
+    result_writer.write(deliveries)
 
-Identifica todos los alimentos visibles y calcula los valores nutricionales aproximados para la porción total mostrada en la imagen.
+def callback(ch, method, properties, body):
+    pipeline.submit(Delivery(ch, method, properties, body))
 
-Proporciona tu respuesta en este formato exacto:
-Comida: [descripción específica de lo que ves]
-Calorías: [número] kcal
-Proteínas: [número] g
-Carbohidratos: [número] g
-Grasas: [número] g
-Fibra: [número] g
-Confianza: [porcentaje]%
+def publish_engine_status():
+    redis_conn = get_redis_client()
+    if redis_conn is None:
+        return
+    status = engines.current.health()
+    status['swapping'] = engines.swapping
+    redis_conn.hset(f"engine:{ENGINE_NAME}:status", engine_health.worker_id, json.dumps(status))
 
-Sé específico sobre qué alimentos ves y proporciona estimaciones nutricionales realistas basadas en las porciones visibles. [/INST]"""
-        
-        logger.info(f"Imagen para análisis - Tamaño: {image.size}, Modo: {image.mode}")
-        logger.info("Procesando imagen con LLaVA-Next...")
-        
-        if torch.cuda.is_available():
-            torch.cuda.empty_cache()
-        
-        try:
-            inputs = processor(text=prompt, images=image, return_tensors="pt").to(model_device)
-            
-            with torch.no_grad():
-                logger.info(f"Generando respuesta con LLaVA-Next en: {model_device}")
-                
-                output = analyzer.generate(
-                    **inputs,
-                    max_new_tokens=512,
-                    do_sample=True,
-                    temperature=0.2,
-                    pad_token_id=processor.tokenizer.eos_token_id
-                )
-                
-                generated_text = processor.decode(output[0], skip_special_tokens=True)
-                
-                if "[/INST]" in generated_text:
-                    raw_result = generated_text.split("[/INST]")[-1].strip()
-                elif "assistant" in generated_text.lower():
-                    raw_result = generated_text.split("assistant")[-1].strip()
-                else:
-                    raw_result = generated_text.strip()
-                    
-        except RuntimeError as e:
-            if "Expected all tensors to be on the same device" in str(e) or "CUDA out of memory" in str(e):
-                logger.warning(f"Error GPU detectado: {e}")
-                logger.info("Intentando procesar en CPU como fallback...")
-                
-                analyzer_cpu = analyzer.cpu()
-                if torch.cuda.is_available():
-                    torch.cuda.empty_cache()
-                
-                inputs_cpu = processor(text=prompt, images=image, return_tensors="pt").to('cpu')
-                
-                with torch.no_grad():
-                    output = analyzer_cpu.generate(
-                        **inputs_cpu,
-                        max_new_tokens=512,
-                        do_sample=True,
-                        temperature=0.2,
-                        pad_token_id=processor.tokenizer.eos_token_id
-                    )
-                    
-                    generated_text = processor.decode(output[0], skip_special_tokens=True)
-                    
-                    if "[/INST]" in generated_text:
-                        raw_result = generated_text.split("[/INST]")[-1].strip()
-                    elif "assistant" in generated_text.lower():
-                        raw_result = generated_text.split("assistant")[-1].strip()
-                    else:
-                        raw_result = generated_text.strip()
-                
-                if torch.cuda.is_available():
-                    try:
-                        analyzer = analyzer_cpu.cuda()
-                        logger.info("Modelo LLaVA-Next movido de vuelta a GPU")
-                    except:
-                        logger.warning("No se pudo mover LLaVA-Next de vuelta a GPU")
-            else:
-                raise e
-            
-        if torch.cuda.is_available():
-            torch.cuda.empty_cache()
+def publish_profile(seconds, memory):
+    # Corre fuera del hilo de la conexión: el consumo y los heartbeats siguen durante el perfil.
+    try:
+        report = run_profile(seconds, memory, label=f"{ENGINE_NAME}-{engine_health.worker_id.replace(':', '-')}")
+    except Exception as e:
+        logger.error(f"No se pudo perfilar el worker: {e}")
+        report = {'error': str(e)}
+    redis_conn = get_redis_client()
+    if redis_conn is None:
+        return
+    key = f"engine:{ENGINE_NAME}:profiles"
+    pipe = redis_conn.pipeline(transaction=False)
+    pipe.hset(key, engine_health.worker_id, json.dumps(report))
+    pipe.expire(key, PROFILE_RESULT_TTL)
+    pipe.execute()
+    logger.info(f"Perfil publicado en {key}")
 
-        logger.info(f"Análisis LLaVA-Next completado")
-        logger.info(f"Respuesta completa del modelo: {raw_result}")
-        
-        analysis_text = str(raw_result).strip()
-        logger.info(f"Texto para parsing nutricional: {analysis_text}")
-        
-        nutrition_info = parse_nutrition_with_langchain(analysis_text)
-        
-        structured_result = {
-            'nombre': nutrition_info.comida,
-            'alimento': nutrition_info.comida,
-            'food_type': nutrition_info.comida,
-            'calorías': {
-                'value': nutrition_info.calorias,
-                'unit': 'kcal',
-                'description': 'Energía proporcionada por el alimento'
-            },
-            'proteínas': {
-                'value': nutrition_info.proteinas,
-                'unit': 'g',
-                'description': 'Esenciales para el crecimiento y reparación muscular'
-            },
-            'carbohidratos': {
-                'value': nutrition_info.carbohidratos,
-                'unit': 'g',
-                'description': 'Fuente principal de energía'
-            },
-            'grasas': {
-                'value': nutrition_info.grasas,
-                'unit': 'g',
-                'description': 'Importantes para la absorción de vitaminas'
-            },
-            'fibra': {
-                'value': nutrition_info.fibra,
-                'unit': 'g',
-                'description': 'Ayuda a la digestión y salud intestinal'
-            },
-            'confianza': {
-                'value': nutrition_info.confianza,
-                'unit': '%',
-                'description': 'Nivel de confianza del análisis'
-            },
-            'raw_analysis': raw_result,
-            'model': 'LLaVA-Next'
-        }
-        
-        logger.info(f"Análisis Comida: {nutrition_info.comida}, "
-                   f"Calorías: {nutrition_info.calorias}, Proteínas: {nutrition_info.proteinas}g, "
-                   f"Carbohidratos: {nutrition_info.carbohidratos}g, Grasas: {nutrition_info.grasas}g, "
-                   f"Fibra: {nutrition_info.fibra}g, Confianza: {nutrition_info.confianza}%")
-        
-        return structured_result
+def control_callback(ch, method, properties, body):
+    # Mensajes de control en difusión: cada worker decide si le van dirigidos.
+    try:
+        command = json.loads(body.decode('utf-8'))
+        if command.get('engine', ENGINE_NAME) not in (ENGINE_NAME, '*'):
+            return
+        if command.get('worker') not in (None, engine_health.worker_id):
+            return
         
+        action = command.get('action')
+        if action == 'swap':
+            kind = command.get('kind', engines.current.kind)
+            logger.info(f"Orden de cambio de motor recibida: {kind} {command.get('options') or {}}")
+            engines.swap(kind, command.get('options'))
+        elif action == 'status':
+            publish_engine_status()
+        elif action == 'profile':
+            threading.Thread(target=publish_profile, args=(command.get('seconds', 30), bool(command.get('memory'))),
+                             name='profile', daemon=True).start()
+        else:
+            logger.warning(f"Orden de control desconocida: {action}")
     except Exception as e:
-        logger.error(f"Error en query_nutrition_analyzer: {e}")
-        return {
-            'error': str(e),
-            'raw_analysis': 'Error en el análisis',
-            'calories': 0,
-            'proteins': 0,
-            'carbohydrates': 0,
-            'fats': 0,
-            'food_type': 'No identificado'
-        }
+        logger.error(f"Mensaje de control inválido: {e}")
  
-def start_consuming():
-    connection = None
-    channel = None
+def consume_once():
+    redis_conn = get_redis_client()
+    if not redis_conn:
+        raise ConnectionError("No se puede conectar a Redis")
     
-    try:
-        logger.info("Inicializando worker...")
-        
-        redis_conn = get_redis_client()
-        if not redis_conn:
-            logger.error("No se puede conectar a Redis. Deteniendo worker.")
-            return
-        
-        connection = get_rabbitmq_connection()
-        channel = connection.channel()
-        
-        channel.queue_declare(queue=queue_name, durable=True)
-        channel.queue_declare(queue=priority_queue_name, durable=True)
-        channel.basic_qos(prefetch_count=1)
-        
-        channel.basic_consume(
-            queue=priority_queue_name,
-            on_message_callback=callback,
-            auto_ack=False
-        )
+    connection = get_rabbitmq_connection()
+    channel = connection.channel()
+    
+    # Colas propias del motor (enrutadas por el backend) antes que las compartidas.
+    queues = [engine_queue(priority_queue_name, ENGINE_NAME), priority_queue_name,
+              engine_queue(queue_name, ENGINE_NAME), queue_name]
+    for queue in queues:
+        channel.queue_declare(queue=queue, durable=True)
+    failover = failover_engine(engines.current)
+    if failover:
+        channel.queue_declare(queue=engine_queue(priority_queue_name, failover), durable=True)
+        channel.queue_declare(queue=engine_queue(queue_name, failover), durable=True)
+    declare_topology(channel, queues)
+    # Los mensajes que el motor retiene (p. ej. lotes de OpenAI) no ocupan los huecos del pipeline.
+    channel.basic_qos(prefetch_count=PIPELINE_PREFETCH + engines.current.max_deferred, global_qos=True)
+    
+    for queue in queues:
         channel.basic_consume(
-            queue=queue_name,
+            queue=queue,
             on_message_callback=callback,
             auto_ack=False
         )
-        
-        analyzer, processor = setup_analyzer()
-        if analyzer is None or processor is None:
-            logger.error("No se pudo inicializar LLaVA-Next")
-            return
-        
-        logger.info(f"Worker LLaVA-Next iniciado")
-        logger.info(f"  - Consumiendo de cola prioritaria: {priority_queue_name}")
-        logger.info(f"  - Consumiendo de cola normal: {queue_name}")
-        logger.info("Esperando mensajes...")
-        channel.start_consuming()
-            
-    except KeyboardInterrupt:
-        logger.info("Worker detenido por el usuario")
-        if channel:
-            channel.stop_consuming()
-        if connection:
-            connection.close()
+    
+    channel.exchange_declare(exchange=CONTROL_EXCHANGE, exchange_type='fanout', durable=True)
+    control_queue = channel.queue_declare(queue='', exclusive=True).method.queue
+    channel.queue_bind(queue=control_queue, exchange=CONTROL_EXCHANGE)
+    channel.basic_consume(queue=control_queue, on_message_callback=control_callback, auto_ack=True)
+    
+    logger.info(f"Worker {engines.current.label} iniciado (motor {ENGINE_NAME})")
+    for queue in queues:
+        logger.info(f"  - Consumiendo de cola: {queue}")
+    logger.info(f"  - Órdenes de control en: {CONTROL_EXCHANGE}")
+    logger.info("Esperando mensajes...")
+    consume_until_shutdown(connection, channel, pipeline)
+
+def start_consuming():
+    global pipeline, fast_tier, engine_health, engines, result_writer
+    logger.info(f"Inicializando worker (motor {ENGINE_KIND})...")
+    
+    try:
+        engine = start_engine(ENGINE_KIND, get_redis=get_redis_client)
     except Exception as e:
-        logger.error(f"Error en worker: {e}")
-        import time
-        logger.info("Reintentando en 10 segundos...")
-        time.sleep(10)
-        start_consuming()
+        logger.error(f"No se pudo inicializar el motor {ENGINE_KIND}: {e}")
+        return
+    engines = EngineManager(engine, on_swap=publish_engine_status, get_redis=get_redis_client)
+    
+    engine_health = EngineHealth(ENGINE_NAME, get_redis_client)
+    engine_health.start()
+    
+    fast_tier = FastTier(get_redis_client)
+    fast_tier.load()
+    result_writer = ResultWriter(get_redis_client)
+    pipeline = TaskPipeline(
+        decode_task, infer_task, persist_tasks,
+        infer_workers=engine.concurrency,
+        infer_batch=infer_batch_tasks if engine.supports_batch else None,
+        fast_path=fast_tier.resolve if fast_tier.enabled else None,
+        fast_batch_size=FAST_TIER_BATCH_SIZE,
+        on_infer_time=fast_tier.record_escalated if fast_tier.enabled else None,
+        get_redis=get_redis_client
+    )
+    run_supervised(consume_once)
         
 if __name__ == "__main__":
-    start_consuming()
\ No newline at end of file
+    start_consuming()